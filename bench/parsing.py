@@ -0,0 +1,141 @@
+#!/usr/bin/env python3
+"""Check that parsing checker output stays cheap.
+
+mypy in particular can print errors for every file in a project, of which
+pycheckers keeps only those for the file being checked. This feeds
+synthetic mypy and pylint output, and a bandit report, through each
+runner's parsing pipeline (matching, fixups and formatting), and fails if
+parsing the fastest of several runs takes longer than the budget.
+
+Usage: bench/parsing.py [--lines N] [--bandit-findings N] [--budget-ms N] [--runs N]
+"""
+
+from __future__ import absolute_import, division, print_function
+
+import json
+import os
+import sys
+import tempfile
+import time
+from argparse import ArgumentParser
+
+MYPY = False
+if MYPY:
+    from typing import Any, Callable, List, Tuple  # pylint: disable=unused-import
+
+BIN_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'bin')
+sys.path.insert(0, BIN_DIR)
+
+import pycheckers  # noqa: E402  pylint: disable=wrong-import-position
+
+
+def mypy_output(lines, checked_file):
+    # type: (int, str) -> str
+    """Output from a project-wide mypy run: mostly errors in other files,
+    with some notes and unparseable lines mixed in."""
+    out = []
+    for i in range(lines):
+        if i % 10 == 0:
+            out.append('{}:{}: error: Name "x{}" is not defined'.format(checked_file, i, i))
+        elif i % 10 == 1:
+            out.append('{}:{}:5: note: See https://mypy.readthedocs.io'.format(checked_file, i))
+        elif i % 10 == 2:
+            out.append('    def f(self) -> None: ...')
+        else:
+            out.append('pkg/module_{}.py:{}: error: Incompatible types in assignment'.format(
+                i % 500, i))
+    return '\n'.join(out) + '\n'
+
+
+def pylint_output(lines, checked_file):
+    # type: (int, str) -> str
+    """Output from pylint: all about the checked file, with module headers."""
+    out = ['************* Module checked']
+    for i in range(lines - 1):
+        if i % 2:
+            out.append('{}:{}:4: [W0612(unused-variable), f] Unused variable \'v{}\''.format(
+                checked_file, i, i))
+        else:
+            out.append('{}:{}:0: [C0301(line-too-long), ] Line too long (120/100)'.format(
+                checked_file, i))
+    return '\n'.join(out) + '\n'
+
+
+def bandit_output(findings, checked_file):
+    # type: (int, str) -> str
+    """A bandit JSON report, with `findings` issues in the checked file."""
+    severities = ['LOW', 'MEDIUM', 'HIGH']
+    results = [{
+        'code': '{} subprocess.call(cmd, shell=True)\n'.format(i),
+        'col_offset': 4,
+        'end_col_offset': 38,
+        'filename': checked_file,
+        'issue_confidence': severities[(i // 3) % 3],
+        'issue_severity': severities[i % 3],
+        'issue_text': 'subprocess call with shell=True identified, security issue.',
+        'line_number': i + 1,
+        'line_range': [i + 1, i + 2],
+        'more_info': 'https://bandit.readthedocs.io/en/latest/plugins/b602.html',
+        'test_id': 'B602',
+        'test_name': 'subprocess_popen_with_shell_equals_true',
+    } for i in range(findings)]
+    return json.dumps({'errors': [], 'generated_at': '2026-01-01T00:00:00Z',
+                       'metrics': {}, 'results': results}, indent=2)
+
+
+def time_parsing(runner, filepath, output, runs):
+    # type: (Any, str, str, int) -> Tuple[float, int]
+    """Parse `output` several times, and return the fastest time in
+    milliseconds, along with how many diagnostics were kept."""
+    times = []
+    kept = 0
+    for _ in range(runs):
+        st = time.time()
+        results = runner._process_streams(  # pylint: disable=protected-access
+            [filepath], None, False, output, '')
+        times.append((time.time() - st) * 1000)
+        kept = results[filepath][0]
+    return min(times), kept
+
+
+def main():
+    # type: () -> None
+    parser = ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--lines', type=int, default=100000,
+                        help='Number of lines of output per checker')
+    parser.add_argument('--bandit-findings', type=int, default=500,
+                        help='Number of issues in the bandit report')
+    parser.add_argument('--budget-ms', type=float, default=1000,
+                        help='Maximum time to parse each checker\'s output, in milliseconds')
+    parser.add_argument('--runs', type=int, default=5,
+                        help='Number of runs, of which the fastest is used')
+    options = parser.parse_args()
+
+    checked_file = os.path.join(tempfile.mkdtemp(prefix='pycheckers-bench-'), 'checked.py')
+    with open(checked_file, 'w') as f:
+        f.write('')
+
+    cases = [
+        ('mypy3', pycheckers.MyPy3Runner, mypy_output, options.lines, 'lines'),
+        ('pylint', pycheckers.PylintRunner, pylint_output, options.lines, 'lines'),
+        ('bandit', pycheckers.BanditRunner, bandit_output, options.bandit_findings, 'findings'),
+    ]  # type: List[Tuple[str, Any, Callable[[int, str], str], int, str]]
+    failed = False
+    for name, runner_class, make_output, size, unit in cases:
+        # Parse (and format) everything, however much there is
+        runner_options = pycheckers.parse_args(
+            ['-c', name, '--max-diagnostics', '0', checked_file])
+        runner = runner_class((), (), runner_options)
+        output = make_output(size, checked_file)
+        best, kept = time_parsing(runner, checked_file, output, options.runs)
+        print('{}: parsed {} {} ({} kept) in {:.1f}ms, {:.2f}us each (budget {:.1f}ms)'.format(
+            name, size, unit, kept, best, best * 1000 / size, options.budget_ms))
+        if best > options.budget_ms:
+            print('FAIL: {} parsing is over budget'.format(name))
+            failed = True
+
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
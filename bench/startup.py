@@ -0,0 +1,108 @@
+#!/usr/bin/env python3
+"""Check that importing pycheckers.py stays cheap.
+
+pycheckers.py is started for every check flycheck runs, so anything it
+imports up front is paid for on every keystroke-triggered check. This runs
+`python -X importtime` over a fresh interpreter several times, and fails if
+the best cumulative import time exceeds the budget, or if any module that
+should only be imported on demand is imported at startup.
+
+Usage: bench/startup.py [--budget-ms N] [--runs N]
+"""
+
+from __future__ import absolute_import, division, print_function
+
+import os
+import re
+import subprocess
+import sys
+import tempfile
+from argparse import ArgumentParser
+
+MYPY = False
+if MYPY:
+    from typing import Dict, List, Tuple  # pylint: disable=unused-import
+
+BIN_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'bin')
+
+# Modules that are only needed by some runs or some checkers, and so must not
+# be imported when pycheckers.py starts up.
+LAZY_MODULES = [
+    'argparse', 'configparser', 'csv', 'distutils', 'hashlib', 'json',
+    'multiprocessing', 'shlex', 'socket', 'sqlite3', 'subprocess', 'typing',
+]
+
+IMPORTTIME_LINE = re.compile(r'import time:\s+(\d+) \|\s+(\d+) \| (\s*)(\S+)')
+
+
+def measure(pycache_dir):
+    # type: (str) -> Tuple[int, List[str]]
+    """Import pycheckers in a fresh interpreter, and return its cumulative
+    import time in microseconds, along with every module it imported."""
+    env = dict(os.environ, PYTHONPYCACHEPREFIX=pycache_dir)
+    # Bytecode caching is what an installed copy would normally get
+    env.pop('PYTHONDONTWRITEBYTECODE', None)
+    code = 'import sys; sys.path.insert(0, {!r}); import pycheckers'.format(BIN_DIR)
+    process = subprocess.Popen(
+        [sys.executable, '-X', 'importtime', '-c', code],
+        stderr=subprocess.PIPE, universal_newlines=True, env=env)
+    _out, err = process.communicate()
+    if process.returncode:
+        raise RuntimeError('Importing pycheckers failed:\n' + err)
+
+    cumulative = None
+    modules = []
+    pending = []                # type: List[str]
+    # Modules imported by pycheckers are listed, nested, just before it
+    for line in err.splitlines():
+        m = IMPORTTIME_LINE.match(line)
+        if not m:
+            continue
+        name = m.group(4)
+        if name == 'pycheckers':
+            cumulative = int(m.group(2))
+            modules = pending
+            break
+        if not m.group(3):
+            # A top-level import made by the interpreter itself
+            pending = []
+        else:
+            pending.append(name)
+    if cumulative is None:
+        raise RuntimeError('pycheckers not found in -X importtime output')
+    return cumulative, modules
+
+
+def main():
+    # type: () -> None
+    parser = ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--budget-ms', type=float, default=40,
+                        help='Maximum cumulative import time, in milliseconds')
+    parser.add_argument('--runs', type=int, default=5,
+                        help='Number of runs, of which the fastest is used')
+    options = parser.parse_args()
+
+    pycache_dir = tempfile.mkdtemp(prefix='pycheckers-bench-')
+    # The first run compiles and caches bytecode
+    measure(pycache_dir)
+    results = [measure(pycache_dir) for _ in range(options.runs)]
+    best, modules = min(results)
+
+    failed = False
+    print('pycheckers import time: {:.1f}ms (budget {:.1f}ms)'.format(
+        best / 1000.0, options.budget_ms))
+    if best / 1000.0 > options.budget_ms:
+        print('FAIL: import time is over budget')
+        failed = True
+
+    eager = sorted(set(m.split('.')[0] for m in modules) & set(LAZY_MODULES))
+    if eager:
+        print('FAIL: imported at startup, but should be imported on demand: ' +
+              ', '.join(eager))
+        failed = True
+
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
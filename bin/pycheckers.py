@@ -16,38 +16,92 @@ from __future__ import absolute_import, division, print_function
 import os
 import re
 import sys
+import threading
 import time
-from argparse import ArgumentParser, ArgumentTypeError
-from csv import DictReader
-from distutils.version import LooseVersion
+from collections import OrderedDict
 from functools import partial
-import shlex
-from subprocess import PIPE, Popen
-
-# TODO: Ignore the type of conditional imports until
-# https://github.com/python/mypy/issues/1107 is fixed
-try:
-    from StringIO import StringIO  # type: ignore
-except ImportError:
-    from io import StringIO  # type: ignore
-try:
-    from configparser import ConfigParser  # type: ignore
-except ImportError:
-    from ConfigParser import SafeConfigParser as ConfigParser  # type: ignore
-
-try:
+
+# Startup time matters, since we're run on every check: anything not needed
+# by every run is imported where it's used (see bench/startup.py).
+
+MYPY = False
+if MYPY:
     # pylint: disable=unused-import, ungrouped-imports
     from argparse import Namespace
+    from subprocess import Popen
     from typing import (
-        Any, Dict, List, Iterable, Optional, Set, Tuple, Union)
-except ImportError:
-    pass
+        Any, Callable, Dict, List, Iterable, Iterator, Optional, Set, Tuple, Union)
 
 CONFIG_FILE_NAME = '.pycheckers'
 
 # Checkers to run by default, when no --checkers options are supplied.
 default_checkers = 'pylint,mypy2,mypy3'
 
+# Used when no --max-line-length is given, by checkers that don't defer to
+# their own config files.
+DEFAULT_MAX_LINE_LENGTH = 79
+
+# Options that say which files to check, rather than how to check them.
+FILE_SELECTION_OPTIONS = ('file', 'files', 'files_from', 'batch_size', 'file_index')
+
+# When streaming results, printed after each checker's output.
+STREAM_DONE_FORMAT = 'pycheckers-done: {checker} {count}'
+# Printed instead of results when a newer check of the same file took over,
+# along with exiting with SUPERSEDED_STATUS.
+SUPERSEDED_MESSAGE = 'pycheckers-superseded'
+SUPERSEDED_STATUS = 2
+
+# Checkers' output is read, and parsed, this many characters at a time.
+OUTPUT_CHUNK_SIZE = 1 << 16
+# Lines of checker output longer than this are skipped rather than parsed.
+MAX_OUTPUT_LINE_SIZE = 1 << 20
+# How much of a checker's stderr to keep.
+MAX_STDERR_SIZE = 1 << 20
+# Shown instead of mypy's results while its daemon starts up.
+DAEMON_WARMING_UP_MESSAGE = ('The mypy daemon is warming up, checking the whole project in '
+                             'the background. Results will follow once it has.')
+# How many resident mypy builds a server keeps, each holding a whole
+# project's types in memory.
+MAX_RESIDENT_MYPY_BUILDS = 4
+# Beyond this many directories, configs.json forgets the ones whose config
+# files were found longest ago.
+MAX_CACHED_CONFIG_CHAINS = 2000
+
+# Process-wide caches. For a one-shot run these only save repeated work
+# between runners; when running as a server (--serve) they stay warm between
+# requests.
+_version_cache = {}             # type: Dict[str, Optional[str]]
+_discovery_indexes = {}         # type: Dict[Tuple[str, str], DiscoveryIndex]
+_config_chain_cache = {}        # type: Dict[str, Dict[str, Any]]
+_branch_cache = {}              # type: Dict[str, Tuple[Optional[float], Optional[str]]]
+_executable_cache = {}          # type: Dict[Tuple[str, str], Tuple[str, List[Tuple[str, Optional[float]]], Optional[float]]]
+_python_files_cache = {}        # type: Dict[str, Dict[str, List[Any]]]
+_buffer_matchers = {}           # type: Dict[type, Any]
+_ruff_codes_cache = {}          # type: Dict[str, Set[str]]
+# Source files behind astroid's cached modules when running pylint in-process,
+# and their modification times when they were parsed
+_astroid_mtimes = {}            # type: Dict[str, Optional[float]]
+_pylint_lock = threading.Lock()
+# Resident mypy builds, by project root, config file and cache dir, with the
+# most recently used last
+_resident_mypy = OrderedDict()  # type: OrderedDict[Tuple[str, ...], Any]
+_mypy_lock = threading.Lock()
+# Background processes starting mypy daemons, by pid
+_daemon_warm_ups = {}           # type: Dict[int, Popen]
+
+# Set when this process is a long-lived server handling requests from clients
+_serving = False
+
+# Checker processes that are currently running, so they can be cancelled
+# Checker processes that are currently running, so they can be cancelled,
+# each with the function that stops it
+_live_processes = {}            # type: Dict[Popen, Callable[[], None]]
+_live_processes_lock = threading.Lock()
+# Checks of files in progress, which newer checks of the same file may cancel
+_active_registrations = set()   # type: Set[RunRegistration]
+# A server runs one check at a time, since checks change the cwd, environment, etc.
+_request_lock = threading.Lock()
+
 
 class FatalException(Exception):
     def __init__(self, msg, filename):
@@ -100,16 +154,873 @@ def str2bool(v):
         return True
     if is_false(v):
         return False
+    from argparse import ArgumentTypeError
     raise ArgumentTypeError('Boolean value expected.')
 
 
-def croak(msgs, filename):
-    # type: (Tuple[str], str) -> None
+class Version(object):
+    """A version number, for comparing checker versions.
+
+    This replaces distutils' LooseVersion, which is slow to import and no
+    longer available from Python 3.12. Only the leading numeric components are
+    compared, so '0.780+dev.1234' compares equal to '0.780', and trailing
+    zeros are insignificant ('3.6' == '3.6.0').
+    """
+
+    def __init__(self, vstring):
+        # type: (str) -> None
+        self.vstring = vstring
+        m = re.match(r'\d+(\.\d+)*', vstring.strip())
+        release = [int(part) for part in m.group(0).split('.')] if m else []
+        while release and release[-1] == 0:
+            release.pop()
+        self.release = tuple(release)
+
+    @staticmethod
+    def _release(other):
+        # type: (Union[Version, str]) -> Tuple[int, ...]
+        if not isinstance(other, Version):
+            other = Version(other)
+        return other.release
+
+    def __eq__(self, other):
+        # type: (Any) -> bool
+        return self.release == self._release(other)
+
+    def __ne__(self, other):
+        # type: (Any) -> bool
+        return self.release != self._release(other)
+
+    def __lt__(self, other):
+        # type: (Union[Version, str]) -> bool
+        return self.release < self._release(other)
+
+    def __le__(self, other):
+        # type: (Union[Version, str]) -> bool
+        return self.release <= self._release(other)
+
+    def __gt__(self, other):
+        # type: (Union[Version, str]) -> bool
+        return self.release > self._release(other)
+
+    def __ge__(self, other):
+        # type: (Union[Version, str]) -> bool
+        return self.release >= self._release(other)
+
+    def __hash__(self):
+        # type: () -> int
+        return hash(self.release)
+
+    def __str__(self):
+        # type: () -> str
+        return self.vstring
+
+    def __repr__(self):
+        # type: () -> str
+        return 'Version("{}")'.format(self.vstring)
+
+
+def croak(msgs, filename, output_format='text'):
+    # type: (Tuple[str, ...], str, str) -> None
     for m in msgs:
-        print('ERROR :pycheckers:{} at {} line 1.'.format(m.strip(), filename), file=sys.stderr)
+        if output_format == 'jsonl':
+            line = Diagnostic('ERROR', 'pycheckers', m.strip(), filename, 1).to_json()
+        else:
+            line = 'ERROR :pycheckers:{} at {} line 1.'.format(m.strip(), filename)
+        print(line, file=sys.stderr)
     sys.exit(1)
 
 
+class Diagnostic(object):
+    """A single error or warning, as found by a checker.
+
+    Files can have thousands of these, so they're kept small. Their
+    `fields()` are the mapping for LintRunner's `out_fmt` templates.
+    """
+
+    __slots__ = ('level', 'checker', 'message', 'filename', 'line_number', 'column_number',
+                 'end_line_number', 'end_column_number', 'error_type', 'error_number')
+
+    def __init__(self, level, checker, message, filename, line_number, column_number=None,
+                 end_line_number=None, end_column_number=None, error_type='', error_number=''):
+        # type: (str, str, str, str, Any, Any, Any, Any, str, str) -> None
+        self.level = level
+        self.checker = checker
+        self.message = message
+        self.filename = filename
+        self.line_number = line_number
+        self.column_number = column_number
+        self.end_line_number = end_line_number
+        self.end_column_number = end_column_number
+        self.error_type = error_type
+        self.error_number = error_number
+
+    @classmethod
+    def from_data(cls, checker, data):
+        # type: (str, Dict[str, str]) -> Diagnostic
+        """Build a diagnostic from a checker's parsed (and fixed-up) output."""
+        get = data.get
+        return cls(get('level') or '', checker, get('description') or '',
+                   get('filename') or '', get('line_number') or '',
+                   get('column_number'), get('end_line_number'),
+                   get('end_column_number'), get('error_type') or '',
+                   get('error_number') or '')
+
+    def fields(self):
+        # type: () -> Dict[str, Any]
+        """The fields used by LintRunner's `out_fmt` templates."""
+        return {
+            'level': self.level,
+            'error_type': self.error_type,
+            'error_number': self.error_number,
+            # Say which checker found what
+            'description': '%s: %s' % (self.checker, self.message),
+            'filename': self.filename,
+            'line_number': self.line_number,
+            'column_number': self.column_number or '',
+        }
+
+    def to_json(self):
+        # type: () -> str
+        """A compact JSON record of this diagnostic, leaving out anything unknown."""
+        import json
+        record = [
+            ('checker', self.checker),
+            ('level', self.level),
+            ('code', self.error_type + self.error_number),
+            ('file', self.filename),
+            ('line', _int_or_none(self.line_number)),
+            ('column', _int_or_none(self.column_number)),
+            ('end_line', _int_or_none(self.end_line_number)),
+            ('end_column', _int_or_none(self.end_column_number)),
+            ('message', self.message.strip()),
+        ]
+        return json.dumps(dict((k, v) for k, v in record if v not in (None, '')),
+                          separators=(',', ':'), sort_keys=True)
+
+
+def _int_or_none(value):
+    # type: (Any) -> Optional[int]
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def get_cache_dir(cache_dir, *parts):
+    # type: (Optional[str], *str) -> str
+    """Return (creating it if needed) a directory under pycheckers' own cache
+    directory (as given by --cache-dir), for persisting state between runs."""
+    cache_dir = cache_dir or os.path.join(
+        os.environ.get('XDG_CACHE_HOME') or os.path.expanduser('~/.cache'), 'pycheckers')
+    path = os.path.join(os.path.expanduser(cache_dir), *parts)
+    if not os.path.isdir(path):
+        try:
+            os.makedirs(path)
+        except OSError:
+            # Probably created concurrently by another run
+            if not os.path.isdir(path):
+                raise
+    return path
+
+
+def read_json(path):
+    # type: (str) -> Any
+    """Load a JSON cache file, returning None if it is missing or unreadable."""
+    import json
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (IOError, OSError, ValueError):
+        return None
+
+
+def write_json(path, data):
+    # type: (str, Any) -> None
+    """Atomically replace the JSON cache file at `path`, so concurrent runs
+    never see a partially-written file."""
+    import json
+    import tempfile
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix='.tmp-')
+    try:
+        with os.fdopen(fd, 'w') as f:
+            json.dump(data, f, separators=(',', ':'))
+        os.rename(tmp_path, path)
+    except (IOError, OSError):
+        if os.path.exists(tmp_path):
+            os.unlink(tmp_path)
+
+
+def link_tree(src, dst):
+    # type: (str, str) -> None
+    """Copy the directory tree `src` to `dst`, which mustn't exist yet.
+
+    Files are hardlinked, which is only safe for files that are replaced
+    rather than changed in place, as mypy's are. Its SQLite caches are the
+    exception: those are cloned (on filesystems that support it) or copied,
+    leaving out any journal, which would belong to a transaction in progress.
+    """
+    import shutil
+    link = getattr(os, 'link', shutil.copy2)
+    os.makedirs(dst)
+    for dirpath, dirnames, filenames in os.walk(src):
+        target_dir = os.path.normpath(os.path.join(dst, os.path.relpath(dirpath, src)))
+        for dirname in dirnames:
+            os.mkdir(os.path.join(target_dir, dirname))
+        for filename in filenames:
+            source = os.path.join(dirpath, filename)
+            target = os.path.join(target_dir, filename)
+            if filename.endswith(('-journal', '-wal', '-shm')):
+                continue
+            if filename.endswith('.db'):
+                clone_file(source, target)
+                continue
+            try:
+                link(source, target)
+            except OSError:
+                # Another filesystem, say
+                shutil.copy2(source, target)
+
+
+def clone_file(src, dst):
+    # type: (str, str) -> None
+    """Copy `src` to `dst`, sharing its data on disk where the filesystem can
+    (with reflinks on btrfs and XFS, say)."""
+    import shutil
+    if sys.platform.startswith('linux'):
+        import fcntl
+        ficlone = 0x40049409
+        try:
+            with open(src, 'rb') as src_file:
+                with open(dst, 'wb') as dst_file:
+                    fcntl.ioctl(dst_file.fileno(), ficlone, src_file.fileno())
+            shutil.copystat(src, dst)
+            return
+        except (IOError, OSError):
+            pass
+    shutil.copy2(src, dst)
+
+
+class ResultCache(object):
+    """Content-addressed store of checker results, with LRU eviction.
+
+    Each entry is a small JSON file named after its key. Hits bump the file's
+    mtime, and the least-recently used entries are removed once the total size
+    exceeds `max_bytes`.
+    """
+
+    # Scanning the whole directory on every write would be wasteful, so only
+    # check the size limit on a fraction of writes.
+    eviction_probability = 1 / 16.0
+
+    def __init__(self, directory, max_bytes):
+        # type: (str, int) -> None
+        self.directory = directory
+        self.max_bytes = max_bytes
+
+    def _path(self, key):
+        # type: (str) -> str
+        return os.path.join(self.directory, key + '.json')
+
+    def get(self, key):
+        # type: (str) -> Optional[Tuple[int, List[str]]]
+        path = self._path(key)
+        entry = read_json(path)
+        if entry is None:
+            return None
+        try:
+            os.utime(path, None)
+        except OSError:
+            pass
+        errors_or_warnings, out_lines = entry
+        return errors_or_warnings, out_lines
+
+    def put(self, key, errors_or_warnings, out_lines):
+        # type: (str, int, List[str]) -> None
+        import random
+        write_json(self._path(key), [errors_or_warnings, out_lines])
+        if random.random() < self.eviction_probability:
+            self.evict()
+
+    def evict(self):
+        # type: () -> None
+        """Remove least-recently used entries until we're back under the size
+        limit, with some slack so we don't need to do this again right away."""
+        entries = []
+        total = 0
+        for name in os.listdir(self.directory):
+            path = os.path.join(self.directory, name)
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            entries.append((st.st_mtime, st.st_size, path))
+            total += st.st_size
+        if total <= self.max_bytes:
+            return
+        target = self.max_bytes * 0.9
+        for _mtime, size, path in sorted(entries):
+            try:
+                os.unlink(path)
+            except OSError:
+                continue
+            total -= size
+            if total <= target:
+                break
+
+
+def _file_digest(path):
+    # type: (str) -> Optional[str]
+    """Hash a file's contents, returning None if it can't be read."""
+    import hashlib
+    h = hashlib.sha1()
+    try:
+        with open(path, 'rb') as f:
+            for block in iter(partial(f.read, 1 << 16), b''):
+                h.update(block)
+    except (IOError, OSError):
+        return None
+    return h.hexdigest()
+
+
+class FileIndex(object):
+    """The state of each file in a project when it was last checked in batch
+    mode, along with the results, so later runs only re-check files that
+    have changed.
+
+    A file's mtime and size are compared first, and its contents are only
+    hashed if those differ. Entries live in an SQLite database per project,
+    so even very large projects needn't be loaded into memory.
+
+    `batch_digest` summarizes the state of every file in the batch, for
+    checkers whose results for one file depend on others.
+
+    Results name files as they were given, which depends on the directory
+    pycheckers ran from. They're stored naming each file by its absolute
+    path instead, and renamed on the way out.
+    """
+
+    def __init__(self, path, batch_digest):
+        # type: (str, str) -> None
+        import sqlite3
+        self.batch_digest = batch_digest
+        # Checkers for a batch run in threads of their own
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self._db.execute(
+            'CREATE TABLE IF NOT EXISTS results ('
+            ' checker TEXT NOT NULL, path TEXT NOT NULL,'
+            ' mtime REAL, size INTEGER, digest TEXT, fingerprint TEXT,'
+            ' errors_or_warnings INTEGER, out_lines TEXT,'
+            ' PRIMARY KEY (checker, path))')
+        # The state of files when we looked them up, to be stored with their
+        # results -- they may have changed by the time checking finishes
+        self._states = {}           # type: Dict[Tuple[str, str], Tuple[float, int, Optional[str]]]
+
+    def get(self, checker, filepath, fingerprint):
+        # type: (str, str, str) -> Optional[Tuple[int, List[str]]]
+        """Return the results of the last check of `filepath` by `checker`,
+        if neither the file nor the `fingerprint` of its configuration have
+        changed since."""
+        path = os.path.abspath(filepath)
+        try:
+            st = os.stat(path)
+        except OSError:
+            return None
+        with self._lock:
+            row = self._db.execute(
+                'SELECT mtime, size, digest, fingerprint, errors_or_warnings, out_lines'
+                ' FROM results WHERE checker = ? AND path = ?', (checker, path)).fetchone()
+        if row is None or row[3] != fingerprint:
+            result = None       # type: Optional[Tuple[int, List[str]]]
+        else:
+            result = (row[4], _rename_file(row[5].split('\n') if row[5] else [],
+                                           path, filepath))
+            if row[:2] == (st.st_mtime, st.st_size):
+                return result
+
+        digest = _file_digest(path)
+        self._states[(checker, path)] = (st.st_mtime, st.st_size, digest)
+        if result is not None and row[2] == digest:
+            # Touched, but not changed
+            self.put(checker, filepath, fingerprint, result)
+            return result
+        return None
+
+    def put(self, checker, filepath, fingerprint, result):
+        # type: (str, str, str, Tuple[int, List[str]]) -> None
+        path = os.path.abspath(filepath)
+        state = self._states.pop((checker, path), None)
+        if state is None:
+            return
+        errors_or_warnings, out_lines = result
+        out_lines = _rename_file(out_lines, filepath, path)
+        with self._lock:
+            self._db.execute(
+                'INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                (checker, path) + state + (fingerprint, errors_or_warnings, '\n'.join(out_lines)))
+
+    def close(self):
+        # type: () -> None
+        with self._lock:
+            self._db.commit()
+            self._db.close()
+
+
+def _rename_file(out_lines, old_name, new_name):
+    # type: (List[str], str, str) -> List[str]
+    """Rename the file that formatted results (in either --output-format)
+    are about."""
+    if old_name == new_name:
+        return out_lines
+    import json
+    renames = [(' at {} line '.format(old_name), ' at {} line '.format(new_name)),
+               ('"file":' + json.dumps(old_name), '"file":' + json.dumps(new_name))]
+    renamed = []
+    for line in out_lines:
+        for old, new in renames:
+            line = line.replace(old, new)
+        renamed.append(line)
+    return renamed
+
+
+def new_session_kwargs():
+    # type: () -> Dict[str, Any]
+    """Popen arguments to start a child in a new session (and so a new process
+    group). preexec_fn isn't safe to use from threads, so prefer the Python 3
+    way of doing this."""
+    if sys.version_info[0] >= 3:
+        return {'start_new_session': True}
+    return {'preexec_fn': os.setsid}
+
+
+def kill_checker(process):
+    # type: (Popen) -> None
+    """Kill a checker. Checkers stay in our process group, so that whoever
+    kills that (as flycheck does, with SIGKILL) takes them with it."""
+    try:
+        process.kill()
+    except OSError:
+        # Already gone
+        pass
+
+
+def read_pipe(pipe, stop_fd):
+    # type: (Any, int) -> Iterator[str]
+    """Yield the text read from `pipe` as it arrives, until it is closed or
+    `stop_fd` becomes readable.
+
+    A killed checker may have left processes it started holding the pipe
+    open, so waiting for it to close isn't enough."""
+    import codecs
+    import io
+    import select
+    decoder = io.IncrementalNewlineDecoder(
+        codecs.getincrementaldecoder('utf-8')('replace'), translate=True)
+    fd = pipe.fileno()
+    while True:
+        ready, _, _ = select.select([fd, stop_fd], [], [])
+        if stop_fd in ready:
+            return
+        data = os.read(fd, OUTPUT_CHUNK_SIZE)
+        text = decoder.decode(data, final=not data)
+        if text:
+            yield text
+        if not data:
+            return
+
+
+def wait_for_checker(process, timeout, on_output, input_data=None):
+    # type: (Popen, Optional[float], Callable[[str], None], Optional[str]) -> Tuple[bool, str]
+    """Pass a checker's stdout to `on_output` as it arrives, a chunk of whole
+    lines at a time, killing the checker if it runs for longer than `timeout`
+    seconds. Returns whether it timed out, and (the start of) its stderr.
+
+    Any `input_data` is written to the checker's stdin.
+
+    Output is never held in full, so checkers can print as much as they like.
+    While running, the process is registered so that it can be cancelled.
+    Once it is killed, whatever it printed after that is ignored."""
+    timed_out = threading.Event()
+    stop_fd, stop_write_fd = os.pipe()
+
+    def stop():
+        # type: () -> None
+        kill_checker(process)
+        with _live_processes_lock:
+            # Unless it has already finished, and the pipe is closed
+            if process in _live_processes:
+                os.write(stop_write_fd, b'x')
+
+    def on_timeout():
+        # type: () -> None
+        timed_out.set()
+        stop()
+
+    err_chunks = []             # type: List[str]
+    stdin, stdout, stderr = process.stdin, process.stdout, process.stderr
+    assert stdout is not None and stderr is not None  # make mypy happy
+
+    def read_stderr():
+        # type: () -> None
+        size = 0
+        for chunk in read_pipe(stderr, stop_fd):
+            if size < MAX_STDERR_SIZE:
+                err_chunks.append(chunk)
+                size += len(chunk)
+
+    def write_stdin():
+        # type: () -> None
+        assert stdin is not None  # make mypy happy
+        try:
+            stdin.write(input_data)
+            stdin.close()
+        except (IOError, OSError, UnicodeError):
+            # The checker went away without reading it all
+            pass
+
+    timer = None
+    if timeout:
+        timer = threading.Timer(timeout, on_timeout)
+        timer.daemon = True
+        timer.start()
+    with _live_processes_lock:
+        _live_processes[process] = stop
+    try:
+        stderr_reader = threading.Thread(target=read_stderr)
+        stderr_reader.daemon = True
+        stderr_reader.start()
+        if input_data is not None:
+            # Written from another thread, so a checker that prints as it
+            # reads can't fill its stdout pipe while we're still writing
+            stdin_writer = threading.Thread(target=write_stdin)
+            stdin_writer.daemon = True
+            stdin_writer.start()
+
+        pending = ''            # The start of a line, awaiting its end
+        overlong = False        # Whether we're skipping the rest of a line
+        for chunk in read_pipe(stdout, stop_fd):
+            end = chunk.rfind('\n') + 1
+            if not end:
+                if len(pending) + len(chunk) > MAX_OUTPUT_LINE_SIZE:
+                    pending, overlong = '', True
+                elif not overlong:
+                    pending += chunk
+                continue
+            if overlong:
+                on_output(chunk[chunk.index('\n') + 1:end])
+                overlong = False
+            else:
+                on_output(pending + chunk[:end])
+            pending = chunk[end:]
+        if pending and not overlong:
+            on_output(pending)
+
+        stderr_reader.join()
+        process.wait()
+    finally:
+        if timer:
+            timer.cancel()
+        with _live_processes_lock:
+            _live_processes.pop(process, None)
+            os.close(stop_write_fd)
+        os.close(stop_fd)
+        # Don't leave a pipe of ours open in the checker's place
+        stdout.close()
+        stderr.close()
+    return timed_out.is_set(), ''.join(err_chunks)
+
+
+def cancel_running_checkers():
+    # type: () -> None
+    """Kill every checker that is currently running."""
+    with _live_processes_lock:
+        stops = list(_live_processes.values())
+    for stop in stops:
+        stop()
+
+
+class RunRegistration(object):
+    """A claim on checking a file, which a newer check of the same file can
+    take over.
+
+    Flycheck may start a new check of a buffer while older ones are still
+    running, and only the newest result matters. Each file being checked gets
+    a lock file, held by the run currently checking it (and containing its
+    pid), plus a file naming the newest run that wants to check it. A new run
+    records itself as the newest, asks the current holder to give up (with
+    SIGUSR1), and waits for the lock. Once it has the lock, it only goes ahead
+    if nobody newer turned up in the meantime.
+    """
+
+    def __init__(self, filepath, cache_dir):
+        # type: (str, Optional[str]) -> None
+        import hashlib
+        # Flycheck checks a copy of the buffer, named after the original file
+        dir_path, basename = os.path.split(os.path.abspath(filepath))
+        original_filepath = os.path.join(dir_path, basename.replace('flycheck_', ''))
+        key = hashlib.sha1(original_filepath.encode('utf-8')).hexdigest()
+        runs_dir = get_cache_dir(cache_dir, 'runs')
+        self.lock_path = os.path.join(runs_dir, key + '.lock')
+        self.newest_path = os.path.join(runs_dir, key + '.newest')
+        self.token = '{}:{}:{}'.format(os.getpid(), id(self), time.time())
+        # Whether our checkers have been started
+        self.running = False
+        # Whether we were asked to give up
+        self.cancelled = False
+        self._fd = None             # type: Optional[int]
+
+    @property
+    def superseded(self):
+        # type: () -> bool
+        """Whether a newer run wants to check this file."""
+        if self.cancelled:
+            return True
+        # A missing file means the last run to finish cleared it after a newer
+        # run recorded itself, so nobody newer than us is waiting
+        newest = read_json(self.newest_path)
+        return newest is not None and newest != self.token
+
+    def acquire(self):
+        # type: () -> bool
+        """Wait for our turn to check the file, cancelling whoever is checking
+        it now. Returns False if we were superseded while waiting."""
+        import fcntl
+        write_json(self.newest_path, self.token)
+        while True:
+            fd = self._fd = os.open(self.lock_path, os.O_RDWR | os.O_CREAT, 0o600)
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except (IOError, OSError):
+                self._cancel_holder(fd)
+                fcntl.flock(fd, fcntl.LOCK_EX)
+            # The holder removes the lock file when it's done, so the one we
+            # locked may no longer be the one others will open
+            try:
+                if os.fstat(fd).st_ino == os.stat(self.lock_path).st_ino:
+                    break
+            except OSError:
+                pass
+            os.close(fd)
+        if self.superseded:
+            self.release()
+            return False
+        os.ftruncate(fd, 0)
+        os.write(fd, str(os.getpid()).encode('utf-8'))
+        with _live_processes_lock:
+            _active_registrations.add(self)
+        return True
+
+    def release(self):
+        # type: () -> None
+        import fcntl
+        with _live_processes_lock:
+            _active_registrations.discard(self)
+        if self._fd is not None:
+            # Remove the lock file while we still hold it; anyone waiting on
+            # it will notice, and open a new one
+            paths = [self.lock_path]
+            if read_json(self.newest_path) == self.token:
+                paths.append(self.newest_path)
+            for path in paths:
+                try:
+                    os.unlink(path)
+                except OSError:
+                    pass
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+            os.close(self._fd)
+            self._fd = None
+
+    def _cancel_holder(self, fd):
+        # type: (int) -> None
+        import signal
+        os.lseek(fd, 0, os.SEEK_SET)
+        try:
+            pid = int(os.read(fd, 32))
+        except ValueError:
+            # The holder hasn't recorded its pid yet
+            return
+        if pid == os.getpid():
+            # Another request to this server
+            cancel_runs(self.lock_path)
+            return
+        # Only signal processes that really are pycheckers, in case the holder
+        # died without clearing its pid and it has been reused
+        cmdline_path = '/proc/{}/cmdline'.format(pid)
+        if os.path.exists(cmdline_path):
+            with open(cmdline_path, 'rb') as f:
+                if b'pycheckers' not in f.read():
+                    return
+        try:
+            os.kill(pid, signal.SIGUSR1)
+        except OSError:
+            pass
+
+
+def cancel_runs(lock_path=None):
+    # type: (Optional[str]) -> None
+    """Cancel the registered runs of this process that a newer run has
+    superseded (only those for `lock_path`, if given), killing their checkers
+    if they're running."""
+    with _live_processes_lock:
+        registrations = [r for r in _active_registrations
+                         if (lock_path is None or r.lock_path == lock_path)
+                         and r.superseded]
+    for registration in registrations:
+        registration.cancelled = True
+    if any(registration.running for registration in registrations):
+        # Checks run one at a time, so these are its checkers
+        cancel_running_checkers()
+
+
+def iter_checker_results(func, checker_names, multi_thread, in_order):
+    # type: (Any, List[str], bool, bool) -> Iterable[Any]
+    """Call `func` for each checker, yielding the results.
+
+    With `multi_thread`, each checker gets its own thread -- the checkers
+    themselves are subprocesses, so threads only wait on their output. Results
+    are yielded as checkers finish, unless `in_order` is requested.
+    """
+    if not multi_thread:
+        for checker_name in checker_names:
+            yield func(checker_name)
+        return
+
+    try:
+        from queue import Queue
+    except ImportError:
+        from Queue import Queue  # type: ignore
+
+    results = Queue()            # type: Queue
+
+    def worker(i, checker_name):
+        # type: (int, str) -> None
+        try:
+            results.put((i, func(checker_name), None))
+        except BaseException as e:  # pylint: disable=broad-except
+            results.put((i, None, e))
+
+    for i, checker_name in enumerate(checker_names):
+        thread = threading.Thread(target=worker, args=(i, checker_name))
+        thread.daemon = True
+        thread.start()
+
+    finished = {}
+    next_i = 0
+    for _ in checker_names:
+        i, result, exc = results.get()
+        if exc is not None:
+            raise exc
+        if not in_order:
+            yield result
+            continue
+        finished[i] = result
+        while next_i in finished:
+            yield finished.pop(next_i)
+            next_i += 1
+
+
+class OutputParser(object):
+    """Turns a checker's output into results for each file checked, as the
+    output arrives.
+
+    With `demultiplex`, each error is attributed to the file it names --
+    checkers name files relative to the directory they ran in (`cwd`) -- and
+    errors for any other files are dropped. Beyond the runner's
+    --max-diagnostics, errors are only counted, and a summary line says how
+    many weren't shown.
+
+    Output is fed in as it arrives, and each stream (stdout, then stderr) is
+    ended with end_stream(). Runners that print a single report rather than
+    a line per error (`parses_whole_output`) have each stream parsed in one
+    go once it ends.
+    """
+
+    def __init__(self, runner, filepaths, cwd, demultiplex):
+        # type: (LintRunner, List[str], Optional[str], bool) -> None
+        self.runner = runner
+        self.filepaths = filepaths
+        self.demultiplex = demultiplex
+        self.max_diagnostics = runner.options.max_diagnostics
+        # Text that lines about the files checked must contain
+        self.prefilter = runner.output_prefilter(filepaths, demultiplex)
+        self._results = dict((filepath, (0, [])) for filepath in filepaths)  # type: Dict[str, Tuple[int, List[str]]]
+        self._dropped = dict.fromkeys(filepaths, 0)
+        if demultiplex:
+            self._base_dir = cwd or os.getcwd()
+            self._by_abspath = dict((os.path.abspath(f), f) for f in filepaths)
+            basenames = [os.path.basename(f) for f in filepaths]
+            self._by_basename = dict((b, f) for b, f in zip(basenames, filepaths)
+                                     if basenames.count(b) == 1)
+        # Work out anything that depends only on the file once, not per line
+        self._fixups = {}       # type: Dict[str, Callable[[str, Dict[str, str]], Optional[Dict[str, str]]]]
+        self._resolved = {}     # type: Dict[str, Optional[str]]
+        self._pending = []      # type: List[str]
+
+    def feed(self, output):
+        # type: (str) -> None
+        """Parse some whole lines of output."""
+        if self.runner.parses_whole_output:
+            self._pending.append(output)
+        else:
+            self._parse(output)
+
+    def end_stream(self):
+        # type: () -> None
+        """Say that all of the current stream's output has been fed in."""
+        if self._pending:
+            output = ''.join(self._pending)
+            self._pending = []
+            self._parse(output)
+
+    def _parse(self, output):
+        # type: (str) -> None
+        runner = self.runner
+        results = self._results
+        for line, match in runner.iter_matches(output, self.prefilter):
+            filepath = self.filepaths[0]
+            if self.demultiplex:
+                named = match.get('filename') or ''
+                if named in self._resolved:
+                    resolved = self._resolved[named]
+                else:
+                    resolved = self._resolved[named] = (
+                        self._by_abspath.get(
+                            os.path.abspath(os.path.join(self._base_dir, named))) or
+                        self._by_basename.get(os.path.basename(named)))
+                if resolved is None:
+                    continue
+                filepath = resolved
+            fixup = self._fixups.get(filepath)
+            if fixup is None:
+                fixup = self._fixups[filepath] = runner.make_fixup(filepath)
+            # Return None from fixup_data to ignore this error
+            fixed_up = fixup(line, match)
+            if not fixed_up:
+                continue
+            errors_or_warnings, out_lines = results[filepath]
+            if self.max_diagnostics and len(out_lines) >= self.max_diagnostics:
+                self._dropped[filepath] += 1
+            else:
+                diagnostic = Diagnostic.from_data(runner.name, fixed_up)
+                if self.demultiplex:
+                    # Checkers' own names for files may be ambiguous
+                    diagnostic.filename = filepath
+                out_lines.append(runner.format_diagnostic(diagnostic))
+            results[filepath] = (errors_or_warnings + 1, out_lines)
+
+    def results(self):
+        # type: () -> Dict[str, Tuple[int, List[str]]]
+        """The number of errors/warnings found in each file, and the lines to
+        print for them."""
+        for filepath, dropped in self._dropped.items():
+            if dropped:
+                self._results[filepath][1].append(self.runner.format_message(
+                    'INFO', '{} more errors/warnings not shown (see --max-diagnostics)'.format(
+                        dropped), filepath))
+        return self._results
+
+
 class LintRunner(object):
     """Base class provides common functionality to run python code checkers."""
 
@@ -120,10 +1031,6 @@ class LintRunner(object):
         "%(description)s at %(filename)s line %(line_number)s,"
         "%(column_number)s.")
 
-    output_template = dict.fromkeys(
-        ('level', 'error_type', 'error_number', 'description',
-         'filename', 'line_number', 'column_number'), '')
-
     output_matcher = re.compile(r'')
 
     command = ''
@@ -134,8 +1041,17 @@ class LintRunner(object):
 
     version_matcher = re.compile(r'')
 
+    # Whether the checker prints a single report (e.g. a JSON document), which
+    # can only be parsed once all of it has arrived, rather than a line per error
+    parses_whole_output = False
+
+    # Whether results depend only on the file's contents and configuration, and
+    # so may be served from the result cache. Checkers that look into imported
+    # modules can't be cached this way, since those modules may have changed.
+    cacheable = True
+
     def __init__(self, ignore_codes, enable_codes, options):
-        # type: (Tuple[str], Tuple[str], Namespace) -> None
+        # type: (Optional[Iterable[str]], Optional[Iterable[str]], Namespace) -> None
         self._ignore_codes = set(ignore_codes) if ignore_codes is not None else None
         self.enable_codes = set(enable_codes) if enable_codes is not None else None
         self.options = options
@@ -145,9 +1061,11 @@ class LintRunner(object):
         # The root directory of the current project
         self._project_root = None         # type: Optional[str]
         # The version of the checker, if available
-        self._version = None              # type: Optional[LooseVersion]
+        self._version = None              # type: Optional[Version]
         # Any debugging output
         self._debug_lines = []            # type: List[str]
+        # See config_fingerprint()
+        self._config_fingerprints = {}    # type: Dict[bool, str]
 
     @property
     def ignore_codes(self):
@@ -222,15 +1140,59 @@ class LintRunner(object):
         """
         return self.command
 
+    @property
+    def max_line_length(self):
+        # type: () -> int
+        """The maximum line length, as given by --max-line-length or a config
+        file, or the default."""
+        return int(self.options.max_line_length or DEFAULT_MAX_LINE_LENGTH)
+
+    @property
+    def executable(self):
+        # type: () -> str
+        """The full path to the checker's executable, if it can be found."""
+        return find_executable(self.command) or self.command
+
     @property
     def version(self):
-        # type: () -> LooseVersion
+        # type: () -> Version
         """The version of the current checker."""
         if not self._version:
-            self._version = LooseVersion(self._get_version() or '0')
+            self._version = Version(self._get_cached_version() or '0')
             assert self._version  # make mypy happy
         return self._version
 
+    def _get_cached_version(self):
+        # type: () -> Optional[str]
+        """Look up the checker's version in the on-disk version cache, only
+        running the checker to find out if the executable has changed since we
+        last asked."""
+        executable = find_executable(self.command)
+        if not executable:
+            return self._get_version()
+        key = version_cache_key(executable, self.version_args)
+        if key not in _version_cache:
+            versions_path = os.path.join(get_cache_dir(self.options.cache_dir), 'versions.json')
+            versions = read_json(versions_path) or {}
+            entry = versions.get(key)
+            if entry:
+                _version_cache[key] = entry['version']
+            else:
+                # Cache the result even if no version could be parsed, so
+                # checkers that don't report one aren't probed every time.
+                version = self._get_version()
+                _version_cache[key] = version
+                real_path = os.path.realpath(executable)
+                # Re-read, in case other checkers stored their versions while
+                # we were probing, and forget about older installs of the same
+                # executable
+                versions = dict((k, v) for k, v in (read_json(versions_path) or {}).items()
+                                if v.get('real_path') != real_path)
+                versions[key] = {'command': self.command, 'path': executable,
+                                 'real_path': real_path, 'version': version}
+                write_json(versions_path, versions)
+        return _version_cache[key]
+
     def get_run_flags(self, _filepath):
         # type: (str) -> Iterable[str]
         """Called to build up the list of command-line arguments to pass to the checker."""
@@ -261,22 +1223,9 @@ class LintRunner(object):
         # type: (str, str) -> str
         """Find the root directory of the current project.
 
-        1. Find a virtualenv that matches a part of the directory, and choose that.
-        2. Failing that, walk up the directory tree looking for a VCS directory.
-        3. Otherwise, just use the local directory.
-        """
-        # Case 1
-        project_dir, _venv_path = guess_virtualenv(source_file, venv_root)
-        if project_dir:
-            return project_dir
-
-        # Case 2
-        vcs_root, _vcs_name = find_vcs_root(source_file)
-        if vcs_root:
-            return vcs_root
-
-        # Case 3
-        return os.path.dirname(source_file)
+        See DiscoveryIndex.lookup() for how this is determined."""
+        index = discovery_index(self.options.cache_dir, venv_root)
+        return index.lookup(os.path.dirname(os.path.abspath(source_file)))['project_root']
 
     def find_file_in_project_root(self, filename):
         # type: (str) -> Optional[AbsPath]
@@ -313,6 +1262,57 @@ class LintRunner(object):
                     break
         return config_file
 
+    def cache_key_files(self):
+        # type: () -> List[str]
+        """Files whose contents affect this checker's results, beyond the file
+        being checked. By default, any config files given in the options."""
+        return [value for key, value in sorted(vars(self.options).items())
+                if ('config_file' in key or 'rcfile' in key) and value]
+
+    def config_fingerprint(self, demultiplex=False):
+        # type: (bool) -> str
+        """Hash everything besides the file being checked that can influence
+        the output of checking it.
+
+        Batch mode (`demultiplex`) formats results differently, so they're
+        cached separately."""
+        if demultiplex not in self._config_fingerprints:
+            import hashlib
+            h = hashlib.sha1()
+
+            def add(value):
+                # type: (Any) -> None
+                h.update(repr(value).encode('utf-8'))
+                h.update(b'\0')
+
+            add((self.name, str(self.version), demultiplex))
+            add(sorted(self.ignore_codes) if self.ignore_codes is not None else None)
+            add(sorted(self.enable_codes or ()))
+            add(sorted((k, v) for k, v in vars(self.options).items()
+                       if k not in FILE_SELECTION_OPTIONS))
+            add(os.environ.get('PATH'))
+            for path in self.cache_key_files():
+                add(path)
+                add(_file_digest(path))
+            self._config_fingerprints[demultiplex] = h.hexdigest()
+        return self._config_fingerprints[demultiplex]
+
+    def result_cache_key(self, filepath, demultiplex=False):
+        # type: (str, bool) -> str
+        """Hash everything that can influence the output of checking `filepath`."""
+        import hashlib
+        key = '\0'.join([self.config_fingerprint(demultiplex), os.path.abspath(filepath),
+                         _file_digest(filepath) or ''])
+        return hashlib.sha1(key.encode('utf-8')).hexdigest()
+
+    def _result_cache(self):
+        # type: () -> Optional[ResultCache]
+        if (not self.cacheable or not self.options.result_cache or self.options.debug
+                or self._user_command_line_option()):
+            return None
+        return ResultCache(get_cache_dir(self.options.cache_dir, 'results'),
+                           self.options.result_cache_size * 1024 * 1024)
+
     def user_defined_command_line(self, filepath):
         # type: (str) -> Optional[List[str]]
         """Allow users to define their own command-lines for checkers.
@@ -322,6 +1322,7 @@ class LintRunner(object):
         """
         user_command_line_option = self._user_command_line_option()
         if user_command_line_option:
+            import shlex
             parts = shlex.split(user_command_line_option)  # type: Optional[List[str]]
         else:
             parts = None
@@ -350,8 +1351,8 @@ class LintRunner(object):
         if args:
             return args
 
-        # `env` to use a virtualenv, if found
-        args = ['/usr/bin/env', self.command]
+        # Run the executable found on PATH, which has any virtualenv first
+        args = [self.executable]
         # Get checker arguments
         args.extend(self.get_run_flags(filepath))
         # Get a checker-specific filename, if necessary
@@ -360,12 +1361,30 @@ class LintRunner(object):
             args.append(checker_filepath)
         return args
 
+    def construct_batch_args(self, filepaths):
+        # type: (List[str]) -> List[str]
+        """Construct the argument list for checking several files with one run
+        of the checker. The flags are those for the first file."""
+        args = [self.executable]
+        args.extend(self.get_run_flags(filepaths[0]))
+        for filepath in filepaths:
+            checker_filepath = self.get_filepath(filepath)
+            if checker_filepath is not None:
+                args.append(checker_filepath)
+        return args
+
+    def get_stdin(self, _filepath):
+        # type: (str) -> Optional[str]
+        """The input to give the checker when checking a single file, for
+        checkers that read the file from stdin. By default, nothing."""
+        return None
+
     def construct_version_args(self):
         # type: () -> List[str]
         """Construct the argument list for finding the parser's version, suitable for passing to Popen."""
 
-        # `env` to use a virtualenv, if found
-        args = ['/usr/bin/env', self.command]
+        # Run the executable found on PATH, which has any virtualenv first
+        args = [self.executable]
         # Get checker arguments
         args.extend(self.version_args)
         return args
@@ -380,43 +1399,116 @@ class LintRunner(object):
         m = self.output_matcher.match(line)
         return m.groupdict() if m else None
 
+    def _buffer_matcher(self):
+        # type: () -> Any
+        """The output matcher, compiled to match each line of a whole buffer."""
+        cls = type(self)
+        matcher = _buffer_matchers.get(cls)
+        if matcher is None:
+            matcher = _buffer_matchers[cls] = re.compile(
+                '^(?:{})'.format(self.output_matcher.pattern),
+                self.output_matcher.flags | re.MULTILINE)
+        return matcher
+
+    def output_prefilter(self, _filepaths, _demultiplex):
+        # type: (List[str], bool) -> Optional[str]
+        """Text that every line of output about the files being checked is
+        sure to contain, if any. Other lines are skipped without parsing."""
+        return None
+
+    def iter_matches(self, output, prefilter=None):
+        # type: (str, Optional[str]) -> Iterator[Tuple[str, Dict[str, str]]]
+        """Yield each line of `output` that the matcher recognizes, along with
+        the fields extracted from it.
+
+        Regex matchers scan the whole buffer in one go, so lines that don't
+        match are skipped without ever being split out. Given a `prefilter`,
+        only lines containing it are matched at all."""
+        if callable(self.output_matcher):
+            for line in output.splitlines():
+                if prefilter is not None and prefilter not in line:
+                    continue
+                data = self.process_output(line)
+                if data:
+                    yield line, data
+            return
+        if prefilter is None:
+            for m in self._buffer_matcher().finditer(output):
+                yield m.group(0), m.groupdict()
+            return
+        matcher = self.output_matcher
+        pos = output.find(prefilter)
+        while pos != -1:
+            start = output.rfind('\n', 0, pos) + 1
+            end = output.find('\n', pos)
+            if end == -1:
+                end = len(output)
+            m = matcher.match(output, start, end)
+            if m:
+                yield m.group(0), m.groupdict()
+            pos = output.find(prefilter, end)
+
     def fixup_data(self, _line, data, _filepath):
-        # type: (str, Dict[str, str], str) -> Dict[str, str]
-        """Called to perform any optional cleanups of the parsed data."""
+        # type: (str, Dict[str, str], str) -> Optional[Dict[str, str]]
+        """Called to perform any optional cleanups of the parsed data. Return
+        None to ignore the line."""
         return data
 
+    def make_fixup(self, filepath):
+        # type: (str) -> Callable[[str, Dict[str, str]], Optional[Dict[str, str]]]
+        """Return the function that cleans up the parsed data of each line
+        about `filepath`. Runners can override this to work out whatever only
+        depends on the file once, rather than for every line."""
+        return lambda line, data: self.fixup_data(line, data, filepath)
+
     def process_returncode(self, returncode):
         # type: (int) -> bool
         """Return True if the checker's returncode indicates successful check, False otherwise"""
         return returncode == 0
 
-    def _process_streams(self, filepath, *streams):
-        # type: (str, *List[str]) -> Tuple[int, List[str]]
-        """This runs over both stdout and stderr, counting errors/warnings."""
+    def indicates_crash(self, returncode):
+        # type: (int) -> bool
+        """Return True if the checker's returncode means it failed to check at
+        all, rather than that it found something. Most checkers exit with 1
+        when they find something."""
+        return returncode not in (0, 1)
+
+    def _process_streams(self, filepaths, cwd, demultiplex, *streams):
+        # type: (List[str], Optional[str], bool, *str) -> Dict[str, Tuple[int, List[str]]]
+        """This runs over both stdout and stderr (each as a single string),
+        counting errors/warnings. See OutputParser."""
         if not streams:
             raise ValueError('No streams passed to _process_streams')
-        errors_or_warnings = 0
-        out_lines = []
+        parser = OutputParser(self, filepaths, cwd, demultiplex)
         for stream in streams:
-            for line in stream:
-                match = self.process_output(line)
-                if match:
-                    tokens = dict(self.output_template)
-                    # Return None from fixup_data to ignore this error
-                    fixed_up = self.fixup_data(line, match, filepath)
-                    if fixed_up:
-                        # Prepend the command name to the description (if
-                        # present) so we know which checker threw which error
-                        if 'description' in fixed_up:
-                            fixed_up['description'] = '%s: %s' % (
-                                self.name, fixed_up['description'])
-                        tokens.update(fixed_up)
-                        template = (
-                            self.out_fmt_w_col if fixed_up.get('column_number')
-                            else self.out_fmt)
-                        out_lines.append(template % tokens)
-                        errors_or_warnings += 1
-        return errors_or_warnings, out_lines
+            parser.feed(stream)
+            parser.end_stream()
+        return parser.results()
+
+    def format_diagnostic(self, diagnostic):
+        # type: (Diagnostic) -> str
+        """Format a diagnostic for output, in the requested --output-format."""
+        if self.options.output_format == 'jsonl':
+            return diagnostic.to_json()
+        template = self.out_fmt_w_col if diagnostic.column_number else self.out_fmt
+        return template % diagnostic.fields()
+
+    def format_message(self, level, message, filepath, checker=None):
+        # type: (str, str, str, Optional[str]) -> str
+        """Format a message about running the checker (rather than about the
+        code being checked), shown at the top of the file."""
+        checker = checker or self.command
+        if self.options.output_format == 'jsonl':
+            return Diagnostic(level, checker, message, filepath, 1).to_json()
+        return '{} : {}:{} at {} line 1.'.format(level, checker, message, filepath)
+
+    def _format_exception(self, e, filepath):
+        # type: (Exception, str) -> str
+        if self.options.output_format != 'jsonl':
+            return str(e)
+        if isinstance(e, FatalException):
+            return self.format_message('ERROR', e.msg, e.filename, 'pycheckers')
+        return self.format_message('ERROR', str(e), filepath, 'pycheckers')
 
     def _user_command_line_option(self):
         # type: () -> str
@@ -431,17 +1523,7 @@ class LintRunner(object):
         if user_cmd_line:
             return True
 
-        # https://stackoverflow.com/a/6569511/52550
-        args = ['/usr/bin/env', 'which', self.command]
-
-        try:
-            process = Popen(args, stdout=PIPE, stderr=PIPE)
-        except Exception as e:                   # pylint: disable=broad-except
-            print(e)
-            return False
-        exec_path, _err = process.communicate()
-
-        return bool(exec_path) and process.returncode == 0
+        return find_executable(self.command) is not None
 
     def run(self, filepath):
         # type: (str) -> Tuple[int, List[str]]
@@ -451,67 +1533,177 @@ class LintRunner(object):
         and returns a tuple containing the count of error/warning lines,
         and a list of said lines.
         """
-        st = time.time()
+        return self.run_batch([filepath], demultiplex=False)[filepath]
+
+    def run_batch(self, filepaths, demultiplex=True, file_index=None):
+        # type: (List[str], bool, Optional[FileIndex]) -> Dict[str, Tuple[int, List[str]]]
+        """Like run(), but check several files with a single run of the
+        checker, returning the results for each file.
+
+        Files whose results are in the result cache (or in `file_index`, if
+        given) aren't checked again. All the files should share the same
+        options and project root. Without `demultiplex`, there must be a
+        single file, and all output is taken to be about it.
+        """
         if not self._executable_exists():
             # Return a parseable error message so the normal parsing mechanism
             # can display it
-            return 1, [
-                ('ERROR : {}:Checker not found on PATH, '
-                 'unable to check at {} line 1.'.format(
-                     self.command, filepath))]
+            return dict((filepath, (1, [self.format_message(
+                'ERROR', 'Checker not found on PATH, unable to check', filepath)]))
+                        for filepath in filepaths)
+
+        if demultiplex and self._user_command_line_option():
+            # User command lines only know how to check a single file (%f)
+            results = {}
+            for filepath in filepaths:
+                runner = self.__class__(self._ignore_codes, self.enable_codes, self.options)
+                results[filepath] = runner.run(filepath)
+            return results
 
         # Save the path to the file being checked so we don't have to pass it everywhere.
         # TODO: This means we're carrying state around, double-check that we're ok with this.
-        self._filepath = filepath
+        self._filepath = filepaths[0]
+
+        results = {}
+        fingerprint = None          # type: Optional[str]
+        if file_index is not None:
+            try:
+                fingerprint = self.config_fingerprint(demultiplex)
+            except FatalException:
+                # Let the normal path report this
+                file_index = None
+            else:
+                if not self.cacheable:
+                    # Results may depend on any of the other files being checked
+                    fingerprint += file_index.batch_digest
+                for filepath in filepaths:
+                    cached = file_index.get(self.name, filepath, fingerprint)
+                    if cached is not None:
+                        results[filepath] = cached
+
+        result_cache = self._result_cache() if file_index is None else None
+        cache_keys = {}             # type: Dict[str, str]
+        for filepath in filepaths:
+            if not result_cache:
+                break
+            try:
+                cache_keys[filepath] = self.result_cache_key(filepath, demultiplex)
+            except FatalException:
+                # Let the normal path report this
+                continue
+            cached = result_cache.get(cache_keys[filepath])
+            if cached is not None:
+                results[filepath] = cached
+
+        unchecked = [filepath for filepath in filepaths if filepath not in results]
+        if unchecked:
+            checked, completed = self._check(unchecked, demultiplex)
+            results.update(checked)
+            for filepath, result in (checked.items() if completed else ()):
+                if file_index is not None and fingerprint is not None:
+                    file_index.put(self.name, filepath, fingerprint, result)
+                elif result_cache and filepath in cache_keys:
+                    result_cache.put(cache_keys[filepath], *result)
+        return results
+
+    def _check(self, filepaths, demultiplex):
+        # type: (List[str], bool) -> Tuple[Dict[str, Tuple[int, List[str]]], bool]
+        """Run the checker over `filepaths`, and parse its output. Returns the
+        results, and whether the checker ran to completion (rather than timing
+        out, crashing or being killed), so that they're worth caching."""
+        st = time.time()
+
+        def for_each_file(level, message):
+            # type: (str, str) -> Dict[str, Tuple[int, List[str]]]
+            return dict((filepath, (1, [self.format_message(level, message, filepath)]))
+                        for filepath in filepaths)
 
-        # The command may want to run from the project root instead of wherever we are now.
-        old_cwd = None  # type: Optional[str]
+        # The command may want to run from the project root instead of wherever
+        # we are now. Pass this to Popen rather than chdir-ing, since several
+        # checkers may be running in threads of the same process.
+        cwd = None  # type: Optional[str]
         if self.runs_from_project_root:
-            old_cwd = os.getcwd()
-            os.chdir(self.find_project_root(filepath))
+            cwd = self.find_project_root(filepaths[0])
 
+        input_data = None   # type: Optional[str]
         try:
-            args = self.construct_args(filepath)
+            if demultiplex:
+                args = self.construct_batch_args(filepaths)
+            else:
+                args = self.construct_args(filepaths[0])
+                input_data = self.get_stdin(filepaths[0])
         except Exception as e:
-            print(e)
-            return 1, [str(e)]
+            print(self._format_exception(e, filepaths[0]), file=sys.stderr)
+            return dict((filepath, (1, [self._format_exception(e, filepath)]))
+                        for filepath in filepaths), False
+        # Parse stdout as it arrives, rather than holding all of it
+        parser = OutputParser(self, filepaths, cwd, demultiplex)
         try:
             self.debug('{} command: {}'.format(self.name, ' '.join(args)))
-            process = Popen(
-                args, stdout=PIPE, stderr=PIPE, universal_newlines=True,
-                env=dict(os.environ, **self.get_env_vars()))
+            timed_out, err, returncode = self.run_checker(args, cwd, input_data, parser.feed)
         except Exception as e:                   # pylint: disable=broad-except
-            print(e, args)
-            return 1, [str(e)]
-
-        if old_cwd is not None:
-            os.chdir(old_cwd)
-
-        out, err = process.communicate()
-        process.wait()
-        errors_or_warnings, out_lines = self._process_streams(
-            filepath, out.splitlines(), err.splitlines())
-
-        if not self.process_returncode(process.returncode):
-            errors_or_warnings += 1
-            out_lines += [
-                ('WARNING : {}:Checker indicated failure of some kind at {} line 1.'.format(
-                    self.command, filepath))]
-            if self.options.report_checker_errors_inline:
-                for line in err.splitlines():
-                    out_lines += ['WARNING : {}:{} at {} line 1.'.format(
-                        self.command, line, filepath)]
+            print(e, args, file=sys.stderr)
+            return dict((filepath, (1, [self._format_exception(e, filepath)]))
+                        for filepath in filepaths), False
+        if timed_out:
+            return for_each_file(
+                'WARNING', 'Checker timed out after {} seconds'.format(
+                    self.options.checker_timeout)), False
+        parser.end_stream()
+        parser.feed(err)
+        parser.end_stream()
+        results = parser.results()
+
+        # Most checkers fail whenever they find something, so when checking
+        # several files only complain if the checker itself broke, since any
+        # one of them may have caused it
+        if demultiplex:
+            failed = self.indicates_crash(returncode)
+        else:
+            failed = not self.process_returncode(returncode)
+        if failed:
+            for filepath in filepaths:
+                errors_or_warnings, out_lines = results[filepath]
+                errors_or_warnings += 1
+                out_lines += [self.format_message(
+                    'WARNING', 'Checker indicated failure of some kind', filepath)]
+                if self.options.report_checker_errors_inline:
+                    for line in err.splitlines():
+                        out_lines += [self.format_message('WARNING', line, filepath)]
+                results[filepath] = (errors_or_warnings, out_lines)
 
         et = time.time()
         self.debug('Start: %.2fs  end: %.2fs  duration: %.2fs' % (st, et, (et-st)))
 
         if self.options.debug:
             debug_output = self._get_debug_output()
+            errors_or_warnings, out_lines = results[filepaths[0]]
             errors_or_warnings += len(debug_output)
-            out_lines += ['INFO : {}:{} at {} line 1.'.format(
-                self.command, line, filepath) for line in debug_output]
-
-        return errors_or_warnings, out_lines
+            out_lines += [self.format_message('INFO', line, filepaths[0])
+                          for line in debug_output]
+            results[filepaths[0]] = (errors_or_warnings, out_lines)
+
+        return results, not self.indicates_crash(returncode)
+
+    def run_checker(self, args, cwd, input_data, on_output):
+        # type: (List[str], Optional[str], Optional[str], Callable[[str], None]) -> Tuple[bool, str, int]
+        """Run the checker with `args`, passing its stdout to `on_output` as
+        it arrives. Returns whether it timed out, its stderr, and its exit
+        status."""
+        from subprocess import PIPE, Popen
+        process = Popen(
+            args, stdin=PIPE if input_data is not None else None,
+            stdout=PIPE, stderr=PIPE, universal_newlines=True, cwd=cwd,
+            env=dict(os.environ, **self.get_env_vars()))
+        timed_out, err = wait_for_checker(
+            process, self.options.checker_timeout, on_output, input_data)
+        return timed_out, err, process.returncode
+
+    def installed_for_this_python(self):
+        # type: () -> bool
+        """Whether the checker found is installed for the Python running
+        pycheckers, so that it can be imported rather than run."""
+        return os.path.dirname(self.executable) == os.path.dirname(sys.executable)
 
     def debug(self, line):
         # type: (str) -> None
@@ -527,6 +1719,7 @@ class LintRunner(object):
         """Run the command with a '-V' flag or similar, parse the output, and
         return a version number as a string.
         """
+        from subprocess import PIPE, Popen
         args = self.construct_version_args()
         try:
             process = Popen(
@@ -557,8 +1750,8 @@ class PyflakesRunner(LintRunner):
     command = 'pyflakes'
 
     output_matcher = re.compile(
-        r'(?P<filename>[^:]+):'
-        r'(?P<line_number>[^:]+):'
+        r'(?P<filename>[^:\n]+):'
+        r'(?P<line_number>[^:\n]+):'
         r'(?P<description>.+)$')
 
     @classmethod
@@ -589,10 +1782,10 @@ class Flake8Runner(LintRunner):
     command = 'flake8'
 
     output_matcher = re.compile(
-        r'(?P<filename>[^:]+):'
-        '(?P<line_number>[^:]+):'
-        '(?P<column_number>[^:]+): '
-        '(?P<error_type>[A-Z])(?P<error_number>[^ ]+) '
+        r'(?P<filename>[^:\n]+):'
+        r'(?P<line_number>[^:\n]+):'
+        r'(?P<column_number>[^:\n]+): '
+        r'(?P<error_type>[A-Z])(?P<error_number>[^ \n]+) '
         '(?P<description>.+)$')
 
     version_matcher = re.compile(
@@ -626,11 +1819,21 @@ class Flake8Runner(LintRunner):
 
         return data
 
+    def _find_flake8_config_file(self):
+        # type: () -> Optional[str]
+        return self.find_config_file(
+            'flake8_config_file', ['setup.cfg', 'tox.ini', '.flake8'])
+
+    def cache_key_files(self):
+        # type: () -> List[str]
+        config_file = self._find_flake8_config_file()
+        return [config_file] if config_file else []
+
     def get_run_flags(self, _filepath):
         # type: (str) -> Iterable[str]
         args = []
         if self.ignore_codes is not None:
-            if self.version >= LooseVersion('3.6.0'):
+            if self.version >= Version('3.6.0'):
                 # This only works with flake8 3.6.0+, and *extends*
                 # the values given by a config file.
                 args.append('--extend-ignore=' + ','.join(self.ignore_codes))
@@ -640,15 +1843,14 @@ class Flake8Runner(LintRunner):
                 # nothing (i.e. `--ignore=`, meaning ignore nothing)
                 args.append('--ignore=' + ','.join(self.ignore_codes))
 
-        config_file = self.find_config_file(
-            'flake8_config_file', ['setup.cfg', 'tox.ini', '.flake8'])
+        config_file = self._find_flake8_config_file()
         if config_file:
             args += ['--config', config_file]
 
         args += [
             # TODO: --select, but additive
             # '-select=' + ','.join(self.enable_codes),
-            '--max-line-length', str(self.options.max_line_length),
+            '--max-line-length', str(self.max_line_length),
         ]
         return args
 
@@ -666,10 +1868,17 @@ class Pep8Runner(LintRunner):
 
     command = 'pep8'
 
+    def cache_key_files(self):
+        # type: () -> List[str]
+        # pep8 picks up project config files by itself
+        config_files = [self.find_file_in_project_root(name)
+                        for name in ('setup.cfg', 'tox.ini', '.pep8')]
+        return [str(f) for f in config_files if f]
+
     output_matcher = re.compile(
-        r'(?P<filename>[^:]+):'
-        r'(?P<line_number>[^:]+):'
-        r'(?P<column_number>[^:]+):'
+        r'(?P<filename>[^:\n]+):'
+        r'(?P<line_number>[^:\n]+):'
+        r'(?P<column_number>[^:\n]+):'
         r' (?P<error_number>\w+) '
         r'(?P<description>.+)$')
 
@@ -688,7 +1897,7 @@ class Pep8Runner(LintRunner):
             '--repeat',
             # TODO: make this additive, not a replacement
             # '--select=' + ','.join(self.enable_codes),
-            '--max-line-length', str(self.options.max_line_length),
+            '--max-line-length', str(self.max_line_length),
         ]
         return args
 
@@ -704,19 +1913,21 @@ class PylintRunner(LintRunner):
 
     command = 'pylint'
 
+    cacheable = False
+
     output_matcher = re.compile(
-        r'(?P<filename>[^:]+):'
+        r'(?P<filename>[^:\n]+):'
         r'(?P<line_number>\d+):'
         r'(?P<column_number>\d+):'
-        r'\s*\[(?P<error_type>[WECR])(?P<error_number>[^(,\]]+)'
-        r'\((?P<symbol>[^)]*)\)'
-        r'\s*(?P<context>[^\]]*)\]'
-        r'\s*(?P<description>.*)$')
+        r'[ \t]*\[(?P<error_type>[WECRF])(?P<error_number>[^(,\]\n]+)'
+        r'\((?P<symbol>[^)\n]*)\)'
+        r'[ \t]*(?P<context>[^\]\n]*)\]'
+        r'[ \t]*(?P<description>.*)$')
 
     @classmethod
     def fixup_data(cls, _line, data, _filepath):
         # type: (str, Dict[str, str], str) -> Dict[str, str]
-        if data['error_type'].startswith('E'):
+        if data['error_type'] in ('E', 'F'):
             data['level'] = 'ERROR'
         else:
             data['level'] = 'WARNING'
@@ -739,9 +1950,9 @@ class PylintRunner(LintRunner):
                                '[{msg_id}({symbol})] {msg}'),
             '--reports', 'n',
             # This is additive, not replacing
-            '--enable=' + ','.join(self.enable_codes),
+            '--enable=' + ','.join(self.enable_codes or ()),
             '--dummy-variables-rgx=' + '_.*',
-            '--max-line-length', str(self.options.max_line_length),
+            '--max-line-length', str(self.max_line_length),
         ]
         if self.options.pylint_rcfile:
             args.extend(['--rcfile', self.options.pylint_rcfile])
@@ -759,9 +1970,158 @@ class PylintRunner(LintRunner):
         # https://docs.pylint.org/en/1.6.0/run.html, pylint returns a bit-encoded exit code.
         return not (returncode & 1 or returncode & 32)
 
+    def indicates_crash(self, returncode):
+        # type: (int) -> bool
+        # Only a usage error stops pylint checking everything. Fatal messages
+        # (bit 1) are reported against the file they're about, like the kinds
+        # of messages found that the other bits are for.
+        return returncode < 0 or bool(returncode & 32)
+
+    def _runs_in_process(self, args):
+        # type: (List[str]) -> bool
+        """Whether to run pylint inside this process, rather than starting
+        one. This only pays off in a server, which keeps pylint warm between
+        checks, and only works with the pylint installed alongside our own
+        Python (since that's the one we can import)."""
+        if not (_serving and self.options.pylint_in_process):
+            return False
+        if not args or args[0] != self.executable:
+            # A user-defined command line
+            return False
+        return self.installed_for_this_python()
+
+    def run_checker(self, args, cwd, input_data, on_output):
+        # type: (List[str], Optional[str], Optional[str], Callable[[str], None]) -> Tuple[bool, str, int]
+        if not self._runs_in_process(args):
+            return super(PylintRunner, self).run_checker(args, cwd, input_data, on_output)
+        with _pylint_lock:
+            # Any rcfile is among the args, so PYLINTRC isn't needed
+            out, err, returncode = run_pylint_in_process(args[1:])
+        on_output(out)
+        return False, err, returncode
+
+
+def run_pylint_in_process(args):
+    # type: (List[str]) -> Tuple[str, str, int]
+    """Run pylint with `args` in this process, returning its output, error
+    output and exit status.
+
+    Astroid's cache of parsed modules is kept between runs, so imported
+    modules (and their dependencies) are only parsed once. Modules whose
+    source files have changed since are dropped from it first. Flycheck's
+    copies of buffers are recreated for every check, so they're dropped
+    straight after it instead.
+
+    Other checkers may be running in other threads meanwhile, so only what
+    this thread writes to stderr is captured."""
+    try:
+        from StringIO import StringIO  # type: ignore
+    except ImportError:
+        from io import StringIO  # type: ignore
+    from astroid import MANAGER  # type: ignore
+    from pylint.lint import Run
+    from pylint.reporters.text import TextReporter
+
+    _invalidate_astroid_cache(MANAGER)
+    out, err = StringIO(), StringIO()
+    saved_stderr = sys.stderr
+    sys.stderr = _ThreadStream(saved_stderr, err)
+    try:
+        try:
+            run = Run(args, reporter=TextReporter(out), exit=False)
+        except TypeError:
+            # Before pylint 2.5
+            run = Run(args, reporter=TextReporter(out), do_exit=False)  # type: ignore
+        returncode = run.linter.msg_status
+    except SystemExit as e:
+        # Bad arguments, for instance
+        returncode = e.code if isinstance(e.code, int) else 32
+    finally:
+        sys.stderr = saved_stderr
+    for name, module in list(MANAGER.astroid_cache.items()):
+        path = getattr(module, 'file', None)
+        if not path:
+            continue
+        if os.path.basename(path).startswith('flycheck_'):
+            # Nothing else imports it, so inferred results needn't be cleared
+            del MANAGER.astroid_cache[name]
+        elif path not in _astroid_mtimes:
+            _astroid_mtimes[path] = _mtime(path)
+    return out.getvalue(), err.getvalue(), returncode
+
+
+class _ThreadStream(object):
+    """File-like object that sends what the thread creating it writes to
+    `target`, and what other threads write to `stream`."""
+
+    def __init__(self, stream, target):
+        # type: (Any, Any) -> None
+        self.stream = stream
+        self.target = target
+        self.thread = threading.current_thread()
+
+    def write(self, text):
+        # type: (str) -> None
+        if threading.current_thread() is self.thread:
+            self.target.write(text)
+        else:
+            self.stream.write(text)
+
+    def flush(self):
+        # type: () -> None
+        self.stream.flush()
+
+    def __getattr__(self, name):
+        # type: (str) -> Any
+        return getattr(self.stream, name)
+
+
+def _invalidate_astroid_cache(manager):
+    # type: (Any) -> None
+    """Drop modules whose source files have changed since they were parsed
+    from astroid's cache, along with everything inferred so far (which may
+    depend on them)."""
+    changed = False
+    for name, module in list(manager.astroid_cache.items()):
+        path = getattr(module, 'file', None)
+        if path and path in _astroid_mtimes and _mtime(path) != _astroid_mtimes[path]:
+            del manager.astroid_cache[name]
+            del _astroid_mtimes[path]
+            changed = True
+    if changed:
+        import astroid.context  # type: ignore
+        import astroid.inference_tip  # type: ignore
+        for clear in (getattr(astroid.inference_tip, 'clear_inference_tip_cache', None),
+                      getattr(astroid.context, '_invalidate_cache', None)):
+            if clear is not None:
+                clear()
+
 
 class MyPy2Runner(LintRunner):
 
+    cacheable = False
+
+    # Beyond this many changed files, a daemon `recheck` isn't worth it
+    max_recheck_files = 500
+
+    def __init__(self, ignore_codes, enable_codes, options):
+        # type: (Optional[Iterable[str]], Optional[Iterable[str]], Namespace) -> None
+        super(MyPy2Runner, self).__init__(ignore_codes, enable_codes, options)
+        # Whether the daemon is checking flycheck's copy of the buffer
+        self._daemon_checks_copy = False
+        # The daemon state file's path and contents, once this check succeeds
+        self._daemon_state = None   # type: Optional[Tuple[str, Dict[str, Any]]]
+        self._daemon_project_root = None  # type: Optional[str]
+        # When the daemon is to be started in the background: its state
+        # file's path and contents, and the flags to start it with
+        self._daemon_warm_up = None  # type: Optional[Tuple[str, Dict[str, Any], List[str]]]
+        # The file to say the daemon is warming up in, root-relative, if it is
+        self._daemon_warming = None  # type: Optional[str]
+        self._checking_batch = False
+        # The resident build's key, flags and shadow files, when checking
+        # with one -- see _runs_resident()
+        self._resident_build = None  # type: Optional[Tuple[Tuple[str, ...], List[str], Dict[str, str]]]
+
     # A few of our properties vary if we're in daemon mode:
 
     @property
@@ -780,10 +2140,10 @@ class MyPy2Runner(LintRunner):
 
 
     output_matcher = re.compile(
-        r'(?P<filename>[^:]+):'
+        r'(?P<filename>[^:\n]+):'
         r'(?P<line_number>\d+):'
         r'((?P<column_number>\d+):)?'  # Column number is optional, depending on mypy options
-        r' (?P<level>[^:]+):'
+        r' (?P<level>[^:\n]+):'
         r' (?P<description>.+)$')
 
     # Note: this needs to match both mypy and dmypy
@@ -797,39 +2157,89 @@ class MyPy2Runner(LintRunner):
 
     def _get_cache_dir(self, project_root):
         # type: (str) -> str
-        """Find the appropriate .mypy_cache dir for the given branch.
-
-        We attempt to place the cache directory in the project root,
-        under a subdir corresponding to the branch name.
-        """
-        branch_top = os.path.join(project_root, '.mypy_cache', 'branches')
-        branch = ''  # type: Optional[str]
-        vcs_root = find_vcs_root(project_root)[0]
-        if vcs_root:
-            branch = get_vcs_branch_name(vcs_root)
-        if branch:
-            cache_dir = os.path.join(branch_top, branch)
-        else:
-            # Can't figure out current branch, just fake it
-            cache_dir = os.path.join(branch_top, 'HEAD')
-        return cache_dir
+        """Find the appropriate .mypy_cache dir for the given branch."""
+        return mypy_branch_cache_dir(project_root, self.options.cache_dir,
+                                     self.options.venv_root)
+
+    # Branch caches to seed a new one from, when there's no better idea
+    seed_branches = ['master', 'main', 'default']
+
+    def _use_cache_dir(self, project_root, cache_dir):
+        # type: (str, str) -> None
+        """Get `cache_dir` ready for mypy, and record that it's been used.
+        Every so often, this also starts removing old caches in the
+        background."""
+        if self.options.mypy_seed_cache:
+            self._seed_cache_dir(project_root, cache_dir)
+        branch_caches = BranchCaches(project_root, self.options.cache_dir)
+        if (branch_caches.record_use(cache_dir) and
+                (self.options.mypy_cache_max_size or self.options.mypy_cache_max_age)):
+            start_gc_caches(self.options, project_root)
+
+    def _seed_cache_dir(self, project_root, cache_dir):
+        # type: (str, str) -> None
+        """Fill an empty branch cache dir with the contents of the nearest
+        existing one: that of the branch this one was created from, then of
+        the main branch, then of whichever branch was checked last.
+
+        Mypy checks each module's cache entry against its source, so only
+        what differs between the branches is checked again, rather than
+        everything, as it is with an empty cache."""
+        if _has_entries(cache_dir):
+            return
+        branch_caches = BranchCaches(project_root, self.options.cache_dir)
+        caches = branch_caches.find()
+        candidates = []     # type: List[str]
+        index = discovery_index(self.options.cache_dir, self.options.venv_root)
+        vcs_root = index.lookup(project_root)['vcs_root']
+        branch = get_vcs_branch_name(vcs_root) if vcs_root else None
+        if branch and find_vcs_name(vcs_root) == 'git':
+            parent = git_parent_branch(vcs_root, branch)
+            if parent:
+                for prefix in ('refs/heads/', 'refs/remotes/'):
+                    if parent.startswith(prefix):
+                        parent = parent[len(prefix):]
+                # A remote branch ("origin/master") counts as the local one
+                candidates += [parent, parent.split('/', 1)[-1]]
+        candidates += self.seed_branches
+        last_used = branch_caches.last_used(caches)
+        candidates += sorted(caches, key=lambda name: last_used[name], reverse=True)
+        source = next((caches[name] for name in candidates
+                       if name in caches and caches[name] != cache_dir), None)
+        if source is None:
+            return
+
+        import shutil
+        # Seed a copy, then move it into place, so mypy never sees half of one
+        tmp_dir = os.path.join(branch_caches.branch_top, '.seeding-{}-{}'.format(
+            os.getpid(), threading.current_thread().ident))
+        try:
+            link_tree(source, tmp_dir)
+            if not os.path.isdir(os.path.dirname(cache_dir)):
+                os.makedirs(os.path.dirname(cache_dir))
+            # Replacing the empty dir, if mypy has created one
+            os.rename(tmp_dir, cache_dir)
+            self.debug('Seeded mypy cache {} from {}'.format(cache_dir, source))
+        except (IOError, OSError) as e:
+            # Most likely mypy has started filling it in the meantime
+            self.debug('Couldn\'t seed mypy cache {}: {}'.format(cache_dir, e))
+        finally:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
 
     def get_run_flags(self, filepath):
         # type: (str) -> Iterable[str]
         """Determine which mypy (2 or 3) to run, find the cache dir and config file"""
 
         daemon_mode = self.options.mypy_use_daemon
-        flags = self._base_flags
+        flags = list(self._base_flags)
 
         if daemon_mode:
             flags = [f for f in flags if f != '--incremental']
             # Older daemon versions didn't support following imports
-            if self.version < LooseVersion('0.780'):
-                flags = ['run', '--timeout', '600', '--', '--follow-imports=error'] + flags
-            else:
-                flags = ['run', '--timeout', '600', '--'] + flags
+            if self.version < Version('0.780'):
+                flags = ['--follow-imports=error'] + flags
         else:
-            if self.version < LooseVersion('0.660'):
+            if self.version < Version('0.660'):
                 # --quick-and-dirty is still available
                 flags += ['--quick-and-dirty']
 
@@ -838,8 +2248,13 @@ class MyPy2Runner(LintRunner):
         original_filepath = filepath.replace('flycheck_', '')
 
         project_root = self.find_project_root(filepath)
+        cache_dir = self._get_cache_dir(project_root)
+        if not daemon_mode and not self._runs_resident():
+            # (Mypy's daemon only reads the cache if told to, and doesn't write
+            # it, so it's no use there)
+            self._use_cache_dir(project_root, cache_dir)
         flags += [
-            '--cache-dir={}'.format(self._get_cache_dir(project_root)),
+            '--cache-dir={}'.format(cache_dir),
         ]
         if self.name == 'mypy':
             # mypy2 mode
@@ -854,63 +2269,250 @@ class MyPy2Runner(LintRunner):
         if self.options.mypy_no_implicit_optional:
             flags += ['--no-implicit-optional']
 
+        if daemon_mode:
+            return self._get_daemon_flags(flags, project_root, filepath, config_file)
+
+        if self._runs_resident():
+            # The resident build is told about the buffer's copy separately,
+            # rather than with --shadow-file, so that its options stay the
+            # same from one check to the next
+            shadows = {}    # type: Dict[str, str]
+            if filepath != original_filepath:
+                shadows[os.path.abspath(original_filepath)] = os.path.abspath(filepath)
+            key = (self.name, project_root, config_file or '', cache_dir)
+            self._resident_build = (key, flags, shadows)
+            return flags
+
         # Per Guido's suggestion, use the --shadow-file option to work around
         # https://github.com/msherry/flycheck-pycheckers/issues/2, so we can
         # respect per-file mypy.ini config options
         # TODO: only do this when being run by flycheck?
-        if not daemon_mode:
-            flags += ['--shadow-file', filepath, original_filepath]
-        else:
-            # For daemon mode we have to pass all python files we want it
-            # to consider explicitly (it can't do its normal follow imports
-            # thing).
+        if filepath != original_filepath:
+            flags += ['--shadow-file', original_filepath, filepath]
+        return flags
 
+    def _get_daemon_files(self, project_root, filepath):
+        # type: (str, str) -> List[str]
+        """List the files the daemon should check, relative to the project root."""
+        # For daemon mode we have to pass all python files we want it
+        # to consider explicitly (it can't do its normal follow imports
+        # thing).
+        if self.options.mypy_daemon_files_command:
             # Currently expecting this command to spit out one file per
             # line; this way we work well with the find command and support
             # spaces in filenames.
             from subprocess import check_output, CalledProcessError
             try:
-                flags += check_output(self.options.mypy_daemon_files_command,
-                                      shell=True).strip().split('\n')
+                files = check_output(self.options.mypy_daemon_files_command,
+                                     shell=True, universal_newlines=True,
+                                     cwd=project_root).strip().split('\n')
             except CalledProcessError as exc:
                 # Convert this to a FatalException to get it to show up in the
                 # current file buffer.
                 raise FatalException('Mypy daemon files command failed: ' + str(exc),
                                      filepath)
+        else:
+            files = find_python_files(project_root, self.options.mypy_daemon_exclude,
+                                      self.options.cache_dir)
+        # Copies of other buffers come and go; see below for this one
+        return [f for f in files if not os.path.basename(f).startswith('flycheck_')]
+
+    def _get_daemon_flags(self, mypy_flags, project_root, filepath, config_file):
+        # type: (List[str], str, str, Optional[str]) -> List[str]
+        """Build a `dmypy run` command that checks every file in the project,
+        or, when the daemon has already checked them with the same options, a
+        much cheaper `dmypy recheck`.
+
+        A daemon that doesn't follow imports can be told exactly which files
+        were added, changed or removed (--update/--remove). One that follows
+        imports (the default since mypy 0.780) can't, so it's only asked to
+        recheck when no files have come or gone, and looks for changes itself.
+
+        If flycheck gave us a copy of the buffer, it's checked along with the
+        files on disk, so we see errors for unsaved changes.
+
+        There's one daemon per project root. One that isn't running yet is
+        started in the background, rather than keeping flycheck waiting while
+        it checks the whole project (see run_checker()), and one whose
+        options, config file or list of files (from a files command) have
+        changed is restarted.
+        """
+        files = self._get_daemon_files(project_root, filepath)
+        project_files = list(files)
+        self._daemon_checks_copy = os.path.basename(filepath).startswith('flycheck_')
+        if self._daemon_checks_copy:
+            files.append(os.path.relpath(os.path.abspath(filepath), project_root))
+        run_flags = self._get_daemon_run_flags(mypy_flags, files, 'mypy-daemon:' + project_root)
+
+        import hashlib
+        fingerprint_parts = ([self.name, str(self.version), _file_digest(config_file or '') or '']
+                             + mypy_flags)
+        if self.options.mypy_daemon_files_command:
+            # Files coming and going don't restart a daemon otherwise
+            fingerprint_parts += ['--'] + project_files
+        fingerprint = hashlib.sha1('\0'.join(fingerprint_parts).encode('utf-8')).hexdigest()
+        state_path = daemon_state_path(self.options.cache_dir, self.name, project_root)
+        state = read_json(state_path)
+        if not isinstance(state, dict):
+            state = {}
+        daemon_pid = self._get_daemon_pid(project_root)
+        self._daemon_project_root = project_root
+
+        if daemon_warming_up(state):
+            self._daemon_warming = os.path.relpath(os.path.abspath(filepath), project_root)
+            return run_flags
+        if (daemon_pid is not None and state.get('pid') == daemon_pid
+                and state.get('fingerprint') != fingerprint):
+            # Started by us with other options -- start again
+            stop_daemon(project_root, daemon_pid)
+            daemon_pid = None
+
+        mtimes = dict((f, _mtime(os.path.join(project_root, f))) for f in files)
+        new_state = {'checker': self.name, 'project_root': project_root,
+                     'fingerprint': fingerprint, 'files': mtimes}
+        if (daemon_pid is None and self.options.mypy_daemon_warm_up and not self._checking_batch
+                and not (state.get('warm_up_pid') and state.get('fingerprint') == fingerprint)):
+            # (If warming up didn't leave a daemon running, run it here this
+            # time, and show why)
+            warm_up_flags = self._get_daemon_run_flags(
+                mypy_flags, project_files, 'mypy-daemon-warm-up:' + project_root)
+            new_state['files'] = dict((f, mtimes[f]) for f in project_files)
+            self._daemon_warm_up = (state_path, new_state, warm_up_flags)
+            self._daemon_warming = os.path.relpath(os.path.abspath(filepath), project_root)
+            return run_flags
+        # Saved once the daemon has seen these files -- see process_returncode()
+        self._daemon_state = (state_path, new_state)
+
+        # recheck --update/--remove arrived in mypy 0.750
+        if not self.options.mypy_daemon_recheck or self.version < Version('0.750'):
+            return run_flags
+        if (daemon_pid is None or state.get('pid') != daemon_pid
+                or state.get('fingerprint') != fingerprint):
+            # The daemon isn't running, or was restarted, or needs restarting
+            # with new options
+            return run_flags
+        old_mtimes = state['files']
+        update = sorted(f for f, mtime in mtimes.items() if old_mtimes.get(f) != mtime)
+        remove = sorted(f for f in old_mtimes if f not in mtimes)
+        if '--follow-imports=error' not in mypy_flags:
+            if remove or any(f not in old_mtimes for f in update):
+                return run_flags
+            return ['recheck']
+        if len(update) + len(remove) > self.max_recheck_files:
+            # Cheaper to let the daemon look for changes itself
+            return run_flags
+        # An empty --update tells the daemon that nothing else has changed
+        return ['recheck', '--update'] + update + (['--remove'] + remove if remove else [])
+
+    def _get_daemon_run_flags(self, mypy_flags, files, argfile_name):
+        # type: (List[str], List[str], str) -> List[str]
+        """Build a `dmypy run` command that checks `files`."""
+        run_flags = ['run', '--timeout', '600', '--'] + mypy_flags
+        if self.options.mypy_daemon_files_argfile:
+            # Mypy reads arguments from files named with a leading '@',
+            # which avoids enormous command lines for big projects
+            run_flags.append('@' + write_argfile(files, argfile_name, self.options.cache_dir))
+        else:
+            run_flags += files
+        return run_flags
+
+    @staticmethod
+    def _get_daemon_pid(project_root):
+        # type: (str) -> Optional[int]
+        """Return the pid of the daemon for `project_root`, if it's running."""
+        status = read_json(os.path.join(project_root, '.dmypy.json'))
+        if not isinstance(status, dict) or not status.get('pid'):
+            return None
+        pid = int(status['pid'])
+        try:
+            os.kill(pid, 0)
+        except OSError as e:
+            import errno
+            if e.errno != errno.EPERM:
+                return None
+        return pid
 
+    def process_returncode(self, returncode):
+        # type: (int) -> bool
+        # Mypy exits with 1 when it found errors, and 2 when it failed to check
+        project_root = self._daemon_project_root
+        if self._daemon_state is not None and project_root and returncode in (0, 1):
+            state_path, state = self._daemon_state
+            # `run` may have (re)started the daemon
+            state['pid'] = self._get_daemon_pid(project_root)
+            write_json(state_path, state)
+        return returncode == 0
 
-        return flags
+    def fixup_data(self, line, data, filepath):
+        # type: (str, Dict[str, str], str) -> Optional[Dict[str, str]]
+        return self.make_fixup(filepath)(line, data)
 
-    def fixup_data(self, _line, data, filepath):
-        # type: (str, Dict[str, str], str) -> Dict[str, str]
+    def output_prefilter(self, filepaths, demultiplex):
+        # type: (List[str], bool) -> Optional[str]
+        # Mypy reports errors in every file it looks at, but we only want
+        # those in the file being checked (whose name is part of flycheck's
+        # copy's name, in case that's what the daemon reports on)
+        if demultiplex:
+            return None
+        return os.path.basename(filepaths[0]).replace('flycheck_', '')
+
+    def make_fixup(self, filepath):
+        # type: (str) -> Callable[[str, Dict[str, str]], Optional[Dict[str, str]]]
 
         # Mypy returns lines for files other than the current one -- filter
         # those out. Since we may be using the --shadow-file option, check for
         # the original filename, not the flycheck-munged one
-        original_filename = os.path.basename(filepath).replace('flycheck_', '')
-        original_filepath = RootRelativePath(os.path.join(os.path.dirname(filepath), original_filename))
-        if str(original_filename) not in data['filename']:
-            return {}
-
-        # That wasn't enough, though -- we've just filtered by the basename, so even if
-        # we're trying to check affirm-users/affirm/users/controllers/user.py, we'll get
-        # errors for affirm-users/affirm/users/models/user.py.
-
-        # We may have a partial (root-relative) path in `data`, and potentially an
-        # absolute path in `filepath`. Or some other mixture. Longer-term, we need to have
-        # better typing around all these paths so we know what we're dealing with. For
-        # now, we can ensure that data['filename'] is a substring of filepath (or
-        # vice-versa, just in case?)
-
-        if str(original_filepath) not in data['filename'] and data['filename'] not in str(original_filepath):
-            return {}
-
-        data['filename'] = os.path.basename(original_filename)
-
-        data['level'] = data['level'].upper()
-        if data['level'] == 'NOTE':
-            data['level'] = 'INFO'
-        return data
+        checked_filename = os.path.basename(filepath)
+        original_filename = checked_filename.replace('flycheck_', '')
+        original_filepath = str(RootRelativePath(
+            os.path.join(os.path.dirname(filepath), original_filename)))
+        daemon_checks_copy = self._daemon_checks_copy
+
+        def report_as(reported):
+            # type: (str) -> Optional[str]
+            """The name to report errors in `reported` under, or None to drop them."""
+            if daemon_checks_copy:
+                # The daemon checked both the saved file and the buffer's copy
+                # of it, and only the copy is up to date
+                reported_filename = os.path.basename(reported)
+                if reported_filename == original_filename:
+                    return None
+                if reported_filename == checked_filename:
+                    reported = os.path.join(os.path.dirname(reported), original_filename)
+            if original_filename not in reported:
+                return None
+
+            # That wasn't enough, though -- we've just filtered by the basename, so even if
+            # we're trying to check affirm-users/affirm/users/controllers/user.py, we'll get
+            # errors for affirm-users/affirm/users/models/user.py.
+
+            # We may have a partial (root-relative) path in `reported`, and potentially an
+            # absolute path in `filepath`. Or some other mixture. Longer-term, we need to have
+            # better typing around all these paths so we know what we're dealing with. For
+            # now, we can ensure that `reported` is a substring of filepath (or
+            # vice-versa, just in case?)
+            if original_filepath not in reported and reported not in original_filepath:
+                return None
+            return original_filename
+
+        # Mypy tends to report many errors per file, so decide about each
+        # file only once
+        reported_names = {}     # type: Dict[str, Optional[str]]
+
+        def fixup(_line, data):
+            # type: (str, Dict[str, str]) -> Optional[Dict[str, str]]
+            reported = data['filename']
+            if reported in reported_names:
+                filename = reported_names[reported]
+            else:
+                filename = reported_names[reported] = report_as(reported)
+            if filename is None:
+                return None
+            data['filename'] = filename
+            level = data['level'].upper()
+            data['level'] = 'INFO' if level == 'NOTE' else level
+            return data
+        return fixup
 
     def get_filepath(self, filepath):
         # type: (str) -> Optional[str]
@@ -921,46 +2523,570 @@ class MyPy2Runner(LintRunner):
         """
         if self.options.mypy_use_daemon:
             return None
+        if self._resident_build is not None:
+            # The server may be somewhere else by the next check
+            return os.path.abspath(filepath.replace('flycheck_', ''))
         return filepath.replace('flycheck_', '')
 
+    def _runs_resident(self):
+        # type: () -> bool
+        """Whether to check with a resident mypy build inside this process,
+        rather than starting mypy. As with pylint, this only pays off in a
+        server, and only works with the mypy installed alongside our own
+        Python."""
+        return (_serving and self.options.mypy_resident and
+                not self.options.mypy_use_daemon and self.installed_for_this_python())
+
+    def construct_batch_args(self, filepaths):
+        # type: (List[str]) -> List[str]
+        # Checking many files is worth waiting for the daemon to start
+        self._checking_batch = True
+        return super(MyPy2Runner, self).construct_batch_args(filepaths)
+
+    def run_checker(self, args, cwd, input_data, on_output):
+        # type: (List[str], Optional[str], Optional[str], Callable[[str], None]) -> Tuple[bool, str, int]
+        if self._daemon_warm_up is not None:
+            state_path, state, warm_up_flags = self._daemon_warm_up
+            state['warm_up_pid'] = start_daemon_warm_up(args[:1] + warm_up_flags, cwd)
+            write_json(state_path, state)
+        if self._daemon_warming is not None:
+            on_output('{}:1: note: {}\n'.format(self._daemon_warming, DAEMON_WARMING_UP_MESSAGE))
+            return False, '', 0
+        if self._resident_build is None:
+            return super(MyPy2Runner, self).run_checker(args, cwd, input_data, on_output)
+        key, flags, shadows = self._resident_build
+        files = args[1 + len(flags):]
+        with _mypy_lock:
+            result = run_mypy_resident(key, flags, files, shadows)
+        if result is None:
+            # Mypy's daemon doesn't support these options (or they're
+            # wrong), so run mypy itself, and let it report any problems
+            shadow_flags = []       # type: List[str]
+            for source, shadow in sorted(shadows.items()):
+                shadow_flags += ['--shadow-file', source, shadow]
+            return super(MyPy2Runner, self).run_checker(
+                args[:1] + flags + shadow_flags + files, cwd, input_data, on_output)
+        out, err, returncode = result
+        on_output(out)
+        return False, err, returncode
+
+
+def daemon_state_path(cache_dir, checker_name, project_root):
+    # type: (Optional[str], str, str) -> str
+    """Where we keep track of the mypy daemon for `project_root`."""
+    import hashlib
+    state_name = hashlib.sha1('{}\0{}'.format(checker_name, project_root).encode('utf-8')).hexdigest()
+    return os.path.join(get_cache_dir(cache_dir, 'mypy-daemon'), state_name + '.json')
+
+
+def start_daemon_warm_up(args, cwd):
+    # type: (List[str], Optional[str]) -> int
+    """Start the `dmypy run` command `args` in the background, detached from
+    this process, returning its pid. This starts the daemon, which then
+    checks the whole project, and exits once it has."""
+    from subprocess import Popen
+    with open(os.devnull, 'r+') as devnull:
+        process = Popen(args, stdin=devnull, stdout=devnull, stderr=devnull, cwd=cwd,
+                        close_fds=True, **new_session_kwargs())
+    # Kept so a server can tell when it's done, rather than leaving a zombie
+    _daemon_warm_ups[process.pid] = process
+    return process.pid
+
+
+def daemon_warming_up(state):
+    # type: (Dict[str, Any]) -> bool
+    """Whether the daemon warm-up recorded in `state` is still running."""
+    pid = state.get('warm_up_pid')
+    if not pid:
+        return False
+    process = _daemon_warm_ups.get(pid)
+    if process is not None:
+        if process.poll() is None:
+            return True
+        del _daemon_warm_ups[pid]
+        return False
+    try:
+        os.kill(pid, 0)
+    except OSError:
+        return False
+    return True
 
-class MyPy3Runner(MyPy2Runner):
-
-    @property
-    def name(self):
-        # type: () -> str
-        return 'mypy3'
-
-
-class BanditRunner(LintRunner):
 
-    command = 'bandit'
-    got_header = False
+def stop_daemon(project_root, pid):
+    # type: (str, int) -> None
+    """Stop the mypy daemon for `project_root`, whose process id is `pid`."""
+    import signal
+    try:
+        os.kill(pid, signal.SIGTERM)
+        # Give it a moment, so it isn't asked to check anything on its way out
+        for _ in range(10):
+            time.sleep(0.02)
+            os.kill(pid, 0)
+    except OSError:
+        pass
+    # Only a daemon that's asked to stop removes its status file, and until
+    # it's gone, dmypy will try to use it
+    status_path = os.path.join(project_root, '.dmypy.json')
+    status = read_json(status_path)
+    if isinstance(status, dict) and status.get('pid') == pid:
+        try:
+            os.unlink(status_path)
+        except OSError:
+            pass
+
+
+def daemon_status(options):
+    # type: (Namespace) -> int
+    """Report on the mypy daemons started for the projects of the files or
+    directories given, or for every project, as for --daemon-status. Returns
+    the exit status."""
+    from subprocess import PIPE, Popen
+    roots = None                # type: Optional[Set[str]]
+    if options.files:
+        index = discovery_index(options.cache_dir, options.venv_root)
+        roots = set()
+        for path in options.files:
+            path = os.path.abspath(path)
+            roots.add(index.lookup(path if os.path.isdir(path)
+                                   else os.path.dirname(path))['project_root'])
+    directory = get_cache_dir(options.cache_dir, 'mypy-daemon')
+    dmypy = find_executable('dmypy')
+    for name in sorted(os.listdir(directory)):
+        state = read_json(os.path.join(directory, name))
+        if not isinstance(state, dict) or not state.get('project_root'):
+            continue
+        project_root = state['project_root']
+        if roots is not None and project_root not in roots:
+            continue
+        pid = MyPy2Runner._get_daemon_pid(project_root)  # pylint: disable=protected-access
+        if daemon_warming_up(state):
+            status = 'warming up'
+        elif pid is None:
+            status = 'not running'
+        else:
+            status = 'running (pid {})'.format(pid)
+            if dmypy:
+                # Ask it, in case it's stuck
+                process = Popen([dmypy, 'status'], stdout=PIPE, stderr=PIPE,
+                                universal_newlines=True, cwd=project_root)
+                timed_out, _err = wait_for_checker(
+                    process, options.checker_timeout, lambda _output: None)
+                if timed_out or process.returncode != 0:
+                    status += ', not responding'
+            if state.get('pid') == pid:
+                status += ', has checked {} files'.format(len(state.get('files') or ()))
+        print('{} ({}): {}'.format(project_root, state.get('checker'), status))
+    return 0
+
+
+def run_mypy_resident(key, flags, files, shadows):
+    # type: (Tuple[str, ...], List[str], List[str], Dict[str, str]) -> Optional[Tuple[str, str, int]]
+    """Check `files` with the resident mypy build for `key`, starting it if
+    necessary, and return mypy's output, error output and exit status, or
+    None if the build can't be started with `flags`.
+
+    The build is mypy's daemon, running in this process: after the first
+    check, only modules that have changed, and those depending on them, are
+    checked again. `shadows` maps source files to the files to read them from
+    instead, like mypy's --shadow-file."""
+    from mypy.version import __version__
+
+    server = _resident_mypy.pop(key, None)
+    if server is None:
+        server = _start_resident_mypy(flags)
+        if server is None:
+            return None
+    _resident_mypy[key] = server
+    while len(_resident_mypy) > MAX_RESIDENT_MYPY_BUILDS:
+        _resident_mypy.popitem(last=False)
 
-    def output_matcher(self, line):  # type: ignore
-        # type: (str) -> Optional[Dict[str, str]]
-        keys = ['filename', 'test_name', 'test_id', 'issue_severity',
-                'issue_confidence', 'issue_text', 'line_number', 'line_range']
-        f = StringIO(line)
-        reader = DictReader(f, fieldnames=keys)
-        res = next(reader)
-        if not self.got_header:
-            # This line was the CSV header, not a real error
-            self.got_header = True
+    for attempt in range(2):
+        _set_mypy_shadows(server, shadows)
+        try:
+            try:
+                response = server.cmd_run(__version__, flags + files, export_types=False,
+                                          is_tty=False, terminal_width=80)
+            except TypeError:
+                # Before mypy 1.1
+                response = server.cmd_run(__version__, flags + files, is_tty=False,
+                                          terminal_width=80)
+        except BaseException:
+            # Don't trust whatever state it was left in
+            del _resident_mypy[key]
+            raise
+        if 'restart' not in response or attempt:
+            break
+        # The config file, or a plugin, has changed
+        del _resident_mypy[key]
+        server = _start_resident_mypy(flags)
+        if server is None:
             return None
-        if res and res.get('test_id'):
-            return {
-                'description': res['issue_text'],
-                'error_number': res['test_id'],
-                'filename': res['filename'],
-                'level': 'WARNING',
-                'line_number': res['line_number'],
-            }
+        _resident_mypy[key] = server
+    return (str(response.get('out', '')), str(response.get('err', '')),
+            int(response.get('status', 2)))  # type: ignore
+
+
+def _start_resident_mypy(flags):
+    # type: (List[str]) -> Any
+    """Start a resident mypy build with `flags`, or return None if mypy's
+    daemon doesn't accept them."""
+    try:
+        from StringIO import StringIO  # type: ignore
+    except ImportError:
+        from io import StringIO  # type: ignore
+    from mypy.dmypy_server import Server, process_start_options
+
+    saved_stdout, saved_stderr = sys.stdout, sys.stderr
+    # Any complaints about the options are mypy's to make when it's run
+    sys.stdout, sys.stderr = StringIO(), StringIO()
+    try:
+        # There's no status file, since nothing connects to this daemon
+        return Server(process_start_options(flags, allow_sources=False), os.devnull)
+    except SystemExit:
         return None
+    finally:
+        sys.stdout, sys.stderr = saved_stdout, saved_stderr
+
+
+def _set_mypy_shadows(server, shadows):
+    # type: (Any, Dict[str, str]) -> None
+    """Have the resident build `server` read the files in `shadows` from the
+    files they map to, as mypy's --shadow-file does for a single run.
+
+    Mypy only notices files changing on disk, so files that are shadowed
+    now, or were last time, are always checked again."""
+    from mypy.fswatcher import FileData
+    if server.fine_grained_manager is None:
+        # The build starts with the next check
+        server.options.shadow_file = [list(item) for item in shadows.items()] or None
+        return
+    manager = server.fine_grained_manager.manager
+    for path in set(manager.shadow_map) | set(shadows):
+        # A size nothing has, so the file looks changed
+        server.fswatcher.set_file_data(path, FileData(-1, -1, ''))
+    manager.shadow_map = dict(shadows)
+    manager.shadow_equivalence_map = {}
+
+
+def mypy_branch_cache_dir(project_root, cache_dir, venv_root):
+    # type: (str, Optional[str], str) -> str
+    """Find the appropriate .mypy_cache dir for the current branch.
+
+    We attempt to place the cache directory in the project root,
+    under a subdir corresponding to the branch name.
+    """
+    branch_top = os.path.join(project_root, '.mypy_cache', 'branches')
+    branch = ''  # type: Optional[str]
+    vcs_root = discovery_index(cache_dir, venv_root).lookup(project_root)['vcs_root']
+    if vcs_root:
+        branch = get_vcs_branch_name(vcs_root)
+    if branch:
+        return os.path.join(branch_top, branch)
+    # Can't figure out current branch, just fake it
+    return os.path.join(branch_top, 'HEAD')
+
+
+class BranchCaches(object):
+    """The per-branch mypy caches of a project, and when pycheckers last used
+    each of them, for removing those that haven't been used for a while.
+
+    Last-use times are kept in a JSON file per project under pycheckers' own
+    cache directory, which also lists the projects with caches to look after.
+    """
+
+    # Uses this soon after the last one recorded aren't recorded
+    record_interval = 3600
+    # How often to remove old caches in the background
+    gc_interval = 24 * 3600
+
+    def __init__(self, project_root, cache_dir, state_path=None):
+        # type: (str, Optional[str], Optional[str]) -> None
+        import hashlib
+        self.project_root = project_root
+        self.branch_top = os.path.join(project_root, '.mypy_cache', 'branches')
+        if state_path is None:
+            state_path = os.path.join(
+                get_cache_dir(cache_dir, 'mypy-caches'),
+                hashlib.sha1(project_root.encode('utf-8')).hexdigest() + '.json')
+        self.state_path = state_path
+        state = read_json(state_path)
+        if not isinstance(state, dict) or not isinstance(state.get('last_used'), dict):
+            state = {'last_used': {}, 'last_gc': 0}
+        state['project_root'] = project_root
+        self.state = state      # type: Dict[str, Any]
+
+    @classmethod
+    def all(cls, cache_dir):
+        # type: (Optional[str]) -> List[BranchCaches]
+        """Those of every project whose caches pycheckers has used."""
+        directory = get_cache_dir(cache_dir, 'mypy-caches')
+        projects = []
+        for name in sorted(os.listdir(directory)):
+            if not name.endswith('.json'):
+                continue
+            state = read_json(os.path.join(directory, name))
+            if isinstance(state, dict) and state.get('project_root'):
+                projects.append(cls(state['project_root'], cache_dir,
+                                    os.path.join(directory, name)))
+        return projects
+
+    def find(self):
+        # type: () -> Dict[str, str]
+        """The project's caches, by branch name."""
+        return find_branch_caches(self.branch_top)
+
+    def last_used(self, caches):
+        # type: (Dict[str, str]) -> Dict[str, float]
+        """When each of `caches` was last used, going by when mypy last wrote
+        to it for those used before pycheckers recorded it."""
+        recorded = self.state['last_used']
+        return dict((name, recorded.get(name) or _cache_last_used(path))
+                    for name, path in caches.items())
+
+    def record_use(self, cache_dir):
+        # type: (str) -> bool
+        """Record that `cache_dir` has just been used. Returns whether it's
+        time to remove old caches."""
+        name = os.path.relpath(cache_dir, self.branch_top).replace(os.sep, '/')
+        now = time.time()
+        gc_due = now - self.state.get('last_gc', 0) > self.gc_interval
+        if now - self.state['last_used'].get(name, 0) < self.record_interval and not gc_due:
+            return False
+        self.state['last_used'][name] = now
+        if gc_due:
+            # Whoever gets here first does it
+            self.state['last_gc'] = now
+        write_json(self.state_path, self.state)
+        return gc_due
+
+    def collect(self, current_cache_dir, max_bytes, max_age):
+        # type: (str, int, float) -> List[Tuple[str, int]]
+        """Remove caches unused for more than `max_age` seconds, then the least
+        recently used ones until the rest take up no more than `max_bytes`
+        (either of which may be 0, for no limit). The current branch's cache
+        is always kept.
+
+        Returns the names of the caches removed, and the space each freed."""
+        import shutil
+        caches = self.find()
+        last_used = self.last_used(caches)
+        # Seeded caches share files with the one they were seeded from, so
+        # count each file once, and only as freed once no cache has it
+        usage = dict((name, _disk_usage(path)) for name, path in caches.items())
+        refs = {}               # type: Dict[Tuple[int, int], int]
+        total = 0
+        for files in usage.values():
+            for key, size in files.items():
+                if key not in refs:
+                    refs[key] = 0
+                    total += size
+                refs[key] += 1
+
+        now = time.time()
+        removed = []
+        for name in sorted(caches, key=lambda name: last_used[name]):
+            if os.path.normpath(caches[name]) == os.path.normpath(current_cache_dir):
+                continue
+            if not ((max_age and now - last_used[name] > max_age) or
+                    (max_bytes and total > max_bytes)):
+                continue
+            freed = 0
+            for key, size in usage[name].items():
+                refs[key] -= 1
+                if not refs[key]:
+                    freed += size
+            total -= freed
+            shutil.rmtree(caches[name], ignore_errors=True)
+            _remove_empty_dirs(os.path.dirname(caches[name]), self.branch_top)
+            self.state['last_used'].pop(name, None)
+            removed.append((name, freed))
+        if removed:
+            write_json(self.state_path, self.state)
+        return removed
+
+
+def gc_caches(options):
+    # type: (Namespace) -> int
+    """Remove old per-branch mypy caches, as for --gc-caches, from the projects
+    of the files or directories given, or from every project pycheckers has
+    checked. Returns the exit status."""
+    if options.files:
+        index = discovery_index(options.cache_dir, options.venv_root)
+        roots = set()
+        for path in options.files:
+            path = os.path.abspath(path)
+            roots.add(index.lookup(path if os.path.isdir(path)
+                                   else os.path.dirname(path))['project_root'])
+        projects = [BranchCaches(root, options.cache_dir) for root in sorted(roots)]
+    else:
+        projects = BranchCaches.all(options.cache_dir)
+    for project in projects:
+        current = mypy_branch_cache_dir(project.project_root, options.cache_dir,
+                                        options.venv_root)
+        for name, freed in project.collect(current, options.mypy_cache_max_size * 1024 * 1024,
+                                           options.mypy_cache_max_age * 24 * 3600):
+            print('Removed {} ({:.1f}MB)'.format(
+                os.path.join(project.branch_top, name), freed / (1024.0 * 1024)))
+    return 0
+
+
+def start_gc_caches(options, project_root):
+    # type: (Namespace, str) -> None
+    """Remove old per-branch mypy caches from `project_root` in the background,
+    detached from this process."""
+    from subprocess import Popen
+    args = [sys.executable, os.path.realpath(__file__), '--gc-caches',
+            '--mypy-cache-max-size', str(options.mypy_cache_max_size),
+            '--mypy-cache-max-age', str(options.mypy_cache_max_age),
+            '--venv-root', options.venv_root]
+    if options.cache_dir:
+        args += ['--cache-dir', options.cache_dir]
+    with open(os.devnull, 'r+') as devnull:
+        Popen(args + [project_root],
+              stdin=devnull, stdout=devnull, stderr=devnull, close_fds=True,
+              **new_session_kwargs())
+
+
+def find_branch_caches(branch_top):
+    # type: (str) -> Dict[str, str]
+    """Find the mypy caches under `branch_top`, by branch name. Branch names
+    may contain slashes, so a cache is any directory that mypy has written
+    into (marking it with CACHEDIR.TAG, or a Python version directory)."""
+    caches = {}
+    for dirpath, dirnames, filenames in os.walk(branch_top):
+        if 'CACHEDIR.TAG' in filenames or any(
+                re.match(r'\d+\.\d+$', dirname) for dirname in dirnames):
+            caches[os.path.relpath(dirpath, branch_top).replace(os.sep, '/')] = dirpath
+            del dirnames[:]
+        else:
+            # Skip caches being seeded
+            dirnames[:] = [d for d in dirnames if not d.startswith('.')]
+    return caches
+
+
+def _cache_last_used(cache_dir):
+    # type: (str) -> float
+    """When mypy last wrote to the cache in `cache_dir`, roughly."""
+    try:
+        names = os.listdir(cache_dir)
+    except OSError:
+        return 0
+    return max([_mtime(os.path.join(cache_dir, name)) or 0 for name in names] + [0])
+
+
+def _disk_usage(path):
+    # type: (str) -> Dict[Tuple[int, int], int]
+    """The space taken up by each file under `path`, by device and inode."""
+    usage = {}
+    for dirpath, _dirnames, filenames in os.walk(path):
+        for filename in filenames:
+            try:
+                st = os.lstat(os.path.join(dirpath, filename))
+            except OSError:
+                continue
+            blocks = getattr(st, 'st_blocks', None)
+            usage[(st.st_dev, st.st_ino)] = blocks * 512 if blocks is not None else st.st_size
+    return usage
+
+
+def _remove_empty_dirs(path, top):
+    # type: (str, str) -> None
+    """Remove `path` and its parents, up to but not including `top`, for as
+    long as they're empty."""
+    top = os.path.normpath(top)
+    path = os.path.normpath(path)
+    while path != top and path.startswith(top + os.sep):
+        try:
+            os.rmdir(path)
+        except OSError:
+            return
+        path = os.path.dirname(path)
+
+
+def _has_entries(path):
+    # type: (str) -> bool
+    try:
+        return bool(os.listdir(path))
+    except OSError:
+        return False
+
+
+class MyPy3Runner(MyPy2Runner):
+
+    @property
+    def name(self):
+        # type: () -> str
+        return 'mypy3'
+
+
+class BanditRunner(LintRunner):
+    """Run bandit, producing flycheck readable output.
+
+    Bandit's JSON report looks like:
+      {"errors": [{"filename": "x.py", "reason": "syntax error while parsing AST from file"}],
+       "results": [{"filename": "t.py", "test_id": "B602", "test_name": "...",
+                    "issue_severity": "HIGH", "issue_confidence": "HIGH",
+                    "issue_text": "...", "line_number": 4, "line_range": [4, 5],
+                    "col_offset": 0, "end_col_offset": 42, ...}],
+       ...}
+    """
+
+    command = 'bandit'
+
+    parses_whole_output = True
+
+    def iter_matches(self, output, _prefilter=None):
+        # type: (str, Optional[str]) -> Iterator[Tuple[str, Dict[str, str]]]
+        # Bandit logs its progress to stderr, so only look at the report
+        if not output.lstrip().startswith('{'):
+            return
+        import json
+        try:
+            report = json.loads(output)
+        except ValueError:
+            return
+        # Files bandit couldn't check at all
+        for error in report.get('errors', []):
+            yield '', {
+                'description': error.get('reason', ''),
+                'filename': error.get('filename', ''),
+                'level': 'ERROR',
+                'line_number': '1',
+            }
+        for result in report.get('results', []):
+            data = {
+                'description': result['issue_text'],
+                'error_number': result['test_id'],
+                'filename': result['filename'],
+                'level': self._level(result.get('issue_severity'),
+                                     result.get('issue_confidence')),
+                'line_number': str(result['line_number']),
+            }
+            # Bandit's columns (newer versions only) count from 0
+            if result.get('col_offset') is not None:
+                data['column_number'] = str(result['col_offset'] + 1)
+            line_range = result.get('line_range') or []
+            if len(line_range) > 1:
+                data['end_line_number'] = str(line_range[-1])
+            if result.get('end_col_offset') is not None:
+                data['end_line_number'] = data.get('end_line_number', data['line_number'])
+                data['end_column_number'] = str(result['end_col_offset'] + 1)
+            yield '', data
+
+    @staticmethod
+    def _level(severity, confidence):
+        # type: (Optional[str], Optional[str]) -> str
+        """Severe issues bandit is sure about are errors, and minor (or
+        doubtful) ones are for information only."""
+        if severity == 'HIGH' and confidence != 'LOW':
+            return 'ERROR'
+        if severity == 'LOW' or confidence == 'LOW':
+            return 'INFO'
+        return 'WARNING'
 
     def get_run_flags(self, _filepath):
         # type: (str) -> Iterable[str]
-        flags = ['-f', 'csv']
+        flags = ['-f', 'json']
         if self.ignore_codes is not None:
             # NOTE: this doesn't work if the code isn't recognized as a bandit
             # code (e.g. pylint errors)
@@ -968,6 +3094,209 @@ class BanditRunner(LintRunner):
         return flags
 
 
+class RuffRunner(LintRunner):
+    """Run ruff, producing flycheck readable output.
+
+    Ruff reads the file from stdin, under its real (not flycheck's) name, so
+    its own config discovery and per-file settings apply. Its JSON output
+    looks like:
+      [{"code": "F401", "filename": "/src/t.py", "message": "`os` imported but unused",
+        "location": {"row": 1, "column": 8}, "end_location": {"row": 1, "column": 10},
+        ...}]
+    with a code of "invalid-syntax" (or null, in older versions) for syntax
+    errors.
+    """
+
+    command = 'ruff'
+
+    parses_whole_output = True
+
+    version_matcher = re.compile(r'ruff (?P<version>[0-9.]+)')
+
+    # Pyflakes messages that flake8 and ruff call errors, but aren't
+    WARNING_CODES = set(['F401', 'F403', 'F405', 'F811', 'F841'])
+
+    def __init__(self, ignore_codes, enable_codes, options):
+        # type: (Optional[Iterable[str]], Optional[Iterable[str]], Namespace) -> None
+        super(RuffRunner, self).__init__(ignore_codes, enable_codes, options)
+        # See _ruff_config_files()
+        self._ruff_configs = None   # type: Optional[Tuple[Optional[str], List[str]]]
+
+    def _find_ruff_config_file(self):
+        # type: () -> Optional[str]
+        """The config file ruff uses for the file being checked."""
+        return self._ruff_config_files()[0]
+
+    def _ruff_config_files(self):
+        # type: () -> Tuple[Optional[str], List[str]]
+        """Find ruff's config file for the file being checked as ruff does,
+        in the nearest directory above it that has one. Returns that, and the
+        pyproject.toml files without ruff settings passed on the way there,
+        which would take over if ruff settings were added to them."""
+        if self.options.ruff_config_file:
+            return self.find_config_file('ruff_config_file', []), []
+        if self._ruff_configs is None:
+            passed = []         # type: List[str]
+            found = None        # type: Optional[str]
+            dir_path = os.path.dirname(os.path.abspath(self._filepath or '.'))
+            while found is None:
+                for name in ('.ruff.toml', 'ruff.toml', 'pyproject.toml'):
+                    path = os.path.join(dir_path, name)
+                    if not os.path.isfile(path):
+                        continue
+                    if name != 'pyproject.toml':
+                        found = path
+                        break
+                    with open(path) as f:
+                        if '[tool.ruff' in f.read():
+                            found = path
+                            break
+                    passed.append(path)
+                parent = os.path.dirname(dir_path)
+                if parent == dir_path:
+                    break
+                dir_path = parent
+            self._ruff_configs = (found, passed)
+        return self._ruff_configs
+
+    def cache_key_files(self):
+        # type: () -> List[str]
+        config_file, passed = self._ruff_config_files()
+        return ([config_file] if config_file else []) + passed
+
+    def _known_codes(self):
+        # type: () -> Set[str]
+        """The codes (and, in newer versions, names) of all of ruff's rules,
+        which codes it's given need to be (a prefix of). Cached on disk for
+        each install of ruff."""
+        executable = find_executable(self.command)
+        if not executable:
+            return set()
+        key = version_cache_key(executable, ('rule', '--all'))
+        if key not in _ruff_codes_cache:
+            codes_path = os.path.join(get_cache_dir(self.options.cache_dir), 'ruff-codes.json')
+            known = read_json(codes_path) or {}
+            if key not in known:
+                import json
+                from subprocess import PIPE, Popen
+                process = Popen([executable, 'rule', '--all', '--output-format', 'json'],
+                                stdout=PIPE, stderr=PIPE, universal_newlines=True)
+                out, _err = process.communicate()
+                try:
+                    codes = sorted(set(selector for rule in json.loads(out)
+                                       for selector in (rule.get('code'), rule.get('name'))
+                                       if selector))
+                except (ValueError, AttributeError, TypeError):
+                    codes = []
+                if not codes:
+                    # Don't remember a failed probe, try again next time
+                    return set()
+                # Forget about other installs of ruff
+                known = {key: codes}
+                write_json(codes_path, known)
+            _ruff_codes_cache[key] = set(known[key])
+        return _ruff_codes_cache[key]
+
+    def _ruff_codes(self, codes):
+        # type: (Iterable[str]) -> List[str]
+        """Those of `codes` that ruff knows, since it refuses to run given
+        any others (e.g. pylint's). If we couldn't find out which codes it
+        knows, all of them."""
+        known = self._known_codes()
+        if not known:
+            return sorted(codes)
+        return sorted(code for code in codes
+                      if code == 'ALL' or any(k.startswith(code) for k in known))
+
+    def get_run_flags(self, _filepath):
+        # type: (str) -> Iterable[str]
+        args = ['check', '--output-format=json', '--no-fix', '--force-exclude']
+        if self.ignore_codes:
+            ignore_codes = self._ruff_codes(self.ignore_codes)
+            if ignore_codes:
+                # This extends (rather than replaces) the config file's ignores
+                args.append('--ignore=' + ','.join(ignore_codes))
+        if self.enable_codes:
+            enable_codes = self._ruff_codes(self.enable_codes)
+            if enable_codes:
+                args.append('--extend-select=' + ','.join(enable_codes))
+        # Otherwise ruff finds its config itself, from the file's real name
+        config_file = (self._find_ruff_config_file() if self.options.ruff_config_file
+                       else None)
+        if config_file:
+            args += ['--config', config_file]
+        # Only override the line length from ruff's own config when asked to
+        if self.options.max_line_length or not self._find_ruff_config_file():
+            args += ['--line-length', str(self.max_line_length)]
+        return args
+
+    def construct_args(self, filepath):
+        # type: (str) -> List[str]
+        args = self.user_defined_command_line(filepath)
+        if args:
+            return args
+        # Flycheck checks a copy of the buffer, named after the original file
+        dir_path, basename = os.path.split(filepath)
+        original_filepath = os.path.join(dir_path, basename.replace('flycheck_', ''))
+        return ([self.executable] + list(self.get_run_flags(filepath)) +
+                ['--stdin-filename', original_filepath, '-'])
+
+    def get_stdin(self, filepath):
+        # type: (str) -> Optional[str]
+        if self.user_defined_command_line(filepath):
+            return None
+        with open(filepath) as f:
+            return f.read()
+
+    def iter_matches(self, output, _prefilter=None):
+        # type: (str, Optional[str]) -> Iterator[Tuple[str, Dict[str, str]]]
+        if not output.lstrip().startswith('['):
+            return
+        import json
+        try:
+            results = json.loads(output)
+        except ValueError:
+            return
+        for result in results:
+            code = result.get('code')
+            location = result.get('location') or {}
+            end_location = result.get('end_location') or {}
+            data = {
+                'description': result.get('message', ''),
+                'filename': result.get('filename', ''),
+                'line_number': str(location.get('row', 1)),
+            }
+            if code and code != 'invalid-syntax':
+                data['error_type'] = code[:1]
+                data['error_number'] = code[1:]
+            if location.get('column') is not None:
+                data['column_number'] = str(location['column'])
+            if end_location.get('row') is not None:
+                data['end_line_number'] = str(end_location['row'])
+            if end_location.get('column') is not None:
+                data['end_column_number'] = str(end_location['column'])
+            yield '', data
+
+    def fixup_data(self, _line, data, _filepath):
+        # type: (str, Dict[str, str], str) -> Dict[str, str]
+        code = data.get('error_type', '') + data.get('error_number', '')
+        if not code:
+            # A syntax error
+            data['level'] = 'ERROR'
+        elif code.startswith('F'):
+            data['level'] = 'WARNING' if code in self.WARNING_CODES else 'ERROR'
+        else:
+            data['level'] = 'WARNING'
+        # Like flake8, report the file by its basename
+        data['filename'] = os.path.basename(data['filename'])
+        return data
+
+    def process_returncode(self, returncode):
+        # type: (int) -> bool
+        # Ruff exits with 1 when it found something, and 2 when it failed to check
+        return returncode in (0, 1)
+
+
 RUNNERS = {
     'pyflakes': PyflakesRunner,
     'flake8': Flake8Runner,
@@ -976,6 +3305,7 @@ RUNNERS = {
     'mypy2': MyPy2Runner,
     'mypy3': MyPy3Runner,
     'bandit': BanditRunner,
+    'ruff': RuffRunner,
 }
 
 
@@ -984,6 +3314,11 @@ def get_options_from_file(file_path):
     """Parse options from the config file at `file_path` and return them as a dict"""
     parsed_options = {}         # type: Dict[str, Union[str, bool]]
 
+    try:
+        from configparser import ConfigParser  # type: ignore
+    except ImportError:
+        from ConfigParser import SafeConfigParser as ConfigParser  # type: ignore
+
     config = ConfigParser()
     config.read(file_path)
     # [DEFAULT] section
@@ -1000,43 +3335,76 @@ def get_options_from_file(file_path):
     return parsed_options
 
 
-def update_options_locally(options):
-    # type: (Namespace) -> Namespace
-    """Merge options from files.
+def _config_chain_is_valid(chain):
+    # type: (Dict[str, Any]) -> bool
+    """Check that none of the config files that contributed to a chain have
+    changed, and that none of those looked for has appeared since.
 
-    Traverse the project directory until a config file is found or the
-    filesystem root is reached. If found, use overrides from config as
-    project-specific settings.
+    Not against the mtimes of the directories searched, since flycheck creates
+    a copy of the buffer next to the file for every check.
     """
-    allowed_duplicate_options = {'extra_ignore_codes'}
-    set_options = set()         # type: Set[str]
+    if 'missing' not in chain:
+        return False            # Cached by an older version
+    for path, mtime, inode in chain['files']:
+        try:
+            st = os.stat(path)
+        except OSError:
+            return False
+        if st.st_mtime != mtime or st.st_ino != inode:
+            return False
+    return not any(os.path.exists(path) for path in chain['missing'])
+
+
+def _prune_config_chains(chains):
+    # type: (Dict[str, Dict[str, Any]]) -> Dict[str, Dict[str, Any]]
+    """Once there are more than MAX_CACHED_CONFIG_CHAINS, forget the chains of
+    directories that no longer exist, and then the oldest."""
+    if len(chains) <= MAX_CACHED_CONFIG_CHAINS:
+        return chains
+    chains = dict((key, chain) for key, chain in chains.items()
+                  if os.path.isdir(key.split('\0')[0]))
+    newest = sorted(chains, key=lambda k: chains[k].get('time', 0))
+    return dict((key, chains[key]) for key in newest[-MAX_CACHED_CONFIG_CHAINS // 2:])
+
+
+def find_config_chain(dir_path, merge_configs, cache_dir):
+    # type: (str, bool, Optional[str]) -> Dict[str, Any]
+    """Find and parse the config files that apply to files in `dir_path`.
 
-    dir_path = os.path.dirname(os.path.abspath(options.file))
-    config_file_path = os.path.join(dir_path, CONFIG_FILE_NAME)
+    Traverse the project directory until a config file is found or the
+    filesystem root is reached, continuing upwards while configs are being
+    merged. Returns the parsed options of each file found (nearest first),
+    along with what's needed to tell whether the result is still valid.
+
+    Chains are cached, in memory and in the cache directory, so unchanged
+    hierarchies need neither a filesystem walk nor any parsing.
+    """
+    key = '{}\0{}'.format(dir_path, merge_configs)
+    cache_path = os.path.join(get_cache_dir(cache_dir), 'configs.json')
+    chain = _config_chain_cache.get(key)
+    if chain is None:
+        chain = (read_json(cache_path) or {}).get(key)
+    if chain is not None and _config_chain_is_valid(chain):
+        _config_chain_cache[key] = chain
+        return chain
+
+    chain = {'configs': [], 'files': [], 'missing': [], 'time': time.time()}
+    # The nearest file setting merge_configs decides whether to keep going
+    merge_configs_set = False
     while True:
-        if os.path.exists(config_file_path):
+        config_file_path = os.path.join(dir_path, CONFIG_FILE_NAME)
+        try:
+            st = os.stat(config_file_path)
+        except OSError:
+            chain['missing'].append(config_file_path)
+        else:
             new_options = get_options_from_file(config_file_path)
-            for key, value in new_options.items():
-                if key in set_options and key not in allowed_duplicate_options:
-                    # Already set this option from a file, don't set it again
-                    continue
-                set_options.add(key)
-                # Special handling for some keys
-
-                # Special case config files to contain the full path - assume
-                # the specified path is absolute, or relative to the current
-                # .pycheckers file
-                if 'config_file' in key or 'rcfile' in key:
-                    if not os.path.isabs(value):
-                        value = os.path.join(os.path.dirname(config_file_path), value)
-                # Allow for extending, rather than replacing, ignore codes
-                elif key == 'extra_ignore_codes':
-                    # Still a comma-separated str
-                    value = ','.join([options.ignore_codes, value])
-                    key = 'ignore_codes'
-                setattr(options, key, value)
-
-            if not options.merge_configs:
+            chain['configs'].append((config_file_path, new_options))
+            chain['files'].append((config_file_path, st.st_mtime, st.st_ino))
+            if 'merge_configs' in new_options and not merge_configs_set:
+                merge_configs_set = True
+                merge_configs = new_options['merge_configs']
+            if not merge_configs:
                 # We don't want to walk further up looking for config files
                 break
 
@@ -1045,25 +3413,102 @@ def update_options_locally(options):
         if parent == dir_path:
             break
         dir_path = parent
-        config_file_path = os.path.join(dir_path, CONFIG_FILE_NAME)
+
+    _config_chain_cache[key] = chain
+    cached_chains = read_json(cache_path) or {}
+    cached_chains[key] = chain
+    write_json(cache_path, _prune_config_chains(cached_chains))
+    return chain
+
+
+def update_options_locally(options):
+    # type: (Namespace) -> Namespace
+    """Merge options from files.
+
+    Apply the options from any config files found above the file being
+    checked (see find_config_chain()) as project-specific settings, with
+    nearer files taking precedence.
+    """
+    allowed_duplicate_options = {'extra_ignore_codes'}
+    set_options = set()         # type: Set[str]
+
+    chain = find_config_chain(os.path.dirname(os.path.abspath(options.file)),
+                              options.merge_configs, options.cache_dir)
+    for config_file_path, new_options in chain['configs']:
+        for key, value in new_options.items():
+            if key in set_options and key not in allowed_duplicate_options:
+                # Already set this option from a file, don't set it again
+                continue
+            set_options.add(key)
+            # Special handling for some keys
+
+            # Special case config files to contain the full path - assume
+            # the specified path is absolute, or relative to the current
+            # .pycheckers file
+            if 'config_file' in key or 'rcfile' in key:
+                if not os.path.isabs(value):
+                    value = os.path.join(os.path.dirname(config_file_path), value)
+            # Allow for extending, rather than replacing, ignore codes
+            elif key == 'extra_ignore_codes':
+                # Still a comma-separated str
+                value = ','.join([options.ignore_codes, value])
+                key = 'ignore_codes'
+            setattr(options, key, value)
     return options
 
 
+def explain_config(options):
+    # type: (Namespace) -> None
+    """Print the config files that apply to the file being checked, and the
+    options they set."""
+    chain = find_config_chain(os.path.dirname(os.path.abspath(options.file)),
+                              options.merge_configs, options.cache_dir)
+    if not chain['configs']:
+        print('No {} files apply to {}'.format(CONFIG_FILE_NAME, options.file))
+    for config_file_path, new_options in chain['configs']:
+        print('# {}'.format(config_file_path))
+        for key, value in sorted(new_options.items()):
+            print('{} = {}'.format(key, value))
+        print()
+    print('# Directories searched without finding a {} file:'.format(CONFIG_FILE_NAME))
+    for config_file_path in chain['missing']:
+        print(os.path.dirname(config_file_path))
+    print()
+    original = dict(vars(options))
+    options = update_options_locally(options)
+    print('# Resulting changes to command-line options:')
+    for key, value in sorted(vars(options).items()):
+        if original.get(key) != value:
+            print('{} = {}'.format(key, value))
+
+
 def run_one_checker(ignore_codes, enable_codes, options, source_file_path, checker_name):
-    # type: (Tuple[str], Tuple[str], Namespace, str, str) -> Tuple[int, List[str]]
+    # type: (Optional[Tuple[str, ...]], Tuple[str, ...], Namespace, str, str) -> Tuple[int, List[str]]
     checker_class = RUNNERS[checker_name]
     runner = checker_class(ignore_codes, enable_codes, options)
     errors_or_warnings, out_lines = runner.run(source_file_path)
     return (errors_or_warnings, out_lines)
 
 
+def run_named_checker(ignore_codes, enable_codes, options, source_file_path, checker_name):
+    # type: (Optional[Tuple[str, ...]], Tuple[str, ...], Namespace, str, str) -> Tuple[str, int, List[str]]
+    """Like run_one_checker(), but also say which checker ran, for when
+    results arrive out of order."""
+    errors_or_warnings, out_lines = run_one_checker(
+        ignore_codes, enable_codes, options, source_file_path, checker_name)
+    return (checker_name, errors_or_warnings, out_lines)
+
+
 def find_vcs_name(dir_):
     # type: (str) -> Optional[str]
     """If dir_ is a VCS root, return the name of the VCS, otherwise None"""
     for part in ['.git', '.svn', '.hg', '.cvs', '.jedi']:
         path = os.path.join(dir_, part)
-        if os.path.exists(path) and os.path.isdir(path):
+        if os.path.isdir(path):
             return part[1:]             # return the name of the vcs system
+        if part == '.git' and os.path.isfile(path):
+            # Worktrees and submodules have a .git file pointing elsewhere
+            return 'git'
     return None
 
 
@@ -1082,36 +3527,295 @@ def find_vcs_root(source_file):
     return None, None
 
 
+def _read_first_line(path):
+    # type: (str) -> Optional[str]
+    try:
+        with open(path) as f:
+            return f.readline().strip()
+    except (IOError, OSError):
+        return None
+
+
+def find_git_dir(vcs_root):
+    # type: (str) -> Optional[str]
+    """Find the git metadata directory for a checkout, following the `gitdir:`
+    indirection used by worktrees and submodules."""
+    dot_git = os.path.join(vcs_root, '.git')
+    if os.path.isdir(dot_git):
+        return dot_git
+    line = _read_first_line(dot_git)
+    if line and line.startswith('gitdir:'):
+        git_dir = line[len('gitdir:'):].strip()
+        return os.path.normpath(os.path.join(vcs_root, git_dir))
+    return None
+
+
+def _git_branch_name(vcs_root):
+    # type: (str) -> Optional[str]
+    """Equivalent to `git symbolic-ref --short HEAD`"""
+    git_dir = find_git_dir(vcs_root)
+    if not git_dir:
+        return None
+    head = _read_first_line(os.path.join(git_dir, 'HEAD'))
+    if head and head.startswith('ref:'):
+        ref = head[len('ref:'):].strip()
+        if ref.startswith('refs/heads/'):
+            return ref[len('refs/heads/'):]
+        return ref
+    # Detached HEAD
+    return None
+
+
+def _hg_branch_name(vcs_root):
+    # type: (str) -> Optional[str]
+    """Equivalent to `hg branch`"""
+    if not os.path.exists(os.path.join(vcs_root, '.hg', 'branch')):
+        # Mercurial only writes this file once off the default branch
+        return 'default'
+    return _read_first_line(os.path.join(vcs_root, '.hg', 'branch')) or None
+
+
+def git_parent_branch(vcs_root, branch):
+    # type: (str, str) -> Optional[str]
+    """The ref that `branch` was created from, according to git's reflogs, or
+    None if they don't say (they expire after 90 days, by default)."""
+    git_dir = find_git_dir(vcs_root)
+    if not git_dir:
+        return None
+    # Branch reflogs are shared between worktrees, each HEAD's isn't
+    common_dir = git_dir
+    common_line = _read_first_line(os.path.join(git_dir, 'commondir'))
+    if common_line:
+        common_dir = os.path.normpath(os.path.join(git_dir, common_line))
+    # "branch: Created from master", unless `git checkout -b` made it from HEAD
+    line = _read_first_line(os.path.join(common_dir, 'logs', 'refs', 'heads', branch))
+    marker = '\tbranch: Created from '
+    if line and marker in line:
+        parent = line.split(marker, 1)[1].strip()
+        if parent != 'HEAD':
+            return parent
+    # Otherwise, whichever branch was checked out when it was first checked out
+    marker = '\tcheckout: moving from '
+    suffix = ' to ' + branch
+    try:
+        with open(os.path.join(git_dir, 'logs', 'HEAD')) as f:
+            for line in f:
+                line = line.rstrip('\n')
+                if marker in line and line.endswith(suffix):
+                    return line.split(marker, 1)[1][:-len(suffix)]
+    except (IOError, OSError):
+        pass
+    return None
+
+
 def get_vcs_branch_name(vcs_root):
     # type: (str) -> Optional[str]
     """If under source control and the VCS supports branches, find branch name.
+
+    This reads the VCS metadata directly rather than asking git/hg, and
+    remembers the answer for as long as the file holding it is unchanged.
     """
-    commands = {
-        'git': ['git', 'symbolic-ref', '--short', 'HEAD'],
-        'hg': ['hg', 'branch'],
-    }
     vcs_name = find_vcs_name(vcs_root)
-    if not vcs_name or vcs_name not in commands:
+    if vcs_name == 'git':
+        git_dir = find_git_dir(vcs_root)
+        head_file = os.path.join(git_dir, 'HEAD') if git_dir else None
+        get_branch = _git_branch_name
+    elif vcs_name == 'hg':
+        head_file = os.path.join(vcs_root, '.hg', 'branch')
+        get_branch = _hg_branch_name
+    else:
         # Unsupported VCS
         return None
 
-    args = commands[vcs_name]
-    p = Popen(
-        args, stdout=PIPE, stderr=PIPE, cwd=vcs_root, universal_newlines=True)
-    out, _err = p.communicate()
-    p.wait()
-    out = out.strip()
-    return out if out else None
+    mtime = _mtime(head_file) if head_file else None
+    cached = _branch_cache.get(vcs_root)
+    if cached is not None and mtime is not None and cached[0] == mtime:
+        return cached[1]
+    branch = get_branch(vcs_root)
+    _branch_cache[vcs_root] = (mtime, branch)
+    return branch
+
 
+def _mtime(path):
+    # type: (str) -> Optional[float]
+    try:
+        return os.stat(path).st_mtime
+    except OSError:
+        return None
 
-def guess_virtualenv(source_file, venv_root):
-    # type: (str, str) -> Tuple[Optional[str], Optional[str]]
+
+def _scan_dir(path):
+    # type: (str) -> Tuple[List[str], List[str]]
+    """List the names of the Python files and the subdirectories in `path`.
+
+    Symlinks to directories aren't followed, like find(1)."""
+    file_names = []
+    dir_names = []
+    scandir = getattr(os, 'scandir', None)
+    if scandir is not None:
+        for entry in list(scandir(path)):
+            if entry.is_dir(follow_symlinks=False):
+                dir_names.append(entry.name)
+            elif entry.name.endswith('.py') and entry.is_file():
+                file_names.append(entry.name)
+    else:
+        # Python 2
+        for name in os.listdir(path):
+            full_path = os.path.join(path, name)
+            if os.path.isdir(full_path) and not os.path.islink(full_path):
+                dir_names.append(name)
+            elif name.endswith('.py') and os.path.isfile(full_path):
+                file_names.append(name)
+    return file_names, dir_names
+
+
+def find_python_files(root, exclude, cache_dir=None):
+    # type: (str, str, Optional[str]) -> List[str]
+    """List the Python files under `root`, relative to it.
+
+    `exclude` is a comma-separated list of glob patterns, matched against the
+    names and root-relative paths of files and directories to skip.
+
+    The contents of each directory are cached (in memory and on disk) along
+    with its mtime, which changes whenever entries are added or removed, so
+    only directories that have changed are read again.
+    """
+    import hashlib
+    from fnmatch import fnmatch
+    patterns = [p.strip() for p in exclude.split(',') if p.strip()]
+
+    def excluded(rel_path):
+        # type: (str) -> bool
+        name = os.path.basename(rel_path)
+        return any(fnmatch(name, p) or fnmatch(rel_path, p) for p in patterns)
+
+    key = hashlib.sha1('{}\0{}'.format(os.path.abspath(root), exclude).encode('utf-8')).hexdigest()
+    cache_path = os.path.join(get_cache_dir(cache_dir, 'python-files'), key + '.json')
+    if key not in _python_files_cache:
+        _python_files_cache[key] = read_json(cache_path) or {}
+    cached = _python_files_cache[key]
+
+    # root-relative dir -> [mtime, file names, subdirectory names]
+    dirs = {}                   # type: Dict[str, List[Any]]
+    files = []                  # type: List[str]
+    changed = False
+    pending = ['']
+    while pending:
+        rel_dir = pending.pop()
+        dir_path = os.path.join(root, rel_dir) if rel_dir else root
+        mtime = _mtime(dir_path)
+        entry = cached.get(rel_dir)
+        if entry is None or entry[0] != mtime:
+            try:
+                file_names, dir_names = _scan_dir(dir_path)
+            except OSError:
+                continue
+            entry = [mtime,
+                     sorted(n for n in file_names if not excluded(os.path.join(rel_dir, n))),
+                     sorted(n for n in dir_names if not excluded(os.path.join(rel_dir, n)))]
+            changed = True
+        dirs[rel_dir] = entry
+        files.extend(os.path.join(rel_dir, name) for name in entry[1])
+        pending.extend(os.path.join(rel_dir, name) for name in reversed(entry[2]))
+
+    if changed or len(dirs) != len(cached):
+        _python_files_cache[key] = dirs
+        write_json(cache_path, dirs)
+    return files
+
+
+def write_argfile(args, name, cache_dir=None):
+    # type: (List[str], str, Optional[str]) -> str
+    """Write `args` to the file `name`, one per line, for a command that
+    accepts '@file' arguments. The file is left alone if it's unchanged."""
+    import hashlib
+    contents = ''.join(arg + '\n' for arg in args)
+    filename = hashlib.sha1(name.encode('utf-8')).hexdigest() + '.args'
+    path = os.path.join(get_cache_dir(cache_dir, 'argfiles'), filename)
+    try:
+        with open(path) as f:
+            if f.read() == contents:
+                return path
+    except (IOError, OSError):
+        pass
+    import tempfile
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path))
+    with os.fdopen(fd, 'w') as f:
+        f.write(contents)
+    os.rename(tmp_path, path)
+    return path
+
+
+def find_executable(command):
+    # type: (str) -> Optional[str]
+    """Find `command` on PATH, like `which`, without spawning anything.
+
+    Results are cached per (PATH, command). A cached path is reused as long as
+    neither it nor any of the PATH directories searched before finding it have
+    been modified, i.e. nothing could have been installed that would shadow it.
+    """
+    if os.sep in command:
+        return command if os.access(command, os.X_OK) else None
+
+    search_path = os.environ.get('PATH', os.defpath)
+    key = (search_path, command)
+    cached = _executable_cache.get(key)
+    if cached is not None:
+        path, dir_mtimes, path_mtime = cached
+        if (_mtime(path) == path_mtime and
+                all(_mtime(dir_) == mtime for dir_, mtime in dir_mtimes)):
+            return path
+
+    dir_mtimes = []
+    for dir_ in search_path.split(os.pathsep):
+        dir_ = dir_ or os.curdir
+        dir_mtimes.append((dir_, _mtime(dir_)))
+        path = os.path.join(dir_, command)
+        if os.path.isfile(path) and os.access(path, os.X_OK):
+            _executable_cache[key] = (path, dir_mtimes, _mtime(path))
+            return path
+    _executable_cache.pop(key, None)
+    return None
+
+
+def version_cache_key(executable, version_args):
+    # type: (str, Iterable[str]) -> str
+    """Identify a specific install of a checker, so that cached versions are
+    invalidated when the checker is upgraded."""
+    real_path = os.path.realpath(executable)
+    st = os.stat(real_path)
+    return '\0'.join([real_path, repr(st.st_mtime), str(st.st_size)] + list(version_args))
+
+
+def print_versions(options):
+    # type: (Namespace) -> None
+    """Report the versions of the selected checkers, as known to the version
+    cache. Checkers are never run to find out."""
+    checker_names, _ignore_codes, _enable_codes = get_checkers_and_codes(options)
+    versions = read_json(os.path.join(get_cache_dir(options.cache_dir), 'versions.json')) or {}
+    for checker_name in checker_names:
+        runner = RUNNERS[checker_name](None, (), options)
+        executable = find_executable(runner.command)
+        if not executable:
+            print('{}: {} not found on PATH'.format(checker_name, runner.command))
+            continue
+        entry = versions.get(version_cache_key(executable, runner.version_args))
+        if entry:
+            print('{}: {} ({})'.format(checker_name, entry['version'] or 'unknown', executable))
+        else:
+            print('{}: version not cached yet ({})'.format(checker_name, executable))
+
+
+def guess_virtualenv(source_file, venv_root, venv_names=None):
+    # type: (str, str, Optional[Set[str]]) -> Tuple[Optional[str], Optional[str]]
     """Given the virtualenvwrapper base directory, attempt to guess the paths to
     the project root and the virtualenv that corresponds to this source file,
     based on the project and virtualenv names.
 
     The virtualenv name must match the name of one of the containing
-    directories.
+    directories. If the contents of the virtualenvwrapper directory are
+    already known, they may be passed as `venv_names` to avoid a stat per
+    directory.
     """
     full_path = os.path.abspath(source_file)
     dir_components = os.path.dirname(full_path).split(os.sep)
@@ -1122,29 +3826,165 @@ def guess_virtualenv(source_file, venv_root):
             continue
         used_components.append(component)
         virtualenv_path = os.path.join(virtualenv_base, component)
-        if os.path.exists(virtualenv_path):
+        if (component in venv_names if venv_names is not None
+                else os.path.exists(virtualenv_path)):
             return os.path.join(*used_components), virtualenv_path
     return None, None
 
 
-def set_path_for_virtualenv(source_file, venv_path, venv_root):
-    # type: (str, Optional[str], str) -> None
+class DiscoveryIndex(object):
+    """Remembers the project root, VCS root and virtualenv for directories.
+
+    Answers are persisted in the cache directory so they can be shared between
+    runners and invocations. They're revalidated by checking that each
+    directory examined to produce them still is (or isn't) a VCS root, and
+    against the mtime of the virtualenvs directory, which creating a new
+    virtualenv changes. Not against the mtimes of the directories themselves,
+    since flycheck creates a copy of the buffer next to the file for every
+    check.
+    """
+
+    # Beyond this many directories, forget the ones looked up least recently
+    max_entries = 2000
+
+    def __init__(self, cache_dir, venv_root):
+        # type: (Optional[str], str) -> None
+        self.venv_base = os.path.expanduser(venv_root)
+        self._cache_dir = cache_dir
+        self._path = None           # type: Optional[str]
+        self._entries = None        # type: Optional[Dict[str, Dict[str, Any]]]
+        self._venv_names = None     # type: Optional[Tuple[Optional[float], Set[str]]]
+        # Runners in several threads may look things up at once
+        self._lock = threading.Lock()
+
+    @property
+    def path(self):
+        # type: () -> str
+        if self._path is None:
+            import hashlib
+            cache_dir = get_cache_dir(self._cache_dir, 'discovery')
+            name = hashlib.sha1(self.venv_base.encode('utf-8')).hexdigest()[:12]
+            self._path = os.path.join(cache_dir, name + '.json')
+        return self._path
+
+    @property
+    def entries(self):
+        # type: () -> Dict[str, Dict[str, Any]]
+        if self._entries is None:
+            self._entries = read_json(self.path) or {}
+        return self._entries
+
+    def venv_names(self):
+        # type: () -> Set[str]
+        """The names of all virtualenvs, listed once rather than stat-ing a
+        candidate for every directory component."""
+        mtime = _mtime(self.venv_base)
+        if self._venv_names is None or self._venv_names[0] != mtime:
+            try:
+                names = set(os.listdir(self.venv_base))
+            except OSError:
+                names = set()
+            self._venv_names = (mtime, names)
+        return self._venv_names[1]
+
+    def _is_valid(self, entry):
+        # type: (Dict[str, Any]) -> bool
+        if entry.get('venv_base_mtime') != _mtime(self.venv_base):
+            return False
+        return all(find_vcs_name(dir_) == vcs_name for dir_, vcs_name in entry['probed'])
+
+    def lookup(self, directory):
+        # type: (str) -> Dict[str, Any]
+        """Return the project root, VCS root and name, and virtualenv for a
+        directory.
+
+        The project root is determined as follows:
+        1. Find a virtualenv that matches a part of the directory, and choose that.
+        2. Failing that, walk up the directory tree looking for a VCS directory.
+        3. Otherwise, just use the directory itself.
+        """
+        with self._lock:
+            return self._lookup(directory)
+
+    def _lookup(self, directory):
+        # type: (str) -> Dict[str, Any]
+        entry = self.entries.get(directory)
+        if entry is not None and self._is_valid(entry):
+            return entry
+
+        venv_base_mtime = _mtime(self.venv_base)
+        # guess_virtualenv() wants a file within the directory
+        project_root, venv = guess_virtualenv(
+            os.path.join(directory, '_'), self.venv_base, self.venv_names())
+
+        vcs_root = vcs_name = None
+        probed = []
+        cur_dir = directory
+        while True:
+            vcs_name = find_vcs_name(cur_dir)
+            probed.append((cur_dir, vcs_name))
+            if vcs_name:
+                vcs_root = cur_dir
+                break
+            parent = os.path.dirname(cur_dir)
+            if parent == cur_dir:
+                break              # Hit the FS root without finding VCS info
+            cur_dir = parent
+
+        entry = {
+            'project_root': project_root or vcs_root or directory,
+            'vcs_root': vcs_root,
+            'vcs_name': vcs_name,
+            'venv': venv,
+            'venv_base_mtime': venv_base_mtime,
+            'probed': probed,
+            'time': time.time(),
+        }
+        self.entries[directory] = entry
+        self._save()
+        return entry
+
+    def _save(self):
+        # type: () -> None
+        entries = self.entries
+        if len(entries) > self.max_entries:
+            newest = sorted(entries, key=lambda d: entries[d]['time'])[-self.max_entries // 2:]
+            entries = self._entries = dict((d, entries[d]) for d in newest)
+        write_json(self.path, entries)
+
+
+def discovery_index(cache_dir, venv_root):
+    # type: (Optional[str], str) -> DiscoveryIndex
+    """Return the shared DiscoveryIndex for this cache dir and venv root."""
+    key = (cache_dir or '', venv_root)
+    if key not in _discovery_indexes:
+        _discovery_indexes[key] = DiscoveryIndex(cache_dir, venv_root)
+    return _discovery_indexes[key]
+
+
+def set_path_for_virtualenv(source_file, venv_path, venv_root, cache_dir=None):
+    # type: (str, Optional[str], str, Optional[str]) -> None
     """Determine if the current file is part of a package that has a
     virtualenv, and munge paths appropriately"""
 
     if not venv_path:
         # If the venv path isn't supplied directly, try to guess it
-        _project_root, venv_path = guess_virtualenv(source_file, venv_root)
+        index = discovery_index(cache_dir, venv_root)
+        venv_path = index.lookup(os.path.dirname(os.path.abspath(source_file)))['venv']
     if venv_path:
         bin_path = os.path.join(venv_path, 'bin')
         os.environ['PATH'] = bin_path + ':' + os.environ['PATH']
 
 
-def parse_args():
-    # type: () -> Namespace
+def parse_args(argv=None):
+    # type: (Optional[List[str]]) -> Namespace
+
+    from argparse import ArgumentParser
 
     parser = ArgumentParser()
-    parser.add_argument('file', type=str, help='Filename to check')
+    parser.add_argument('files', type=str, nargs='*', metavar='file',
+                        help=('Filename to check. Given several files or directories, '
+                              'check them all in batch mode'))
     parser.add_argument("-c", "--checkers", dest="checkers",
                         default=default_checkers,
                         help="Comma-separated list of checkers")
@@ -1154,8 +3994,9 @@ def parse_args():
                         default='',
                         help="Comma-separated list of error codes to ignore")
     parser.add_argument('--max-line-length', dest='max_line_length',
-                        default=79, action='store',
-                        help='Maximum line length')
+                        default=None, action='store',
+                        help=('Maximum line length (default {}, or for ruff, the '
+                              'one in its config file)'.format(DEFAULT_MAX_LINE_LENGTH)))
     parser.add_argument('--no-merge-configs', dest='merge_configs',
                         action='store_false',
                         help=('Whether to ignore config files found at a '
@@ -1164,6 +4005,21 @@ def parse_args():
                         action='store',
                         help=('Run checkers sequentially, '
                               'rather than simultaneously'))
+    parser.add_argument('--checker-timeout', dest='checker_timeout', type=float,
+                        default=None, action='store',
+                        help=('Kill any checker still running after this many '
+                              'seconds'))
+    parser.add_argument('--max-diagnostics', dest='max_diagnostics', type=int,
+                        default=1000, action='store',
+                        help=('Show at most this many errors/warnings from each '
+                              'checker for each file, followed by a count of the '
+                              'rest (0 for no limit)'))
+    parser.add_argument('--supersede-runs', dest='supersede_runs', type=str2bool,
+                        default=True, action='store',
+                        help=('Cancel any older check of the same file that is still '
+                              'running, and give up if a newer one starts (printing '
+                              '"{}" and exiting with status {})'
+                              .format(SUPERSEDED_MESSAGE, SUPERSEDED_STATUS)))
     parser.add_argument('--venv-root', dest='venv_root',
                         default='~/.virtualenvs', action='store',
                         help=('Location of all Python virtual environments. '
@@ -1182,24 +4038,86 @@ def parse_args():
                         action='store',
                         help='Whether to run mypy in daemon mode. Defaults to'
                         ' false. This can greatly increase performance but '
-                        ' comes with a few drawbacks: First, it only sees'
-                        ' files as they exist on disk, so unsaved changes'
-                        ' will not be reflected. Second, it requires providing'
-                        ' a static set of python files/dirs to be operated on'
-                        ' (see --mypy-daemon-files-command).')
+                        ' comes with a few drawbacks: First, other files are'
+                        ' only seen as they exist on disk, so unsaved changes'
+                        ' in other buffers will not be reflected. Second, it'
+                        ' requires providing a static set of python files/dirs'
+                        ' to be operated on (see --mypy-daemon-files-command).')
+    parser.add_argument('--mypy-daemon-recheck', type=str2bool, default=True,
+                        action='store',
+                        help='In daemon mode, once the daemon has checked the'
+                        ' project, only tell it about files that have changed'
+                        ' since (with `dmypy recheck`), rather than having it'
+                        ' look over every file again. Needs mypy 0.750+.')
     parser.add_argument('--mypy-daemon-files-command',
-                        default='find . -name "*.py"', action='store',
+                        default=None, action='store',
                         help='A shell command to run to generate the list of'
                         ' python files/dirs for the mypy daemon.'
                         ' Mypy in daemon mode will only process files included'
                         ' here. This command gets run from project root and'
                         ' should return one filename per line.'
-                        ' It defaults to \'find . -name "*.py"\'. To debug'
+                        ' By default, every .py file under the project root is'
+                        ' used, except those matching --mypy-daemon-exclude;'
+                        ' this list is cached between runs. To debug'
                         ' this, look for a running dmypy process and see which'
                         ' args have been passed to it.')
+    parser.add_argument('--mypy-daemon-exclude',
+                        default='.*,__pycache__,node_modules', action='store',
+                        help='Comma-separated glob patterns for files and'
+                        ' directories to leave out of the mypy daemon\'s files,'
+                        ' when no --mypy-daemon-files-command is given. Patterns'
+                        ' match names or paths relative to the project root.')
+    parser.add_argument('--mypy-daemon-warm-up', type=str2bool,
+                        default=True, action='store',
+                        help='When the mypy daemon isn\'t running, start it in'
+                        ' the background, and only say that it\'s warming up'
+                        ' until it has checked the project, rather than waiting'
+                        ' for it. (It is always waited for when checking many'
+                        ' files at once.)')
+    parser.add_argument('--mypy-daemon-files-argfile', type=str2bool,
+                        default=True, action='store',
+                        help='Pass the mypy daemon\'s files in a file (as'
+                        ' "@file"), rather than on the command line.')
+    parser.add_argument('--mypy-seed-cache', type=str2bool, default=True,
+                        action='store',
+                        help='When a branch has no mypy cache yet, start it off'
+                        ' with a copy (hardlinked where possible) of that of'
+                        ' the branch it was created from, or of the main'
+                        ' branch, or of the last branch checked.')
+    parser.add_argument('--mypy-cache-max-size', type=int, default=5120,
+                        action='store',
+                        help='Maximum size of each project\'s per-branch mypy'
+                        ' caches, in megabytes, beyond which the least recently'
+                        ' used are removed (but never the current branch\'s).'
+                        ' 0 means no limit.')
+    parser.add_argument('--mypy-cache-max-age', type=float, default=30,
+                        action='store',
+                        help='Remove per-branch mypy caches that haven\'t been'
+                        ' used for this many days (except the current'
+                        ' branch\'s). 0 means no limit.')
+    parser.add_argument('--pylint-in-process', type=str2bool, default=False,
+                        action='store',
+                        help=('When running as a server (see --use-server), run '
+                              'pylint inside the server, keeping parsed modules in '
+                              'memory between checks. Only applies when the pylint '
+                              'found is installed for the Python running pycheckers, '
+                              'and ignores --checker-timeout.'))
+    parser.add_argument('--mypy-resident', type=str2bool, default=False,
+                        action='store',
+                        help=('When running as a server (see --use-server) and not '
+                              'in daemon mode, check with mypy inside the server, '
+                              'keeping each project\'s types in memory between '
+                              'checks so that only what has changed is checked '
+                              'again. Only applies when the mypy found is installed '
+                              'for the Python running pycheckers, and ignores '
+                              '--checker-timeout.'))
     parser.add_argument('--flake8-config-file', default=None,
                         dest='flake8_config_file',
                         help='Location of a config file for flake8')
+    parser.add_argument('--ruff-config-file', default=None,
+                        dest='ruff_config_file',
+                        help=('Location of a config file for ruff (by default, ruff '
+                              'finds its own)'))
     parser.add_argument('--report-checker-errors-inline', type=str2bool, default=True,
                         action='store',
                         help=("Whether to fake failing checkers's STDERR as a reported "
@@ -1211,65 +4129,655 @@ def parse_args():
     parser.add_argument('--debug', action='store_true',
                         help=('Enable output to help debug pycheckers itself'))
 
-    return parser.parse_args()
+    parser.add_argument('--cache-dir', dest='cache_dir', default=None,
+                        action='store',
+                        help=('Directory for pycheckers\' own caches. Defaults to '
+                              '$XDG_CACHE_HOME/pycheckers'))
+    parser.add_argument('--result-cache', dest='result_cache', type=str2bool,
+                        default=True, action='store',
+                        help=('Reuse previous results for checkers whose input '
+                              '(file contents, options, config files and checker '
+                              'version) has not changed'))
+    parser.add_argument('--result-cache-size', dest='result_cache_size', type=int,
+                        default=50, action='store',
+                        help='Maximum size of the result cache, in megabytes')
+
+    parser.add_argument('--print-versions', dest='print_versions',
+                        action='store_true',
+                        help=('Print the cached versions of the selected checkers '
+                              'and exit'))
+
+    parser.add_argument('--stream-results', dest='stream_results', type=str2bool,
+                        default=False, action='store',
+                        help=('Print each checker\'s results as soon as it finishes, '
+                              'followed by a "{}" line'.format(
+                                  STREAM_DONE_FORMAT.format(checker='<checker>',
+                                                            count='<count>'))))
+
+    parser.add_argument('--output-format', dest='output_format', default='text',
+                        choices=('text', 'jsonl'),
+                        help=('How to print errors: as lines of text, or as one '
+                              'JSON record per line (checker, level, code, file, '
+                              'line, column, end_line, end_column, message)'))
+
+    parser.add_argument('--gc-caches', dest='gc_caches', action='store_true',
+                        help=('Remove old per-branch mypy caches (see '
+                              '--mypy-cache-max-size and --mypy-cache-max-age) from '
+                              'the projects of the given files or directories, or of '
+                              'every project checked so far, and exit. This also '
+                              'happens in the background about once a day'))
+
+    parser.add_argument('--daemon-status', dest='daemon_status', action='store_true',
+                        help=('Report on the mypy daemons started for the projects of '
+                              'the given files or directories, or for every project, '
+                              'and exit'))
+
+    parser.add_argument('--explain-config', dest='explain_config',
+                        action='store_true',
+                        help=('Show the {} files that apply to the given file, '
+                              'the options they set, and exit'.format(CONFIG_FILE_NAME)))
+
+    parser.add_argument('--serve', action='store_true',
+                        help=('Run as a long-lived server, checking files on behalf '
+                              'of clients started with --use-server'))
+    parser.add_argument('--use-server', type=str2bool, default=False,
+                        action='store',
+                        help=('Forward this check to a running pycheckers server, '
+                              'starting one in the background if none is running'))
+    parser.add_argument('--server-socket', dest='server_socket',
+                        default=None, action='store',
+                        help=('Path of the Unix socket the server listens on. Its '
+                              'directory must be accessible only by this user'))
+    parser.add_argument('--server-idle-timeout', dest='server_idle_timeout',
+                        type=int, default=3600, action='store',
+                        help='Seconds without a request before the server exits')
 
+    parser.add_argument('--files-from', dest='files_from', default=None,
+                        action='store',
+                        help=('Also check the files listed, one per line, in this '
+                              'file ("-" for stdin), in batch mode'))
+    parser.add_argument('--file-index', dest='file_index', type=str2bool,
+                        default=True, action='store',
+                        help=('In batch mode, remember the state of each file and the '
+                              'results of checking it, and only re-check files that '
+                              'have changed'))
+    parser.add_argument('--batch-size', dest='batch_size', type=int,
+                        default=200, action='store',
+                        help=('In batch mode, the maximum number of files each '
+                              'checker is run on at once'))
+
+    options = parser.parse_args(argv)
+    options.file = options.files[0] if options.files else None
+    if not (options.file or options.files_from or options.serve or options.print_versions
+            or options.gc_caches or options.daemon_status):
+        parser.error('the following arguments are required: file')
+    return options
+
+
+def is_batch(options):
+    # type: (Namespace) -> bool
+    """Whether we've been asked to check several files at once."""
+    return bool(len(options.files) > 1 or options.files_from or
+                (options.file and os.path.isdir(options.file)))
+
+
+def default_socket_path():
+    # type: () -> str
+    """The socket used by the server, unique per user, Python interpreter and
+    version of this script, so that an upgrade never talks to a stale server."""
+    import hashlib
+    script = os.path.realpath(__file__)
+    ident = '{}\0{}\0{}'.format(script, os.path.getmtime(script), sys.executable)
+    digest = hashlib.sha1(ident.encode('utf-8')).hexdigest()[:12]
+    runtime_dir = os.environ.get('XDG_RUNTIME_DIR')
+    if not runtime_dir:
+        # Somewhere only we can reach, rather than the shared temp directory
+        import tempfile
+        runtime_dir = os.path.join(tempfile.gettempdir(), 'pycheckers-{}'.format(os.getuid()))
+        try:
+            os.mkdir(runtime_dir, 0o700)
+        except OSError:
+            # Already there -- is_private() checks it's ours
+            pass
+    return os.path.join(runtime_dir, 'pycheckers-{}-{}.sock'.format(os.getuid(), digest))
+
+
+def is_private(path):
+    # type: (str) -> bool
+    """Whether `path` exists, belongs to us, and nobody else can use it."""
+    try:
+        st = os.lstat(path)
+    except OSError:
+        return False
+    return st.st_uid == os.getuid() and not st.st_mode & 0o077
+
+
+def peer_uid(conn):
+    # type: (Any) -> Optional[int]
+    """The user id of the process at the other end of the Unix socket
+    `conn`, or None if this platform can't tell us."""
+    import socket
+    import struct
+    if hasattr(socket, 'SO_PEERCRED'):
+        # Linux: struct ucred {pid, uid, gid}
+        creds = conn.getsockopt(socket.SOL_SOCKET, socket.SO_PEERCRED, struct.calcsize('3i'))
+        return struct.unpack('3i', creds)[1]
+    if sys.platform == 'darwin':
+        # LOCAL_PEERCRED (1) at level SOL_LOCAL (0): struct xucred {version, uid, ...}
+        creds = conn.getsockopt(0, 1, struct.calcsize('2I') + 17 * struct.calcsize('I'))
+        return struct.unpack('2I', creds[:struct.calcsize('2I')])[1]
+    return None
 
-def main():
-    # transparently add a virtualenv to the path when launched with a venv'd
-    # python. We can sometimes count on emacs to launch us with the correct
-    # python, but we need to handle being run manually, or with emacs in a
-    # confused state.
-    os.environ['PATH'] = (os.path.dirname(sys.executable) + ':' +
-                          os.environ['PATH'])
 
-    options = parse_args()
+def raw_option(argv, name):
+    # type: (List[str], str) -> Optional[str]
+    """Find the value of option `name` in an unparsed argument list.
+
+    Used by the client, which decides whether to forward a check before paying
+    for the full argument parser."""
+    value = None
+    for i, arg in enumerate(argv):
+        if arg == name and i + 1 < len(argv):
+            value = argv[i + 1]
+        elif arg.startswith(name + '='):
+            value = arg[len(name) + 1:]
+    return value
+
+
+class _FramedWriter(object):
+    """File-like object that sends complete lines to a client, tagged with
+    which stream (stdout or stderr) they were written to."""
+
+    def __init__(self, wfile, tag):
+        # type: (Any, str) -> None
+        self.wfile = wfile
+        self.tag = tag
+        self._partial = ''
+
+    def write(self, text):
+        # type: (str) -> None
+        lines = (self._partial + text).split('\n')
+        self._partial = lines.pop()
+        for line in lines:
+            self.wfile.write((self.tag + line + '\n').encode('utf-8'))
+
+    def flush(self):
+        # type: () -> None
+        if self._partial:
+            self.write('\n')
+        self.wfile.flush()
+
+
+def handle_client(conn):
+    # type: (Any) -> None
+    """Run a single check for a connected client.
+
+    The client sends its argv, working directory and environment as a line of
+    JSON; we reply with its output lines, followed by an exit status line.
+    Checkers run inside the server (see --pylint-in-process and
+    --mypy-resident) get the environment too, but not settings that only take
+    effect when Python starts, such as PYTHONPATH."""
+    import json
+    import traceback
+
+    rfile = conn.makefile('rb')
+    wfile = conn.makefile('wb')
+    request = json.loads(rfile.readline().decode('utf-8'))
+
+    # Claim the file before waiting for our turn, so that we can cancel an
+    # older check of it that is running (or waiting) now
+    registration = None         # type: Optional[RunRegistration]
+    try:
+        options = parse_args(request['argv'])
+    except SystemExit:
+        # Bad arguments -- let run_pycheckers() report that to the client
+        options = None
+    if (options is not None and options.file and options.supersede_runs
+            and not is_batch(options)):
+        registration = RunRegistration(
+            os.path.join(request['cwd'], options.file), options.cache_dir)
+        if not registration.acquire():
+            wfile.write('O{}\nX{}\n'.format(SUPERSEDED_MESSAGE, SUPERSEDED_STATUS)
+                        .encode('utf-8'))
+            wfile.flush()
+            return
+
+    try:
+        with _request_lock:
+            saved_cwd, saved_environ = os.getcwd(), dict(os.environ)
+            saved_stdout, saved_stderr = sys.stdout, sys.stderr
+            sys.stdout = _FramedWriter(wfile, 'O')
+            sys.stderr = _FramedWriter(wfile, 'E')
+            try:
+                os.chdir(request['cwd'])
+                os.environ.clear()
+                os.environ.update(request['env'])
+                code = run_pycheckers(request['argv'], registration)
+            except SystemExit as e:
+                code = e.code if isinstance(e.code, int) else (1 if e.code else 0)
+            except Exception:                   # pylint: disable=broad-except
+                traceback.print_exc()
+                code = 1
+            finally:
+                sys.stdout.flush()
+                sys.stderr.flush()
+                sys.stdout, sys.stderr = saved_stdout, saved_stderr
+                os.chdir(saved_cwd)
+                os.environ.clear()
+                os.environ.update(saved_environ)
+    finally:
+        if registration is not None:
+            registration.release()
+
+    wfile.write('X{}\n'.format(int(code)).encode('utf-8'))
+    wfile.flush()
+
+
+def _handle_client_thread(conn):
+    # type: (Any) -> None
+    try:
+        handle_client(conn)
+    except Exception as e:          # pylint: disable=broad-except
+        print('Error handling client: {}'.format(e), file=sys.stderr)
+    finally:
+        conn.close()
+
+
+def serve(socket_path, idle_timeout):
+    # type: (str, int) -> None
+    """Listen on `socket_path`, running one check at a time.
+
+    Each client is handled in its own thread, so that a new check of a file
+    can cancel an older one that is still running.
+
+    Process-wide caches (checker versions, project roots, etc.) stay warm
+    between requests. The server exits after `idle_timeout` seconds without a
+    request."""
+    import socket
+    global _serving             # pylint: disable=global-statement
+    _serving = True
+
+    if os.path.exists(socket_path):
+        probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            probe.connect(socket_path)
+        except socket.error:
+            # Left behind by a server that died, safe to replace
+            os.unlink(socket_path)
+        else:
+            probe.close()
+            print('A server is already listening on {}'.format(socket_path), file=sys.stderr)
+            return
+
+    if not is_private(os.path.dirname(os.path.abspath(socket_path))):
+        print('Not listening on {}, since others can reach its directory'.format(socket_path),
+              file=sys.stderr)
+        return
+
+    server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    saved_umask = os.umask(0o077)
+    try:
+        server.bind(socket_path)
+    finally:
+        os.umask(saved_umask)
+    server.listen(16)
+    server.settimeout(idle_timeout)
+    try:
+        while True:
+            try:
+                conn, _addr = server.accept()
+            except socket.timeout:
+                if _request_lock.locked():
+                    # Not idle, just running a long check
+                    continue
+                break
+            conn.settimeout(None)
+            uid = peer_uid(conn)
+            if uid is not None and uid != os.getuid():
+                # Requests run commands as us
+                conn.close()
+                continue
+            thread = threading.Thread(target=_handle_client_thread, args=(conn,))
+            thread.daemon = True
+            thread.start()
+    finally:
+        server.close()
+        if os.path.exists(socket_path):
+            os.unlink(socket_path)
+
+
+def start_server(socket_path):
+    # type: (str) -> None
+    """Launch a server in the background, detached from this process."""
+    from subprocess import Popen
+    with open(os.devnull, 'r+') as devnull:
+        Popen([sys.executable, os.path.realpath(__file__), '--serve',
+               '--server-socket', socket_path],
+              stdin=devnull, stdout=devnull, stderr=devnull, close_fds=True,
+              **new_session_kwargs())
+
+
+def run_client(socket_path, argv):
+    # type: (str, List[str]) -> Optional[int]
+    """Forward a check to the server, and echo back its output.
+
+    Returns the exit status, or None if no server could be reached (or it
+    went away before replying), in which case the caller should run the check
+    itself."""
+    import json
+    import socket
+    import stat
+
+    # Requests include our environment, so only send them to our own server
+    if not (is_private(os.path.dirname(os.path.abspath(socket_path))) and
+            is_private(socket_path) and stat.S_ISSOCK(os.lstat(socket_path).st_mode)):
+        return None
+
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(socket_path)
+    except socket.error:
+        sock.close()
+        return None
+
+    try:
+        request = {'argv': argv, 'cwd': os.getcwd(), 'env': dict(os.environ)}
+        sock.sendall((json.dumps(request) + '\n').encode('utf-8'))
+        streams = {'O': sys.stdout, 'E': sys.stderr}
+        replied = False
+        for raw in sock.makefile('rb'):
+            line = raw.decode('utf-8')
+            tag, text = line[:1], line[1:]
+            if tag == 'X':
+                return int(text)
+            streams[tag].write(text)
+            replied = True
+            if text.startswith(STREAM_DONE_FORMAT.split('{')[0]):
+                # Pass streamed results along as they arrive
+                streams[tag].flush()
+    finally:
+        sock.close()
+    if not replied:
+        # The server went away before doing anything, check locally
+        return None
+    # Checking locally now would repeat what the server already printed
+    print('pycheckers server at {} went away mid-check'.format(socket_path),
+          file=sys.stderr)
+    return 1
+
+
+def run_pycheckers(argv=None, registration=None):
+    # type: (Optional[List[str]], Optional[RunRegistration]) -> int
+    """Check a single file as described by `argv`, print the results, and
+    return the exit status.
+
+    `registration` is our claim on the file, if the caller has already made
+    one (see RunRegistration)."""
+    options = parse_args(argv)
+
+    if options.print_versions:
+        if options.file:
+            options = update_options_locally(options)
+            set_path_for_virtualenv(options.file, options.venv_path, options.venv_root,
+                                    options.cache_dir)
+        print_versions(options)
+        return 0
+
+    if options.gc_caches:
+        return gc_caches(options)
+
+    if options.daemon_status:
+        return daemon_status(options)
+
+    if is_batch(options) and not options.explain_config:
+        return run_batch(options)
 
     source_file_path = options.file
     if not os.path.exists(source_file_path):
         raise RuntimeError("Can't find source file %s" % source_file_path)
 
+    if options.explain_config:
+        explain_config(options)
+        return 0
+
     options = update_options_locally(options)
 
-    checkers = options.checkers
+    checker_names, ignore_codes, enable_codes = get_checkers_and_codes(options)
+    set_path_for_virtualenv(source_file_path, options.venv_path, options.venv_root,
+                            options.cache_dir)
+
+    own_registration = None     # type: Optional[RunRegistration]
+    if registration is None and options.supersede_runs:
+        registration = own_registration = RunRegistration(source_file_path, options.cache_dir)
+        if not registration.acquire():
+            # A newer check of this file has already started
+            print(SUPERSEDED_MESSAGE)
+            return SUPERSEDED_STATUS
+    try:
+        return _run_checkers(options, checker_names, ignore_codes, enable_codes,
+                             registration)
+    finally:
+        if own_registration is not None:
+            own_registration.release()
+
+
+def get_checkers_and_codes(options):
+    # type: (Namespace) -> Tuple[List[str], Optional[Tuple[str, ...]], Tuple[str, ...]]
+    """Parse the checkers, ignore codes and enable codes from `options`."""
     ignore_codes = (tuple(c.strip() for c in options.ignore_codes.split(",") if c)
                     if options.ignore_codes is not None else None)
     enable_codes = tuple(c.strip() for c in options.enable_codes.split(",") if c)
-    set_path_for_virtualenv(source_file_path, options.venv_path, options.venv_root)
 
-    checker_names = [checker.strip() for checker in checkers.split(',')]
+    checker_names = [checker.strip() for checker in options.checkers.split(',')]
     try:
         [RUNNERS[checker_name] for checker_name in checker_names]
     except KeyError as e:
         croak(("Unknown checker: {}".format(e),  # pylint: disable=used-before-assignment
                "Expected one of %s" % ', '.join(RUNNERS.keys())),
-              filename=options.file)
-
-    if options.multi_thread:
-        from multiprocessing import Pool, cpu_count
-        p = Pool(cpu_count() + 1)
+              filename=options.file, output_format=options.output_format)
+    return checker_names, ignore_codes, enable_codes
+
+
+def run_checker_on_chunks(ignore_codes, enable_codes, options, chunks, file_index,
+                          checker_name):
+    # type: (Optional[Tuple[str, ...]], Tuple[str, ...], Namespace, List[List[str]], Optional[FileIndex], str) -> Dict[str, Tuple[int, List[str]]]
+    """Run a checker once for each chunk of files, returning the results for
+    each file."""
+    results = {}                # type: Dict[str, Tuple[int, List[str]]]
+    for chunk in chunks:
+        runner = RUNNERS[checker_name](ignore_codes, enable_codes, options)
+        results.update(runner.run_batch(chunk, file_index=file_index))
+    return results
+
+
+def batch_digest(filepaths):
+    # type: (List[str]) -> str
+    """Summarize the state (path, mtime and size) of all the files in a batch."""
+    import hashlib
+    h = hashlib.sha1()
+    for filepath in sorted(os.path.abspath(f) for f in filepaths):
+        try:
+            st = os.stat(filepath)
+        except OSError:
+            continue
+        h.update('{}\0{}\0{}\0'.format(filepath, st.st_mtime, st.st_size).encode('utf-8'))
+    return h.hexdigest()
+
+
+def find_batch_files(options):
+    # type: (Namespace) -> List[str]
+    """List the files to check in batch mode -- those given on the command
+    line and in any --files-from list, with directories replaced by the
+    Python files under them."""
+    paths = list(options.files)
+    if options.files_from:
+        if options.files_from == '-':
+            lines = sys.stdin.read().splitlines()
+        else:
+            with open(options.files_from) as f:
+                lines = f.read().splitlines()
+        paths.extend(line.strip() for line in lines if line.strip())
+
+    filepaths = []
+    for path in paths:
+        if not os.path.isdir(path):
+            if not os.path.exists(path):
+                raise RuntimeError("Can't find source file %s" % path)
+            filepaths.append(path)
+            continue
+        for dir_path, dir_names, file_names in os.walk(path):
+            dir_names[:] = sorted(d for d in dir_names
+                                  if not d.startswith('.') and d != '__pycache__')
+            filepaths.extend(os.path.join(dir_path, file_name)
+                             for file_name in sorted(file_names) if file_name.endswith('.py'))
+    # Drop duplicates, keeping the first
+    seen = set()                # type: Set[str]
+    unique_filepaths = []
+    for filepath in filepaths:
+        if filepath not in seen:
+            seen.add(filepath)
+            unique_filepaths.append(filepath)
+    return unique_filepaths
+
+
+def group_batch_files(options, filepaths):
+    # type: (Namespace, List[str]) -> List[Tuple[Namespace, Optional[str], str, List[str]]]
+    """Group files that can be checked together: those with the same options
+    (after applying any .pycheckers files), virtualenv and project root.
+
+    Returns (options, virtualenv, project root, files) for each group."""
+    import copy
+    groups = []                 # type: List[Tuple[Namespace, Optional[str], str, List[str]]]
+    group_indexes = {}          # type: Dict[Any, int]
+    dir_keys = {}               # type: Dict[str, Any]
+    for filepath in filepaths:
+        dir_path = os.path.dirname(os.path.abspath(filepath))
+        if dir_path not in dir_keys:
+            dir_options = copy.copy(options)
+            dir_options.file = filepath
+            dir_options = update_options_locally(dir_options)
+            entry = discovery_index(dir_options.cache_dir, dir_options.venv_root).lookup(dir_path)
+            venv_path = dir_options.venv_path or entry['venv']
+            key = (repr(sorted((k, v) for k, v in vars(dir_options).items()
+                               if k not in FILE_SELECTION_OPTIONS)),
+                   venv_path, entry['project_root'])
+            if key not in group_indexes:
+                group_indexes[key] = len(groups)
+                groups.append((dir_options, venv_path, entry['project_root'], []))
+            dir_keys[dir_path] = key
+        groups[group_indexes[dir_keys[dir_path]]][3].append(filepath)
+    return groups
+
+
+def run_batch(options):
+    # type: (Namespace) -> int
+    """Check many files, running each checker once per --batch-size files
+    rather than once per file, and print the results file by file."""
+    import hashlib
+    filepaths = find_batch_files(options)
+    digest = batch_digest(filepaths) if options.file_index and not options.debug else None
+    original_path = os.environ['PATH']
+    errors_or_warnings = 0
+    for group_options, venv_path, project_root, group_filepaths in group_batch_files(
+            options, filepaths):
+        checker_names, ignore_codes, enable_codes = get_checkers_and_codes(group_options)
+        os.environ['PATH'] = original_path
+        if venv_path:
+            os.environ['PATH'] = os.path.join(venv_path, 'bin') + ':' + original_path
+
+        batch_size = max(group_options.batch_size, 1)
+        chunks = [group_filepaths[i:i + batch_size]
+                  for i in range(0, len(group_filepaths), batch_size)]
+        file_index = None           # type: Optional[FileIndex]
+        if digest is not None:
+            index_name = hashlib.sha1(project_root.encode('utf-8')).hexdigest() + '.sqlite3'
+            file_index = FileIndex(
+                os.path.join(get_cache_dir(group_options.cache_dir, 'index'), index_name),
+                digest)
+        func = partial(run_checker_on_chunks, ignore_codes, enable_codes, group_options,
+                       chunks, file_index)
+        try:
+            checker_results = list(iter_checker_results(
+                func, checker_names, group_options.multi_thread, in_order=True))
+        finally:
+            if file_index is not None:
+                file_index.close()
+        for filepath in group_filepaths:
+            for results in checker_results:
+                e_or_w, out_lines = results[filepath]
+                errors_or_warnings += e_or_w
+                for line in out_lines:
+                    print(line)
+    os.environ['PATH'] = original_path
+    return int(errors_or_warnings > 0)
+
+
+def _run_checkers(options, checker_names, ignore_codes, enable_codes, registration):
+    # type: (Namespace, List[str], Optional[Tuple[str, ...]], Tuple[str, ...], Optional[RunRegistration]) -> int
+    func = partial(
+        run_named_checker, ignore_codes, enable_codes, options, options.file)
+
+    if registration is not None:
+        registration.running = True
+    # When streaming, results come back in the order the checkers finish
+    outputs = iter_checker_results(
+        func, checker_names, options.multi_thread,
+        in_order=not options.stream_results)  # type: Iterable[Tuple[str, int, List[str]]]
+
+    errors_or_warnings = 0
+    for checker_name, e_or_w, out_lines in outputs:
+        if registration is not None and registration.superseded:
+            # Nobody wants these results any more
+            cancel_running_checkers()
+            print(SUPERSEDED_MESSAGE)
+            return SUPERSEDED_STATUS
+        errors_or_warnings += e_or_w
+        for line in out_lines:
+            print(line)
+        if options.stream_results:
+            print(STREAM_DONE_FORMAT.format(checker=checker_name, count=e_or_w))
+            sys.stdout.flush()
 
-        func = partial(
-            run_one_checker, ignore_codes, enable_codes, options, source_file_path)
+    return int(errors_or_warnings > 0)
 
-        outputs = p.map(func, checker_names, chunksize=1)
-        p.close()
-        p.join()
-        counts, out_lines_list = zip(*outputs)
-        errors_or_warnings = sum(counts)
-    else:
-        errors_or_warnings = 0
-        out_lines_list = []
-        for checker_name in checker_names:
-            e_or_w, o_l = run_one_checker(
-                ignore_codes, enable_codes, options, source_file_path, checker_name)
-            errors_or_warnings += e_or_w
-            out_lines_list.append(o_l)
 
-    for out_lines in out_lines_list:
-        for line in out_lines:
-            print(line)
+def main():
+    # transparently add a virtualenv to the path when launched with a venv'd
+    # python. We can sometimes count on emacs to launch us with the correct
+    # python, but we need to handle being run manually, or with emacs in a
+    # confused state.
+    os.environ['PATH'] = (os.path.dirname(sys.executable) + ':' +
+                          os.environ['PATH'])
 
-    sys.exit(errors_or_warnings > 0)
+    # Don't leave checkers running if we're interrupted
+    import signal
+
+    def on_signal(signum, _frame):
+        # type: (int, Any) -> None
+        cancel_running_checkers()
+        sys.exit(128 + signum)
+    signal.signal(signal.SIGTERM, on_signal)
+    signal.signal(signal.SIGINT, on_signal)
+    # Sent by a newer check of the same file (see RunRegistration)
+    signal.signal(signal.SIGUSR1, lambda _signum, _frame: cancel_runs())
+
+    argv = sys.argv[1:]
+    use_server = raw_option(argv, '--use-server')
+    # The server can't read our stdin
+    if use_server and is_true(use_server) and raw_option(argv, '--files-from') != '-':
+        socket_path = raw_option(argv, '--server-socket') or default_socket_path()
+        status = run_client(socket_path, argv)
+        if status is not None:
+            sys.exit(status)
+        # No server yet -- start one for next time, and check this file ourselves
+        start_server(socket_path)
+
+    if '--serve' in argv:
+        options = parse_args(argv)
+        serve(options.server_socket or default_socket_path(), options.server_idle_timeout)
+        sys.exit(0)
+
+    sys.exit(run_pycheckers(argv))
 
 
 if __name__ == '__main__':
@@ -33,6 +33,7 @@
 ;; - pyflakes
 ;; - mypy (for both Python 2 and 3)
 ;; - bandit
+;; - ruff
 ;;
 ;; This is an alternative way of running multiple Python syntax checkers in
 ;; Flycheck that doesn't depend on Flycheck's chaining mechanism.
@@ -103,7 +104,8 @@
 ;;   `.pycheckers' file described below.
 ;;
 ;; * `flycheck-pycheckers-max-line-length' - the default maximum line
-;;   length.  Can be overridden via `.pycheckers' file.
+;;   length.  Can be overridden via `.pycheckers' file.  When unset, 79 is
+;;   used, except by ruff, which uses the one in its own config file if any.
 ;;
 ;; * `flycheck-pycheckers-multi-thread' - whether to run each checker
 ;;   simultaneously in its own thread, for performance.
@@ -111,10 +113,24 @@
 ;; * `flycheck-pycheckers-venv-root' - a directory containing Python virtual
 ;;   environments, so that imports may be found.
 ;;
+;; * `flycheck-pycheckers-stream-results' - whether to highlight each
+;;   checker's results as soon as it finishes, rather than waiting for the
+;;   slowest one.
+;;
+;; * `flycheck-pycheckers-use-server' - whether to hand checks to a persistent
+;;   `pycheckers.py --serve' process (started automatically), avoiding startup
+;;   costs on every check.
+;;
+;; * `flycheck-pycheckers-output-format' - whether `pycheckers.py' reports
+;;   errors as lines of text, or as one JSON record per line (`jsonl'), which
+;;   is cheaper and more reliable to parse for files with many errors.
+;;
 ;; Additionally, a `.pycheckers' file may be created in a directory to control
 ;; options for every file under this directory.  These files may be logically
 ;; combined, so a project may have one set of options that may be selectively
-;; overridden in a specific subdirectory.
+;; overridden in a specific subdirectory.  To see which files apply to a
+;; given file, and what they set, run `bin/pycheckers.py --explain-config
+;; <file>'.
 ;;
 ;; Example .pycheckers file:
 ;;
@@ -158,9 +174,60 @@
 ;;
 ;; * `flake8_config_file' - the location of a project-specific configuration file
 ;;   for flake8
+;;
+;; * `ruff_config_file' - the location of a project-specific configuration file
+;;   for ruff.  By default, ruff finds its own (`pyproject.toml', `ruff.toml')
+;;
+;; * `pylint_in_process' - when using a server
+;;   (`flycheck-pycheckers-use-server'), run pylint inside it, so modules
+;;   imported by the files being checked are only parsed again when they change
+;;
+;; * `mypy_resident' - when using a server, and not mypy's daemon, keep each
+;;   project's mypy build in memory between checks, so that only what has
+;;   changed is checked again.  Unsaved changes in the buffer being checked
+;;   are seen, as they are without it
+;;
+;; * `mypy_seed_cache' - mypy's cache is kept per VCS branch, under
+;;   `.mypy_cache/branches'.  When a branch has none yet, start it off with a
+;;   copy (hardlinked where possible) of that of the branch it was created
+;;   from, or else of `master'/`main', or of the branch checked last, so that
+;;   only what differs is checked again.  On by default
+;;
+;; * `mypy_cache_max_size', `mypy_cache_max_age' - about once a day,
+;;   pycheckers removes per-branch mypy caches that haven't been used for
+;;   `mypy_cache_max_age' days (30 by default), then the least recently used
+;;   until they take up no more than `mypy_cache_max_size' megabytes (5120 by
+;;   default) in each project.  The current branch's cache is never removed.
+;;   This happens in the background, or can be done with `pycheckers.py
+;;   --gc-caches [file or directory...]'
+;;
+;; * `mypy_daemon_warm_up' - with `mypy_use_daemon', when the project's daemon
+;;   isn't running, start it in the background and say it's warming up, rather
+;;   than waiting while it checks the whole project.  A daemon started by
+;;   pycheckers is restarted when its options, config file or files (from
+;;   `mypy_daemon_files_command') change.  On by default.  `pycheckers.py
+;;   --daemon-status [file or directory...]' reports on each project's daemon
+;;
+;; Checking many files at once:
+;;
+;; `pycheckers.py' can also check whole directories, or a list of files (one
+;; per line, with `--files-from', or `--files-from -' for stdin), applying the
+;; same `.pycheckers' files as it would in Emacs.  Each checker is run once per
+;; `--batch-size' files, rather than once per file, which makes this usable in
+;; CI:
+;;
+;;     bin/pycheckers.py -c flake8,pylint src tests
+;;     git ls-files '*.py' | bin/pycheckers.py -c flake8 --files-from -
+;;
+;; Batch runs keep an index of each file's state and results per project, so
+;; later runs only re-check files that have changed (or, for checkers like
+;; pylint and mypy whose results depend on other files, re-check everything
+;; once anything has changed).  Use `--file-index false' to disable this.
 
 ;;; Code:
 (require 'flycheck)
+(require 'json)
+(require 'let-alist)
 
 (defvar flycheck-pycheckers-command
   (executable-find (concat (file-name-directory (or load-file-name buffer-file-name))
@@ -184,7 +251,8 @@
           (const :tag "pyflakes" pyflakes)
           (const :tag "mypy 2" mypy2)
           (const :tag "mypy 3" mypy3)
-          (const :tag "bandit" bandit)))
+          (const :tag "bandit" bandit)
+          (const :tag "ruff" ruff)))
 
 (flycheck-def-option-var flycheck-pycheckers-ignore-codes
     '("C0411" "C0413" "C0103" "C0111" "W0142" "W0201" "W0232" "W0403" "W0511"
@@ -215,10 +283,14 @@ for example.  Can be further customized via the \".pycheckers\"
 config file."
   :type '(repeat :tag "Codes" (string :tag "Error/Warning code")))
 
-(flycheck-def-option-var flycheck-pycheckers-max-line-length 79
+(flycheck-def-option-var flycheck-pycheckers-max-line-length nil
   python-pycheckers
-  "The maximum line length allowed by the checkers."
-  :type 'integer)
+  "The maximum line length allowed by the checkers.
+
+When nil, the checkers use 79, except for ruff, which uses the
+one from its own config file if it has one."
+  :type '(choice (const :tag "Checkers' default" nil)
+                 (integer :tag "Maximum line length")))
 
 (flycheck-def-option-var flycheck-pycheckers-multi-thread "true"
     python-pycheckers
@@ -231,6 +303,39 @@ config file."
    "Directory containing the collection of virtual environments."
    :type 'string)
 
+(flycheck-def-option-var flycheck-pycheckers-use-server "false"
+   python-pycheckers
+   "Whether to run checks in a persistent pycheckers server.
+
+When enabled, `pycheckers.py' forwards each check to a long-lived
+server process listening on a local socket, starting one in the
+background if none is running yet.  This avoids paying Python
+and checker startup costs on every check."
+   :type '(radio (const :tag "Yes" "true")
+           (const :tag "No" "false")))
+
+(flycheck-def-option-var flycheck-pycheckers-output-format "text"
+   python-pycheckers
+   "How `pycheckers.py' reports errors.
+
+Text lines are matched against `:error-patterns', which can be
+confused by messages that themselves contain \" at \" or
+\"line\".  JSON Lines output (one record per error) avoids this,
+and is faster to parse for files with thousands of errors."
+   :type '(radio (const :tag "Text" "text")
+           (const :tag "JSON Lines" "jsonl")))
+
+(flycheck-def-option-var flycheck-pycheckers-stream-results "false"
+   python-pycheckers
+   "Whether to show each checker's results as soon as it finishes.
+
+Fast checkers (e.g. pyflakes) usually finish long before slow
+ones (e.g. pylint or mypy).  When enabled, their errors are
+highlighted right away, and replaced by the complete set of
+errors once every checker is done."
+   :type '(radio (const :tag "Yes" "true")
+           (const :tag "No" "false")))
+
 (flycheck-def-option-var flycheck-pycheckers-report-errors-inline "true"
    python-pycheckers
    "Whether to splice failing checkers' STDERR inline with other errors.
@@ -242,6 +347,60 @@ this will report the error in the `flycheck-list-errors' buffer."
    :type '(radio (const :tag "Yes" "true")
            (const :tag "No" "false")))
 
+(defconst flycheck-pycheckers--levels
+  '(("ERROR" . error) ("WARNING" . warning) ("INFO" . info))
+  "Maps the levels printed by pycheckers.py to flycheck's.")
+
+(defun flycheck-pycheckers--parse-jsonl (output checker buffer)
+  "Parse OUTPUT from CHECKER in BUFFER, as printed with `--output-format=jsonl'.
+
+Each line holding a JSON record is one error.  Other lines (e.g.
+the terminators printed when streaming) are skipped."
+  (let ((json-object-type 'alist)
+        (json-array-type 'list)
+        (json-key-type 'symbol)
+        errors)
+    (dolist (line (split-string output "\n" t))
+      (when (string-prefix-p "{" line)
+        (let ((record (ignore-errors (json-read-from-string line))))
+          (when record
+            (let-alist record
+              (push (flycheck-error-new-at
+                     (or .line 1) .column
+                     (or (cdr (assoc .level flycheck-pycheckers--levels)) 'error)
+                     ;; Say which checker found what, as the text output does
+                     (format "%s: %s" .checker .message)
+                     :id .code
+                     :checker checker
+                     :buffer buffer
+                     :filename .file
+                     :end-line .end_line
+                     :end-column .end_column)
+                    errors))))))
+    (nreverse errors)))
+
+(defvar-local flycheck-pycheckers--last-errors nil
+  "The errors found by the last check of this buffer that finished.")
+
+(defun flycheck-pycheckers--parse-errors (output checker buffer)
+  "Parse OUTPUT from CHECKER in BUFFER, in whichever format it was printed."
+  (if (string-match-p "^{" output)
+      (flycheck-pycheckers--parse-jsonl output checker buffer)
+    (flycheck-parse-with-patterns output checker buffer)))
+
+(defun flycheck-pycheckers--parse-output (output checker buffer)
+  "Parse OUTPUT from CHECKER in BUFFER, remembering the errors found.
+
+A check that gave up because a newer check of the same file
+started has no results of its own; return the errors from the
+last check instead, so that they are kept rather than cleared."
+  (with-current-buffer buffer
+    (if (string-match-p "^pycheckers-superseded$" output)
+        (copy-sequence flycheck-pycheckers--last-errors)
+      (setq flycheck-pycheckers--last-errors
+            (flycheck-pycheckers--parse-errors output checker buffer))
+      (copy-sequence flycheck-pycheckers--last-errors))))
+
 (flycheck-define-command-checker 'python-pycheckers
   "Multiple python syntax checker.
 
@@ -266,6 +425,9 @@ per-directory."
              (option "--multi-thread" flycheck-pycheckers-multi-thread)
              (option "--venv-root" flycheck-pycheckers-venv-root)
              (option "--report-checker-errors-inline" flycheck-pycheckers-report-errors-inline)
+             (option "--use-server" flycheck-pycheckers-use-server)
+             (option "--stream-results" flycheck-pycheckers-stream-results)
+             (option "--output-format" flycheck-pycheckers-output-format)
              (eval (when (and (boundp 'poetry-project-venv)
                               poetry-project-venv)
                      (concat "--venv-path" poetry-project-venv)))
@@ -283,11 +445,49 @@ per-directory."
     (info line-start
      "INFO " (optional (id (one-or-more (not (any ":"))))) ":"
      (message) " at " (file-name) " line " line (optional "," column) "." line-end))
+  :error-parser #'flycheck-pycheckers--parse-output
   :modes '(python-mode python-ts-mode))
 
+(defconst flycheck-pycheckers--done-regexp
+  "^pycheckers-done: \\([^ \n]+\\) \\([0-9]+\\)\n"
+  "Matches the line printed after each checker's results when streaming.")
+
+(defun flycheck-pycheckers--show-partial-errors (errors)
+  "Highlight ERRORS from a checker that finished early.
+
+The overlays are marked for deletion, so they are replaced by
+the final results once all checkers are done."
+  (let ((file-names (when (buffer-file-name)
+                      (let ((name (file-name-nondirectory (buffer-file-name))))
+                        (list name (concat "flycheck_" name))))))
+    (dolist (err errors)
+      (let ((file-name (flycheck-error-filename err)))
+        (when (or (null file-name)
+                  (member (file-name-nondirectory file-name) file-names))
+          (push (flycheck-add-overlay err) flycheck-overlays-to-delete))))))
+
+(defun flycheck-pycheckers--receive-output (process output)
+  "Show results from PROCESS as each checker finishes.
+
+OUTPUT is the latest chunk of output received.  This only has an
+effect when `flycheck-pycheckers-stream-results' is enabled, since
+otherwise pycheckers.py prints no per-checker terminator lines."
+  (when (eq (process-get process 'flycheck-checker) 'python-pycheckers)
+    (let ((pending (concat (process-get process 'flycheck-pycheckers-pending) output))
+          (buffer (process-get process 'flycheck-buffer)))
+      (while (string-match flycheck-pycheckers--done-regexp pending)
+        (let ((finished (substring pending 0 (match-beginning 0))))
+          (setq pending (substring pending (match-end 0)))
+          (when (buffer-live-p buffer)
+            (with-current-buffer buffer
+              (flycheck-pycheckers--show-partial-errors
+               (flycheck-pycheckers--parse-errors finished 'python-pycheckers buffer))))))
+      (process-put process 'flycheck-pycheckers-pending pending))))
+
 (defun flycheck-pycheckers-unsetup ()
   "Utility function, used for testing only."
   (interactive)
+  (advice-remove 'flycheck-receive-checker-output #'flycheck-pycheckers--receive-output)
   (setq flycheck-checkers (remove 'python-pycheckers flycheck-checkers)))
 
 ;;;###autoload
@@ -296,7 +496,8 @@ per-directory."
   (interactive)
   ;; *Pre*pend this to 'flycheck-checkers, since we want to use this in
   ;; *preference to all other checkers
-  (add-to-list 'flycheck-checkers 'python-pycheckers))
+  (add-to-list 'flycheck-checkers 'python-pycheckers)
+  (advice-add 'flycheck-receive-checker-output :after #'flycheck-pycheckers--receive-output))
 
 (provide 'flycheck-pycheckers)
 ;;; flycheck-pycheckers.el ends here
@@ -0,0 +1,328 @@
+#!/usr/bin/env python3
+"""Tests for pycheckers.py.
+
+Each test works in a scratch project of its own, and runs pycheckers.py
+either in-process or as flycheck would, as a script.
+
+Usage: python -m unittest discover tests
+"""
+
+from __future__ import absolute_import, division, print_function
+
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import unittest
+
+MYPY = False
+if MYPY:
+    from typing import Dict, List, Tuple  # pylint: disable=unused-import
+
+BIN_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'bin')
+SCRIPT = os.path.join(BIN_DIR, 'pycheckers.py')
+sys.path.insert(0, BIN_DIR)
+
+import pycheckers  # noqa: E402  pylint: disable=wrong-import-position
+
+# A checker that starts a child of its own, which keeps its output open
+SLOW_WRAPPER = "sh -c 'sleep 30; echo done'"
+
+
+class ProjectTestCase(unittest.TestCase):
+    """Runs each test in a new project directory, with its own cache."""
+
+    def setUp(self):
+        # type: () -> None
+        self.root = os.path.realpath(tempfile.mkdtemp(prefix='pycheckers-test-'))
+        self.addCleanup(shutil.rmtree, self.root, True)
+        os.mkdir(os.path.join(self.root, '.git'))
+        self.cache_dir = os.path.join(self.root, '.cache')
+
+    def write(self, relpath, text):
+        # type: (str, str) -> str
+        path = os.path.join(self.root, relpath)
+        if not os.path.isdir(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        with open(path, 'w') as f:
+            f.write(text)
+        return path
+
+    def fake_checker(self, command, script):
+        # type: (str, str) -> None
+        """Put an executable `command` running the shell `script` on the PATH
+        of run_script()."""
+        path = self.write(os.path.join('.bin', command), '#!/bin/sh\n' + script)
+        os.chmod(path, 0o755)
+
+    def run_script(self, args, cwd=None):
+        # type: (List[str], str) -> Tuple[int, str, str, float]
+        """Run pycheckers.py, returning its exit status, stdout, stderr and how
+        long it took."""
+        start = time.time()
+        env = dict(os.environ)
+        env['PATH'] = os.path.join(self.root, '.bin') + os.pathsep + env.get('PATH', '')
+        process = subprocess.Popen(
+            [sys.executable, SCRIPT, '--cache-dir', self.cache_dir] + args,
+            stdout=subprocess.PIPE, stderr=subprocess.PIPE, cwd=cwd or self.root,
+            universal_newlines=True, env=env)
+        out, err = process.communicate()
+        return process.returncode, out, err, time.time() - start
+
+
+class CheckerKillTest(ProjectTestCase):
+    """Killed checkers shouldn't be waited for, even when processes they
+    started are still running."""
+
+    def test_timeout_with_grandchild(self):
+        # type: () -> None
+        self.write('.pycheckers', '[DEFAULT]\npyflakes_command = {}\n'.format(SLOW_WRAPPER))
+        self.write('a.py', 'x = 1\n')
+        _status, out, _err, duration = self.run_script(
+            ['-c', 'pyflakes', '--checker-timeout', '1', 'a.py'])
+        self.assertLess(duration, 10)
+        self.assertIn('Checker timed out after 1.0 seconds', out)
+
+    def test_cancel_with_grandchild(self):
+        # type: () -> None
+        process = subprocess.Popen(['sh', '-c', 'sleep 30; echo done'],
+                                   stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                                   universal_newlines=True)
+        threading.Timer(0.5, pycheckers.cancel_running_checkers).start()
+        start = time.time()
+        timed_out, _err = pycheckers.wait_for_checker(process, None, lambda _output: None)
+        self.assertLess(time.time() - start, 10)
+        self.assertFalse(timed_out)
+        self.assertLess(process.returncode, 0)
+
+
+class ResultCacheTest(ProjectTestCase):
+    """Only results from checkers that ran to completion are cached."""
+
+    def test_timeout_not_cached(self):
+        # type: () -> None
+        # Slow the first time it checks something, and quick after that
+        self.fake_checker('pyflakes', (
+            'if [ "$1" = --version ]; then echo 3.0.0; exit; fi\n'
+            'if [ -e {0}/ran ]; then echo "$1:1: \'os\' imported but unused"; exit 1; fi\n'
+            'touch {0}/ran; sleep 30\n').format(self.root))
+        self.write('a.py', 'import os\n')
+        args = ['-c', 'pyflakes', '--checker-timeout', '1', 'a.py']
+        _status, out, _err, _duration = self.run_script(args)
+        self.assertIn('Checker timed out', out)
+        _status, out, _err, _duration = self.run_script(args)
+        self.assertNotIn('Checker timed out', out)
+        self.assertIn('imported but unused', out)
+
+
+class FileIndexTest(ProjectTestCase):
+    """Results replayed from the batch file index."""
+
+    def test_other_working_directory(self):
+        # type: () -> None
+        self.fake_checker('pyflakes', (
+            'if [ "$1" = --version ]; then echo 3.0.0; exit; fi\n'
+            'echo run >> {}/runs\n'
+            'for f in "$@"; do echo "$f:1: \'os\' imported but unused"; done\n'
+            'exit 1\n').format(self.root))
+        self.write('src/a.py', 'import os\n')
+        self.write('src/b.py', 'import os\n')
+        args = ['-c', 'pyflakes', '--file-index', 'true']
+        _status, out, _err, _duration = self.run_script(args + ['src/a.py', 'src/b.py'])
+        self.assertIn(' at src/a.py line 1.', out)
+        _status, out, _err, _duration = self.run_script(
+            args + ['a.py', 'b.py'], cwd=os.path.join(self.root, 'src'))
+        self.assertIn(' at a.py line 1.', out)
+        self.assertNotIn('src/', out)
+        _status, out, _err, _duration = self.run_script(
+            args + ['--output-format', 'jsonl', 'a.py', 'b.py'],
+            cwd=os.path.join(self.root, 'src'))
+        self.assertIn('"file":"a.py"', out)
+        # Only the first run, and the first in jsonl, checked anything
+        with open(os.path.join(self.root, 'runs')) as f:
+            self.assertEqual(len(f.readlines()), 2)
+
+
+class PylintBatchTest(ProjectTestCase):
+    """Pylint's exit status, when checking several files at once."""
+
+    def check(self, exit_status):
+        # type: (int) -> Dict[str, Tuple[int, List[str]]]
+        """Check two files with a pylint that has a fatal error in one of them
+        and exits with `exit_status`, returning the results."""
+        self.fake_checker('pylint', (
+            'if [ "$1" = --version ]; then echo "pylint 3.0.0"; exit; fi\n'
+            'for f in "$@"; do case "$f" in\n'
+            '  *bad.py) echo "$f:1:0: [F0002(astroid-error)] $f: Fatal error";;\n'
+            'esac; done\n'
+            'exit {}\n').format(exit_status))
+        # In-process, since pycheckers.py puts its own Python's pylint first
+        # on PATH when run as a script
+        original_path = os.environ['PATH']
+        os.environ['PATH'] = os.path.join(self.root, '.bin') + os.pathsep + original_path
+        self.addCleanup(os.environ.__setitem__, 'PATH', original_path)
+        filepaths = [self.write('bad.py', 'x = 1\n'), self.write('good.py', 'x = 1\n')]
+        options = pycheckers.parse_args(['--cache-dir', self.cache_dir, '-c', 'pylint']
+                                        + filepaths)
+        return pycheckers.PylintRunner(None, (), options).run_batch(filepaths)
+
+    def test_fatal_error(self):
+        # type: () -> None
+        results = self.check(1)
+        bad_lines = results[os.path.join(self.root, 'bad.py')][1]
+        self.assertEqual(len(bad_lines), 1)
+        self.assertIn('ERROR F0002', bad_lines[0])
+        self.assertEqual(results[os.path.join(self.root, 'good.py')], (0, []))
+
+    def test_usage_error(self):
+        # type: () -> None
+        results = self.check(32)
+        _e_or_w, good_lines = results[os.path.join(self.root, 'good.py')]
+        self.assertIn('Checker indicated failure', good_lines[0])
+
+
+@unittest.skipUnless(pycheckers.find_executable('ruff'), 'ruff is not installed')
+class RuffConfigTest(ProjectTestCase):
+    """Ruff's own config is found the way ruff finds it."""
+
+    def test_nested_config(self):
+        # type: () -> None
+        self.write('sub/ruff.toml', 'line-length = 120\n')
+        self.write('sub/a.py', 'X = "{}"\n'.format('x' * 100))
+        args = ['-c', 'ruff', '-e', 'E501', 'sub/a.py']
+        _status, out, _err, _duration = self.run_script(args)
+        self.assertNotIn('E501', out)
+        # Changing it invalidates cached results
+        self.write('sub/ruff.toml', 'line-length = 80\n')
+        _status, out, _err, _duration = self.run_script(args)
+        self.assertIn('E501', out)
+
+
+class DiscoveryIndexTest(ProjectTestCase):
+    """Project roots remembered between runs."""
+
+    def lookup(self, directory):
+        # type: (str) -> dict
+        """Look `directory` up, as a new run would."""
+        index = pycheckers.DiscoveryIndex(self.cache_dir, os.path.join(self.root, 'venvs'))
+        return index.lookup(directory)
+
+    def test_flycheck_copy(self):
+        # type: () -> None
+        src_dir = os.path.dirname(self.write('src/a.py', 'x = 1\n'))
+        entry = self.lookup(src_dir)
+        self.assertEqual(entry['project_root'], self.root)
+        index_path = pycheckers.DiscoveryIndex(
+            self.cache_dir, os.path.join(self.root, 'venvs')).path
+        saved_mtime = os.stat(index_path).st_mtime
+        # As flycheck does for every check, changing the directory's mtime
+        time.sleep(0.01)
+        self.write('src/flycheck_a.py', 'x = 2\n')
+        os.unlink(os.path.join(src_dir, 'flycheck_a.py'))
+        self.assertEqual(self.lookup(src_dir)['time'], entry['time'])
+        self.assertEqual(os.stat(index_path).st_mtime, saved_mtime)
+
+    def test_new_vcs_root(self):
+        # type: () -> None
+        src_dir = os.path.dirname(self.write('src/a.py', 'x = 1\n'))
+        self.assertEqual(self.lookup(src_dir)['project_root'], self.root)
+        os.mkdir(os.path.join(src_dir, '.git'))
+        self.assertEqual(self.lookup(src_dir)['project_root'], src_dir)
+
+
+class ConfigChainTest(ProjectTestCase):
+    """Config files found above checked files, remembered between runs."""
+
+    def find(self, directory):
+        # type: (str) -> dict
+        """Find the chain for `directory`, as a new run would."""
+        pycheckers._config_chain_cache.clear()  # pylint: disable=protected-access
+        return pycheckers.find_config_chain(directory, True, self.cache_dir)
+
+    def test_flycheck_copy(self):
+        # type: () -> None
+        self.write('.pycheckers', '[DEFAULT]\nmax_line_length = 100\n')
+        src_dir = os.path.dirname(self.write('src/a.py', 'x = 1\n'))
+        chain = self.find(src_dir)
+        cache_path = os.path.join(self.cache_dir, 'configs.json')
+        saved_mtime = os.stat(cache_path).st_mtime
+        time.sleep(0.01)
+        self.write('src/flycheck_a.py', 'x = 2\n')
+        os.unlink(os.path.join(src_dir, 'flycheck_a.py'))
+        self.assertEqual(self.find(src_dir)['time'], chain['time'])
+        self.assertEqual(os.stat(cache_path).st_mtime, saved_mtime)
+
+    def test_new_config_file(self):
+        # type: () -> None
+        src_dir = os.path.dirname(self.write('src/a.py', 'x = 1\n'))
+        self.assertEqual(self.find(src_dir)['configs'], [])
+        self.write('src/.pycheckers', '[DEFAULT]\nmax_line_length = 100\n')
+        self.assertEqual(len(self.find(src_dir)['configs']), 1)
+
+    def test_bounded(self):
+        # type: () -> None
+        original_limit = pycheckers.MAX_CACHED_CONFIG_CHAINS
+        pycheckers.MAX_CACHED_CONFIG_CHAINS = 4
+        self.addCleanup(setattr, pycheckers, 'MAX_CACHED_CONFIG_CHAINS', original_limit)
+        for i in range(10):
+            self.find(os.path.dirname(self.write('d{}/a.py'.format(i), 'x = 1\n')))
+        chains = pycheckers.read_json(os.path.join(self.cache_dir, 'configs.json'))
+        self.assertLessEqual(len(chains), 4)
+        self.assertTrue(any(key.startswith(os.path.join(self.root, 'd9')) for key in chains))
+
+
+class ServerSocketTest(ProjectTestCase):
+    """Checks are only sent to a server that belongs to us."""
+
+    def listen(self, socket_path):
+        # type: (str) -> List[str]
+        """Accept connections on `socket_path` in the background, returning
+        the list that requests received are added to."""
+        import socket
+        server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        server.bind(socket_path)
+        os.chmod(socket_path, 0o600)
+        server.listen(1)
+        server.settimeout(5)
+        self.addCleanup(server.close)
+        received = []           # type: List[str]
+
+        def accept():
+            # type: () -> None
+            try:
+                conn, _addr = server.accept()
+            except socket.timeout:
+                return
+            received.append(conn.makefile('rb').readline().decode('utf-8'))
+            conn.sendall(b'X0\n')
+            conn.close()
+        thread = threading.Thread(target=accept)
+        thread.daemon = True
+        thread.start()
+        return received
+
+    def test_shared_directory(self):
+        # type: () -> None
+        shared_dir = os.path.join(self.root, 'shared')
+        os.mkdir(shared_dir)
+        os.chmod(shared_dir, 0o777)
+        received = self.listen(os.path.join(shared_dir, 'server.sock'))
+        status = pycheckers.run_client(os.path.join(shared_dir, 'server.sock'), ['a.py'])
+        self.assertIsNone(status)
+        self.assertEqual(received, [])
+
+    def test_private_directory(self):
+        # type: () -> None
+        private_dir = os.path.join(self.root, 'private')
+        os.mkdir(private_dir, 0o700)
+        received = self.listen(os.path.join(private_dir, 'server.sock'))
+        status = pycheckers.run_client(os.path.join(private_dir, 'server.sock'), ['a.py'])
+        self.assertEqual(status, 0)
+        self.assertEqual(len(received), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()